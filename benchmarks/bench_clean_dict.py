@@ -0,0 +1,94 @@
+import argparse
+import copy
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from src.tomobabel.models.tomo_images import MovieStackSet
+from src.tomobabel.utils import NumpyEncoder, clean_dict
+
+"""Compare clean_dict with the JSON round trip it replaced
+
+The movie collection fixtures bundled with the tests (about 2 MB of JSON each) are
+validated as MovieStackSets and dumped with model_dump(), which gives dicts holding
+the transformation matrices as NumPy arrays.  These are cleaned by:
+
+- json_round_trip: json.dumps with NumpyEncoder then json.loads, how clean_dict used
+  to work
+- clean_dict: the direct conversion, which copies the dicts and lists
+- clean_dict_in_place: the direct conversion, updating the dumped data
+
+The results are checked to be the same.
+
+    python -m benchmarks.bench_clean_dict --repeats 5
+"""
+
+TEST_DATA = Path(__file__).parents[1] / "tests/converters/relion/test_data"
+
+
+def json_round_trip(data: Dict[str, Any]) -> Dict[str, Any]:
+    return json.loads(json.dumps(data, cls=NumpyEncoder))
+
+
+def load_fixture(json_file: Path) -> Dict[str, Any]:
+    """Get the model_dump() data for the movie sets in a fixture"""
+    with open(json_file) as f:
+        fixture = json.load(f)
+    return {k: MovieStackSet.model_validate(v).model_dump() for k, v in fixture.items()}
+
+
+def time_cleaner(
+    cleaner: Callable[[Dict[str, Any]], Any], data: Dict[str, Any], repeats: int
+) -> float:
+    """Get the best time to clean the data, each repeat cleans a fresh copy"""
+    best = float("inf")
+    for _ in range(repeats):
+        fresh = copy.deepcopy(data)
+        start = time.perf_counter()
+        cleaner(fresh)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def get_arguments() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark clean_dict")
+    parser.add_argument("--repeats", type=int, default=5, help="Best of n repeats")
+    return parser
+
+
+def main(in_args=None) -> List[Dict[str, Any]]:
+    if in_args is None:
+        in_args = sys.argv[1:]
+    args = get_arguments().parse_args(in_args)
+    cleaners: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+        "json_round_trip": json_round_trip,
+        "clean_dict": clean_dict,
+        "clean_dict_in_place": lambda x: clean_dict(x, in_place=True),
+    }
+
+    print(f"{'fixture':<40}{'cleaner':>22}{'time':>10}{'speedup':>9}")
+    results = []
+    for json_file in sorted(TEST_DATA.glob("*_all_movie_cols*.json")):
+        data = load_fixture(json_file)
+        expected = json.dumps(json_round_trip(data))
+        assert json.dumps(clean_dict(data)) == expected
+        assert json.dumps(clean_dict(copy.deepcopy(data), in_place=True)) == expected
+
+        baseline = None
+        for name, cleaner in cleaners.items():
+            seconds = time_cleaner(cleaner, data, args.repeats)
+            baseline = seconds if baseline is None else baseline
+            results.append(
+                {"fixture": json_file.name, "cleaner": name, "seconds": seconds}
+            )
+            print(
+                f"{json_file.name:<40}{name:>22}{seconds * 1000:>8.1f}ms"
+                f"{baseline / seconds:>8.1f}x"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import argparse
+import itertools
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.synthetic_project import STAGES, write_project
+
+"""Measure how the RELION converters scale with the size of a project
+
+Synthetic projects (see :mod:`benchmarks.synthetic_project`) are written for every
+combination of the sizes requested, and each converter is run on them:
+
+- tilt_series: relion_convert_tilt_series.main, writing a pair of files per tilt series
+- dataset: relion_converter.main, writing a single DataSet file
+
+Every conversion is run in a fresh process, so the peak RSS reported is for that
+conversion alone.  The RSS after the modules are imported is reported as well, the
+difference is the memory used by the conversion.  On Linux the peak is reset after the
+imports, elsewhere it can include memory used while importing.  Throughput is in movie
+frames per second, the time includes writing the output.
+
+Arguments after -- are passed to both converters, EG: to compare options
+
+    python -m benchmarks.bench_conversion --n_tilt_series 10 100 --n_frames 8 40
+    python -m benchmarks.bench_conversion --n_frames 400 -- --compact_movies -j 4
+
+Use --json to save the results so they can be compared between versions.
+"""
+
+TARGETS = ("tilt_series", "dataset")
+
+
+def _read_proc_status(field: str) -> Optional[float]:
+    """Get a memory size from /proc/self/status in MB, None if it is not available"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss() -> None:
+    """Reset the peak RSS of this process to its current RSS, if the OS allows it
+
+    Without this the peak includes the memory briefly used while importing pydantic
+    and building the model schemas, which can be more than a small conversion uses.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _current_rss_mb() -> float:
+    """Get the RSS of this process in MB"""
+    current = _read_proc_status("VmRSS")
+    return _peak_rss_mb() if current is None else current
+
+
+def _peak_rss_mb() -> float:
+    """Get the peak RSS of this process in MB"""
+    peak = _read_proc_status("VmHWM")
+    if peak is not None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def run_conversion(
+    target: str, project_dir: Path, starfile: Path, extra_args: List[str]
+) -> Dict[str, float]:
+    """Run a converter on a project and measure it
+
+    This changes the working dir to the project dir, so it should be run in its own
+    process.
+
+    Args:
+        target (str): Which converter to run, one of :data:`TARGETS`
+        project_dir (Path): The project dir
+        starfile (Path): The tilt series group STAR file, relative to project_dir
+        extra_args (List[str]): Extra args for the converter
+
+    Returns:
+        Dict[str, float]: The time in seconds, the peak RSS and the RSS before the
+            conversion in MB, and the size of the output in bytes
+    """
+    from src.tomobabel.converters.relion import relion_convert_tilt_series
+    from src.tomobabel.converters.relion import relion_converter
+
+    os.chdir(project_dir)
+    outdir = Path(tempfile.mkdtemp(prefix="bench_out_", dir="."))
+    main: Callable[[List[str]], Any]
+    if target == "tilt_series":
+        main = relion_convert_tilt_series.main
+        args = ["--input_starfile", str(starfile), "--output", f"{outdir}/"]
+    elif target == "dataset":
+        main = relion_converter.main
+        args = [
+            "--tilt_series_starfile",
+            str(starfile),
+            "--output",
+            str(outdir / "dataset.json"),
+        ]
+    else:
+        raise ValueError(f"Unknown target {target}, choose from {TARGETS}")
+
+    _reset_peak_rss()
+    base_rss = _current_rss_mb()
+    start = time.perf_counter()
+    main(in_args=args + extra_args)
+    seconds = time.perf_counter() - start
+    output_bytes = sum(x.stat().st_size for x in outdir.rglob("*") if x.is_file())
+    shutil.rmtree(outdir)
+    return {
+        "seconds": seconds,
+        "peak_rss_mb": _peak_rss_mb(),
+        "base_rss_mb": base_rss,
+        "output_bytes": output_bytes,
+    }
+
+
+def measure(
+    target: str,
+    project_dir: Path,
+    starfile: Path,
+    extra_args: List[str],
+    repeats: int,
+) -> Dict[str, float]:
+    """Run a conversion in a fresh process several times and keep the fastest
+
+    Args:
+        target (str): Which converter to run, one of :data:`TARGETS`
+        project_dir (Path): The project dir
+        starfile (Path): The tilt series group STAR file, relative to project_dir
+        extra_args (List[str]): Extra args for the converter
+        repeats (int): The number of runs
+
+    Returns:
+        Dict[str, float]: The results of the fastest run, see :func:`run_conversion`
+    """
+    best: Dict[str, float] = {}
+    for _ in range(repeats):
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=get_context("spawn")
+        ) as executor:
+            result = executor.submit(
+                run_conversion, target, project_dir, starfile, extra_args
+            ).result()
+        if not best or result["seconds"] < best["seconds"]:
+            best = result
+    return best
+
+
+def get_arguments() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark the RELION converters")
+    parser.add_argument(
+        "--n_tilt_series",
+        type=int,
+        nargs="+",
+        default=[10],
+        help="Numbers of tilt series to test",
+    )
+    parser.add_argument(
+        "--n_tilts",
+        type=int,
+        nargs="+",
+        default=[41],
+        help="Numbers of tilts per tilt series to test",
+    )
+    parser.add_argument(
+        "--n_frames",
+        type=int,
+        nargs="+",
+        default=[8],
+        help="Numbers of frames per movie to test",
+    )
+    parser.add_argument(
+        "--last_stage",
+        choices=STAGES,
+        nargs="+",
+        default=["CtfFind"],
+        help="Processing stages to test, each has the columns of those before it",
+    )
+    parser.add_argument(
+        "--targets",
+        choices=TARGETS,
+        nargs="+",
+        default=list(TARGETS),
+        help="Converters to run",
+    )
+    parser.add_argument("--repeats", type=int, default=1, help="Best of n repeats")
+    parser.add_argument(
+        "--dir", help="Where to write the projects, a temporary dir by default"
+    )
+    parser.add_argument("--json", help="Also write the results to this file")
+    return parser
+
+
+def main(in_args=None) -> List[Dict[str, Any]]:
+    if in_args is None:
+        in_args = sys.argv[1:]
+    extra_args: List[str] = []
+    if "--" in in_args:
+        split = in_args.index("--")
+        in_args, extra_args = in_args[:split], in_args[split + 1 :]
+    args = get_arguments().parse_args(in_args)
+
+    print(f"Converter args: {' '.join(extra_args) or '(none)'}")
+    print(
+        f"{'target':<12}{'stage':<16}{'ts':>6}{'tilts':>6}{'frames':>7}"
+        f"{'time':>10}{'frames/s':>11}{'peak RSS':>11}{'conv RSS':>11}{'output':>11}"
+    )
+    results = []
+    sizes = itertools.product(
+        args.last_stage, args.n_tilt_series, args.n_tilts, args.n_frames
+    )
+    for stage, n_ts, n_tilts, n_frames in sizes:
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmpdir:
+            project_dir = Path(tmpdir).resolve()
+            starfile = write_project(
+                project_dir,
+                n_tilt_series=n_ts,
+                n_tilts=n_tilts,
+                n_frames=n_frames,
+                last_stage=stage,
+            )
+            for target in args.targets:
+                result = measure(
+                    target, project_dir, starfile, extra_args, args.repeats
+                )
+                total_frames = n_ts * n_tilts * n_frames
+                result.update(
+                    target=target,
+                    last_stage=stage,
+                    n_tilt_series=n_ts,
+                    n_tilts=n_tilts,
+                    n_frames=n_frames,
+                    frames_per_second=total_frames / result["seconds"],
+                )
+                results.append(result)
+                print(
+                    f"{target:<12}{stage:<16}{n_ts:>6}{n_tilts:>6}{n_frames:>7}"
+                    f"{result['seconds']:>9.2f}s"
+                    f"{result['frames_per_second']:>11.0f}"
+                    f"{result['peak_rss_mb']:>9.0f}MB"
+                    f"{result['peak_rss_mb'] - result['base_rss_mb']:>9.0f}MB"
+                    f"{result['output_bytes'] / 1024**2:>9.1f}MB"
+                )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"converter_args": extra_args, "results": results}, f, indent=4)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import sys
+import time
+import warnings
+from typing import Callable, Dict, List
+
+from src.tomobabel.models.imaging import EmImagingParameters
+
+"""Time the EBI schema validation of EbiLinkedBaseModels
+
+EmImagingParameters, the EBI linked model with the most fields, is made in a loop,
+with no values set and with values for most of its fields, and a field of an
+existing instance is set in a loop, which runs the validation again as the models
+validate assignments.  The values used are all valid, so no warnings are raised.
+
+    python -m benchmarks.bench_ebi_validation --n 20000
+"""
+
+VALUES = {
+    "microscope_model": "TFS KRIOS",
+    "specimen_holder_model": "FEI TITAN KRIOS AUTOGRID HOLDER",
+    "accelerating_voltage": 300,
+    "illumination_mode": "FLOOD BEAM",
+    "mode": "BRIGHT FIELD",
+    "nominal_cs": 2.7,
+    "nominal_defocus_min": 1000.0,
+    "nominal_defocus_max": 3000.0,
+    "nominal_magnification": 81000,
+    "electron_source": "FIELD EMISSION GUN",
+    "temperature": 80.0,
+    "alignment_procedure": "COMA FREE",
+    "cryogen": "NITROGEN",
+}
+
+
+def get_cases() -> Dict[str, Callable[[int], None]]:
+    """Get the loops to time {name: loop}"""
+
+    def empty(n: int) -> None:
+        for _ in range(n):
+            EmImagingParameters()
+
+    def with_values(n: int) -> None:
+        for _ in range(n):
+            EmImagingParameters(**VALUES)
+
+    def assignment(n: int) -> None:
+        model = EmImagingParameters(**VALUES)
+        for i in range(n):
+            model.nominal_magnification = 81000 + i % 2
+
+    return {"empty": empty, "with_values": with_values, "assignment": assignment}
+
+
+def get_arguments() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark EBI schema validation")
+    parser.add_argument("--n", type=int, default=20000, help="Iterations per loop")
+    parser.add_argument("--repeats", type=int, default=3, help="Best of n repeats")
+    return parser
+
+
+def main(in_args=None) -> List[Dict[str, float]]:
+    if in_args is None:
+        in_args = sys.argv[1:]
+    args = get_arguments().parse_args(in_args)
+    results = []
+    print(f"{'case':<14}{'per model':>12}")
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        for name, loop in get_cases().items():
+            best = float("inf")
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                loop(args.n)
+                best = min(best, time.perf_counter() - start)
+            results.append({"case": name, "seconds_per_model": best / args.n})
+            print(f"{name:<14}{best / args.n * 1e6:>10.1f}us")
+    return results
+
+
+if __name__ == "__main__":
+    main()
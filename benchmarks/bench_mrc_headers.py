@@ -0,0 +1,89 @@
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import mrcfile
+import numpy as np
+
+from src.tomobabel.mrc_headers import read_mrc_header
+
+"""Compare reading MRC dimensions from the header only against opening the whole file
+with mrcfile, which is how get_mrc_dims used to work.
+
+Writes a set of large synthetic movie stacks to a temporary dir (or --dir) and times
+both approaches on them.  The stacks are written with mrcfile.new_mmap so they are
+sparse on filesystems that support it, but they are still read in full by mrcfile.
+
+    python -m benchmarks.bench_mrc_headers --n_files 4 --size_mb 1024
+"""
+
+
+def full_open_dims(mrc_file: Path):
+    with mrcfile.open(mrc_file, permissive=True) as mrc:
+        return mrc.header.nx, mrc.header.ny, mrc.header.nz
+
+
+def header_only_dims(mrc_file: Path):
+    return read_mrc_header(mrc_file).dims
+
+
+def make_stacks(outdir: Path, n_files: int, size_mb: int) -> List[Path]:
+    """Write synthetic 4k x 4k int8 movie stacks of roughly size_mb each"""
+    nx = ny = 4096
+    nz = max(1, (size_mb * 1024 * 1024) // (nx * ny))
+    stacks = []
+    for n in range(n_files):
+        path = outdir / f"stack_{n:03d}.mrc"
+        with mrcfile.new_mmap(path, shape=(nz, ny, nx), mrc_mode=0) as mrc:
+            mrc.data[-1, -1, -1] = np.int8(1)
+        stacks.append(path)
+    return stacks
+
+
+def time_reader(reader: Callable, files: List[Path], repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for f in files:
+            reader(f)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def get_arguments() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark MRC header reading")
+    parser.add_argument("--n_files", type=int, default=4, help="Number of stacks")
+    parser.add_argument(
+        "--size_mb", type=int, default=256, help="Approximate size of each stack in MB"
+    )
+    parser.add_argument("--repeats", type=int, default=3, help="Best of n repeats")
+    parser.add_argument(
+        "--dir", help="Where to write the stacks, a temporary dir by default"
+    )
+    return parser
+
+
+def main(in_args=None) -> None:
+    if in_args is None:
+        in_args = sys.argv[1:]
+    args = get_arguments().parse_args(in_args)
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmpdir:
+        files = make_stacks(Path(tmpdir), args.n_files, args.size_mb)
+        assert [full_open_dims(f) for f in files] == [
+            header_only_dims(f) for f in files
+        ]
+        full = time_reader(full_open_dims, files, args.repeats)
+        header = time_reader(header_only_dims, files, args.repeats)
+
+    print(f"{args.n_files} stacks of ~{args.size_mb} MB")
+    print(f"mrcfile.open (full read): {full * 1000:10.2f} ms")
+    print(f"read_mrc_header:          {header * 1000:10.2f} ms")
+    print(f"speedup:                  {full / header:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
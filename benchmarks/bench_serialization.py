@@ -0,0 +1,149 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from benchmarks.synthetic_project import write_project
+from src.tomobabel.converters.relion.relion_convert_tilt_series import (
+    PipelinerTiltSeriesGroupConverter,
+)
+from src.tomobabel.interning import dump_deduplicated
+from src.tomobabel.serialization import dump_json, orjson
+from src.tomobabel.utils import NumpyEncoder
+
+"""Compare the ways of writing converted movie sets as JSON
+
+A synthetic project (see :mod:`benchmarks.synthetic_project`) is converted once, then
+the movie set of each tilt series is encoded by:
+
+- model_dump: model_dump() then json.dumps with NumpyEncoder, how the converters used
+  to write their outputs
+- pydantic: pydantic's serialiser, indented and compact
+- orjson: orjson, indented by 2 spaces and compact, if it is installed
+
+The indented pydantic output is checked to be the same as the model_dump output.  The
+movie sets are the largest outputs, a tilt series of 41 tilts with 40 frames per movie
+is a few MB.
+
+    python -m benchmarks.bench_serialization --n_frames 8 40 --deduplicate
+"""
+
+
+def legacy_dump(data: Any) -> bytes:
+    if not isinstance(data, dict):
+        data = data.model_dump()
+    return json.dumps(data, indent=4, cls=NumpyEncoder).encode()
+
+
+def get_encoders() -> Dict[str, Callable[[Any], bytes]]:
+    """Get the encoders to compare {name: encoder}"""
+    encoders: Dict[str, Callable[[Any], bytes]] = {
+        "model_dump": legacy_dump,
+        "pydantic": dump_json,
+        "pydantic_compact": lambda x: dump_json(x, compact=True),
+    }
+    if orjson is not None:
+        encoders["orjson"] = lambda x: dump_json(x, backend="orjson")
+        encoders["orjson_compact"] = lambda x: dump_json(
+            x, compact=True, backend="orjson"
+        )
+    return encoders
+
+
+def time_encoder(encoder: Callable[[Any], bytes], objs: List[Any], repeats: int):
+    """Get the best time to encode all the objects, and the size of the output"""
+    best = float("inf")
+    size = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        size = sum(len(encoder(x)) for x in objs)
+        best = min(best, time.perf_counter() - start)
+    return best, size
+
+
+def get_arguments() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark JSON serialization")
+    parser.add_argument(
+        "--n_tilt_series", type=int, default=4, help="Number of tilt series"
+    )
+    parser.add_argument("--n_tilts", type=int, default=41, help="Tilts per tilt series")
+    parser.add_argument(
+        "--n_frames",
+        type=int,
+        nargs="+",
+        default=[8, 40],
+        help="Numbers of frames per movie to test",
+    )
+    parser.add_argument(
+        "--compact_movies",
+        help="Convert the movies to CompactMovieStacks",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--deduplicate",
+        help="Encode the output of dump_deduplicated rather than the models",
+        action="store_true",
+    )
+    parser.add_argument("--repeats", type=int, default=3, help="Best of n repeats")
+    parser.add_argument(
+        "--dir", help="Where to write the projects, a temporary dir by default"
+    )
+    return parser
+
+
+def main(in_args=None) -> List[Dict[str, Any]]:
+    if in_args is None:
+        in_args = sys.argv[1:]
+    args = get_arguments().parse_args(in_args)
+    encoders = get_encoders()
+
+    print(f"{'frames':>7}{'encoder':>18}{'time':>10}{'output':>11}{'speedup':>9}")
+    results = []
+    cwd = os.getcwd()
+    for n_frames in args.n_frames:
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmpdir:
+            project_dir = Path(tmpdir).resolve()
+            starfile = write_project(
+                project_dir,
+                n_tilt_series=args.n_tilt_series,
+                n_tilts=args.n_tilts,
+                n_frames=n_frames,
+            )
+            os.chdir(project_dir)
+            try:
+                converter = PipelinerTiltSeriesGroupConverter(
+                    starfile, compact_movies=args.compact_movies
+                )
+                converter.do_conversion()
+            finally:
+                os.chdir(cwd)
+        objs = list(converter.all_movie_sets.values())
+        if args.deduplicate:
+            objs = [dump_deduplicated(x) for x in objs]
+        assert [legacy_dump(x) for x in objs] == [dump_json(x) for x in objs]
+
+        baseline = None
+        for name, encoder in encoders.items():
+            seconds, size = time_encoder(encoder, objs, args.repeats)
+            baseline = seconds if baseline is None else baseline
+            results.append(
+                {
+                    "n_frames": n_frames,
+                    "encoder": name,
+                    "seconds": seconds,
+                    "output_bytes": size,
+                }
+            )
+            print(
+                f"{n_frames:>7}{name:>18}{seconds:>9.3f}s"
+                f"{size / 1024**2:>9.1f}MB{baseline / seconds:>8.1f}x"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict
+
+import mrcfile
+import numpy as np
+from gemmi import cif
+
+from src.tomobabel.converters.relion.relion_convert_tilt_series import (
+    PipelinerTiltSeriesGroupConverter,
+)
+from src.tomobabel.models.basemodels import ValidationLevel
+
+"""Compare the converter's validation levels on the RELION test projects bundled with
+the tests.
+
+The tilt series in each job of the test project are converted at each validation
+level.  Small stub MRC files are written for the movies so no image data is needed.
+The test project has 8 frames per movie, use --n_frames to set a different number,
+EG: several hundred for EER movies, to see how the difference grows with the number
+of objects made.
+
+    python -m benchmarks.bench_validation --n_frames 40 --repeats 5
+"""
+
+TEST_DATA = Path(__file__).parents[1] / "tests/converters/relion/test_data"
+JOBS = {
+    "Import": "tilt_series.star",
+    "MotionCorr": "corrected_tilt_series.star",
+    "CtfFind": "tilt_series_ctf.star",
+    "ExcludeTiltImages": "selected_tilt_series.star",
+    "AlignTiltSeries": "aligned_tilt_series.star",
+}
+
+
+def setup_project(n_frames: int) -> Dict[str, Path]:
+    """Copy the test project into the current dir and write stub movies
+
+    Args:
+        n_frames (int): The number of frames in each movie, the frame counts in the
+            tilt series STAR files are changed to match
+
+    Returns:
+        Dict[str, Path]: The tilt series group STAR file for each job
+    """
+    starfiles = {}
+    for n, job in enumerate(JOBS, start=1):
+        jobdir = Path(f"{job}/job{n:03d}")
+        shutil.copytree(TEST_DATA / job, jobdir)
+        starfiles[job] = jobdir / JOBS[job]
+
+    for ts_file in Path(".").glob("*/job*/tilt_series/*.star"):
+        doc = cif.read_file(str(ts_file))
+        block = doc.find_block(ts_file.stem)
+        for row in block.find("_rln", ["TomoTiltMovieFrameCount"]):
+            row[0] = str(n_frames)
+        doc.write_file(str(ts_file))
+
+    glob_block = cif.read_file(str(starfiles["Import"])).find_block("global")
+    for ts_name, ts_file in glob_block.find(
+        "_rln", ["TomoName", "TomoTiltSeriesStarFile"]
+    ):
+        block = cif.read_file(ts_file).find_block(ts_name)
+        for row in block.find("_rln", ["MicrographMovieName"]):
+            movie = Path(row[0])
+            movie.parent.mkdir(parents=True, exist_ok=True)
+            with mrcfile.new(movie, overwrite=True) as mrc:
+                mrc.set_data(np.zeros((n_frames, 4, 4), dtype=np.int8))
+    return starfiles
+
+
+def time_conversion(
+    starfile: Path, validation: ValidationLevel, compact: bool, repeats: int
+) -> float:
+    """Get the best time to convert all the tilt series in a STAR file"""
+    best = float("inf")
+    for _ in range(repeats):
+        converter = PipelinerTiltSeriesGroupConverter(
+            input_file=starfile, validation=validation, compact_movies=compact
+        )
+        start = time.perf_counter()
+        converter.do_conversion()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def get_arguments() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark converter validation")
+    parser.add_argument(
+        "--n_frames", type=int, default=8, help="Number of frames in each movie"
+    )
+    parser.add_argument("--repeats", type=int, default=3, help="Best of n repeats")
+    parser.add_argument(
+        "--compact_movies", action="store_true", help="Make CompactMovieStacks"
+    )
+    return parser
+
+
+def main(in_args=None) -> None:
+    if in_args is None:
+        in_args = sys.argv[1:]
+    args = get_arguments().parse_args(in_args)
+
+    orig_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.chdir(tmpdir)
+        try:
+            starfiles = setup_project(args.n_frames)
+            print(f"{args.n_frames} frames per movie, best of {args.repeats}")
+            print(f"{'job':<20}" + "".join(f"{x.value:>12}" for x in ValidationLevel))
+            for job, starfile in starfiles.items():
+                times = [
+                    time_conversion(starfile, level, args.compact_movies, args.repeats)
+                    for level in ValidationLevel
+                ]
+                print(f"{job:<20}" + "".join(f"{x * 1000:10.1f}ms" for x in times))
+        finally:
+            os.chdir(orig_dir)
+
+
+if __name__ == "__main__":
+    main()
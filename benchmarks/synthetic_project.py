@@ -0,0 +1,347 @@
+import argparse
+import struct
+import sys
+from pathlib import Path
+from typing import List, Sequence
+
+import numpy as np
+
+from src.tomobabel.mrc_headers import MRC_HEADER_SIZE
+
+"""Write synthetic RELION tomography projects of any size for benchmarking
+
+A project has a single job with a tilt series group STAR file, a STAR file for each
+tilt series and a movie file for each tilt image.  The columns in the tilt series STAR
+files are the ones written by each of the processing stages up to the last one
+requested: Import, MotionCorr, CtfFind and AlignTiltSeries.
+
+The movies are stub MRC files that only contain a 1024 byte header, so projects with
+hundreds of thousands of frames can be written quickly and take very little space.  The
+headers describe full size movies, so the converter sees the same dimensions as it
+would for real data.
+
+    python -m benchmarks.synthetic_project my_project --n_tilt_series 100 --n_frames 40
+"""
+
+STAGES = ("Import", "MotionCorr", "CtfFind", "AlignTiltSeries")
+
+# the group STAR file and job type label written by each stage
+STAGE_JOBS = {
+    "Import": ("tilt_series.star", "relion.importtomo"),
+    "MotionCorr": ("corrected_tilt_series.star", "relion.motioncorr.own"),
+    "CtfFind": ("tilt_series_ctf.star", "relion.ctffind.ctffind4"),
+    "AlignTiltSeries": ("aligned_tilt_series.star", "relion.aligntiltseries"),
+}
+
+# the columns each stage adds to the tilt series STAR files
+STAGE_COLUMNS = {
+    "Import": [
+        "MicrographMovieName",
+        "TomoTiltMovieFrameCount",
+        "TomoNominalStageTiltAngle",
+        "TomoNominalTiltAxisAngle",
+        "MicrographPreExposure",
+        "TomoNominalDefocus",
+    ],
+    "MotionCorr": [
+        "CtfPowerSpectrum",
+        "MicrographNameEven",
+        "MicrographNameOdd",
+        "MicrographName",
+        "MicrographMetadata",
+        "AccumMotionTotal",
+        "AccumMotionEarly",
+        "AccumMotionLate",
+    ],
+    "CtfFind": [
+        "CtfImage",
+        "DefocusU",
+        "DefocusV",
+        "CtfAstigmatism",
+        "DefocusAngle",
+        "CtfFigureOfMerit",
+        "CtfMaxResolution",
+        "CtfIceRingDensity",
+    ],
+    "AlignTiltSeries": [
+        "TomoXTilt",
+        "TomoYTilt",
+        "TomoZRot",
+        "TomoXShiftAngst",
+        "TomoYShiftAngst",
+    ],
+}
+
+GLOBAL_COLUMNS = [
+    "TomoName",
+    "TomoTiltSeriesStarFile",
+    "Voltage",
+    "SphericalAberration",
+    "AmplitudeContrast",
+    "MicrographOriginalPixelSize",
+    "TomoHand",
+    "OpticsGroupName",
+]
+
+
+def write_stub_mrc_header(
+    path: Path, nx: int, ny: int, nz: int, pixel_size: float
+) -> None:
+    """Write an MRC file that only has a main header
+
+    Args:
+        path (Path): The file to write
+        nx (int): The image x dimension in px
+        ny (int): The image y dimension in px
+        nz (int): The number of frames
+        pixel_size (float): In Å/px
+    """
+    header = bytearray(MRC_HEADER_SIZE)
+    # nx, ny, nz, mode (int8), nxstart, nystart, nzstart, mx, my, mz
+    struct.pack_into("<10i", header, 0, nx, ny, nz, 0, 0, 0, 0, nx, ny, nz)
+    struct.pack_into("<3f", header, 40, nx * pixel_size, ny * pixel_size, nz)
+    struct.pack_into("<3f", header, 52, 90.0, 90.0, 90.0)
+    struct.pack_into("<3i", header, 64, 1, 2, 3)
+    struct.pack_into("<i", header, 108, 20140)
+    header[208:216] = b"MAP DD\0\0"
+    path.write_bytes(bytes(header))
+
+
+def dose_symmetric_tilts(n_tilts: int, step: float = 3.0) -> np.ndarray:
+    """Get the tilt angles of a dose symmetric tilt scheme in the order collected
+
+    Args:
+        n_tilts (int): The number of tilts
+        step (float): The tilt increment in degrees
+
+    Returns:
+        np.ndarray: The tilt angles: 0, +step, -step, -2 step, +2 step, ...
+    """
+    tilts = [0.0]
+    n = 1
+    while len(tilts) < n_tilts:
+        pair = [n * step, -n * step] if n % 2 else [-n * step, n * step]
+        tilts.extend(pair)
+        n += 1
+    return np.array(tilts[:n_tilts])
+
+
+def format_star_loop(block: str, columns: Sequence[str], rows: List[List[str]]) -> str:
+    """Format a STAR file data block with a single loop
+
+    Args:
+        block (str): The block name
+        columns (Sequence[str]): The column labels without the _rln prefix
+        rows (List[List[str]]): The values for each row
+
+    Returns:
+        str: The block
+    """
+    lines = [f"data_{block}", "", "loop_"]
+    lines.extend(f"_rln{col} #{n}" for n, col in enumerate(columns, start=1))
+    lines.extend("\t".join(row) for row in rows)
+    return "\n".join(lines) + "\n\n"
+
+
+def tilt_series_rows(
+    ts_name: str,
+    n_tilts: int,
+    n_frames: int,
+    stages: Sequence[str],
+    rng: np.random.Generator,
+) -> List[List[str]]:
+    """Make the rows of the STAR file for a tilt series
+
+    Args:
+        ts_name (str): The name of the tilt series
+        n_tilts (int): The number of tilt images
+        n_frames (int): The number of frames in each movie
+        stages (Sequence[str]): The processing stages to make columns for
+        rng (np.random.Generator): For the processing results
+
+    Returns:
+        List[List[str]]: The values for each row, in the order of the columns in
+            :data:`STAGE_COLUMNS`
+    """
+    tilts = dose_symmetric_tilts(n_tilts)
+    defocus = rng.uniform(38000.0, 41000.0, n_tilts)
+    astig = rng.uniform(50.0, 500.0, n_tilts)
+    rows = []
+    for n, tilt in enumerate(tilts):
+        stem = f"{ts_name}_{n:03d}_{tilt:.1f}"
+        mc_stem = f"MotionCorr/job002/frames/{stem.replace('.', '_')}"
+        motion = rng.uniform(2.0, 10.0)
+        row = [
+            f"frames/{stem}.mrc",
+            str(n_frames),
+            f"{tilt + 0.001:.6f}",
+            "85.000000",
+            f"{3.0 * n:.6f}",
+            "-4.000000",
+        ]
+        if "MotionCorr" in stages:
+            row += [
+                f"{mc_stem}_PS.mrc",
+                f"{mc_stem}_EVN.mrc",
+                f"{mc_stem}_ODD.mrc",
+                f"{mc_stem}.mrc",
+                f"{mc_stem}.star",
+                f"{motion:.6f}",
+                "0.000000",
+                f"{motion:.6f}",
+            ]
+        if "CtfFind" in stages:
+            row += [
+                f"CtfFind/job003/frames/{stem.replace('.', '_')}_PS.ctf:mrc",
+                f"{defocus[n] + astig[n]:.6f}",
+                f"{defocus[n] - astig[n]:.6f}",
+                f"{2 * astig[n]:.6f}",
+                f"{rng.uniform(-90.0, 90.0):.6f}",
+                f"{rng.uniform(0.05, 0.3):.6f}",
+                f"{rng.uniform(4.0, 12.0):.6f}",
+                f"{rng.uniform(0.0, 0.02):.6f}",
+            ]
+        if "AlignTiltSeries" in stages:
+            row += [
+                "0.000000",
+                f"{tilt + rng.normal(0.0, 0.1):.6f}",
+                f"{85.0 + rng.normal(0.0, 0.2):.6f}",
+                f"{rng.normal(0.0, 20.0):.6f}",
+                f"{rng.normal(0.0, 20.0):.6f}",
+            ]
+        rows.append(row)
+    return rows
+
+
+def write_project(
+    project_dir: Path,
+    n_tilt_series: int = 10,
+    n_tilts: int = 41,
+    n_frames: int = 8,
+    last_stage: str = "CtfFind",
+    movie_size: Sequence[int] = (4096, 4096),
+    pixel_size: float = 0.675,
+    seed: int = 0,
+) -> Path:
+    """Write a synthetic RELION tomography project
+
+    Paths in the project are relative to project_dir, so the conversion should be run
+    from there, the same as for a real RELION project.
+
+    Args:
+        project_dir (Path): The project dir, it is made if it doesn't exist
+        n_tilt_series (int): The number of tilt series
+        n_tilts (int): The number of tilt images in each tilt series
+        n_frames (int): The number of frames in each movie
+        last_stage (str): The last processing stage done, the tilt series STAR
+            files have the columns for it and all the stages before it
+        movie_size (Sequence[int]): The x and y dimensions of the movies in px
+        pixel_size (float): The movie pixel size in Å/px
+        seed (int): Seed for the random processing results
+
+    Returns:
+        Path: The tilt series group STAR file, relative to project_dir
+    """
+    if last_stage not in STAGES:
+        raise ValueError(f"Unknown stage {last_stage}, choose from {STAGES}")
+    stages = STAGES[: STAGES.index(last_stage) + 1]
+    columns = [col for stage in stages for col in STAGE_COLUMNS[stage]]
+    starfile_name, job_type = STAGE_JOBS[last_stage]
+    job_dir = Path(f"{last_stage}/job{len(stages):03d}")
+
+    project_dir = Path(project_dir)
+    (project_dir / job_dir / "tilt_series").mkdir(parents=True, exist_ok=True)
+    (project_dir / "frames").mkdir(exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    global_rows = []
+    for n in range(1, n_tilt_series + 1):
+        ts_name = f"TS_{n:03d}"
+        ts_file = job_dir / "tilt_series" / f"{ts_name}.star"
+        rows = tilt_series_rows(ts_name, n_tilts, n_frames, stages, rng)
+        (project_dir / ts_file).write_text(format_star_loop(ts_name, columns, rows))
+        for row in rows:
+            write_stub_mrc_header(
+                project_dir / row[0], movie_size[0], movie_size[1], n_frames, pixel_size
+            )
+        global_rows.append(
+            [
+                ts_name,
+                str(ts_file),
+                "300.000000",
+                "2.700000",
+                "0.100000",
+                f"{pixel_size:.6f}",
+                "-1",
+                "optics1",
+            ]
+        )
+
+    starfile = job_dir / starfile_name
+    (project_dir / starfile).write_text(
+        format_star_loop("global", GLOBAL_COLUMNS, global_rows)
+    )
+    write_job_star(project_dir / job_dir / "job.star", job_type)
+    return starfile
+
+
+def write_job_star(job_star: Path, job_type: str) -> None:
+    """Write the job.star file for a job, without gain or defect files
+
+    Args:
+        job_star (Path): The file to write
+        job_type (str): The RELION job type label
+    """
+    job_star.write_text(
+        "data_job\n\n"
+        f"_rlnJobTypeLabel {job_type}\n"
+        "_rlnJobIsContinue 0\n"
+        "_rlnJobIsTomo 1\n\n"
+        "data_joboptions_values\n\n"
+        "loop_\n"
+        "_rlnJobOptionVariable #1\n"
+        "_rlnJobOptionValue #2\n"
+        'fn_gain_ref ""\n'
+        'fn_defect ""\n'
+    )
+
+
+def get_arguments() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Write a synthetic RELION project")
+    parser.add_argument("project_dir", help="Where to write the project")
+    parser.add_argument(
+        "--n_tilt_series", type=int, default=10, help="Number of tilt series"
+    )
+    parser.add_argument(
+        "--n_tilts", type=int, default=41, help="Number of tilts in each tilt series"
+    )
+    parser.add_argument(
+        "--n_frames", type=int, default=8, help="Number of frames in each movie"
+    )
+    parser.add_argument(
+        "--last_stage",
+        choices=STAGES,
+        default="CtfFind",
+        help="The last processing stage, its columns and all before it are written",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    return parser
+
+
+def main(in_args=None) -> None:
+    if in_args is None:
+        in_args = sys.argv[1:]
+    args = get_arguments().parse_args(in_args)
+    starfile = write_project(
+        Path(args.project_dir),
+        n_tilt_series=args.n_tilt_series,
+        n_tilts=args.n_tilts,
+        n_frames=args.n_frames,
+        last_stage=args.last_stage,
+        seed=args.seed,
+    )
+    print(f"Wrote {Path(args.project_dir) / starfile}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,677 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from src.tomobabel.converters.relion.relion_convert_tilt_series import (
+    PipelinerTiltSeriesGroupConverter,
+    add_compact_movies_argument,
+    add_header_cache_arguments,
+    add_jobs_argument,
+    add_json_arguments,
+    add_profile_argument,
+    add_validation_argument,
+    get_header_cache,
+    write_tilt_series_outputs,
+)
+from src.tomobabel.converters.relion.relion_starfiles import StarFileCache
+from src.tomobabel.interning import ModelInterner
+from src.tomobabel.models.basemodels import ValidationLevel
+from src.tomobabel.models.tomo_images import (
+    DefectFile,
+    GainFile,
+    MovieStackSet,
+    TiltSeriesMicrographStack,
+)
+from src.tomobabel.mrc_headers import HeaderCache
+from src.tomobabel.profiling import ConversionProfiler
+
+"""Convert the tilt series in many RELION projects in a single process
+
+Starting a new process for each project means paying the cost of importing and
+building the pydantic models, gemmi and mrcfile every time, and reading the headers of
+gain references that are used by many projects again.  Here all the projects share one
+STAR file cache, one image header cache and, when more than one job is used, one pool of
+worker processes, so tilt series from different projects are converted side by side.
+
+The paths in a RELION project are relative to the project dir, which is found from the
+location of each tilt series group STAR file.  The outputs for each project are written
+to their own dir in the output dir, and a summary of the status of every project is
+kept in batch_status.json, which is updated as each project finishes.
+"""
+
+logger = logging.getLogger(__name__)
+
+BATCH_STATUS_FILE = "batch_status.json"
+
+
+class BatchProject(NamedTuple):
+    """A RELION project to convert
+
+    Attributes:
+        name (str): The name of the project's output dir, unique in the batch
+        project_dir (Path): The absolute path of the RELION project dir
+        input_file (Path): The tilt series group STAR file, relative to project_dir
+        output_dir (Path): Where the outputs for the project are written
+    """
+
+    name: str
+    project_dir: Path
+    input_file: Path
+    output_dir: Path
+
+
+def find_project_dir(starfile: Path) -> Path:
+    """Find the RELION project dir that a STAR file is in
+
+    This is the closest dir above the file that contains a default_pipeline.star file.
+    If there isn't one the file is assumed to be in a job dir, EG:
+    <project>/CtfFind/job003/tilt_series_ctf.star
+
+    Args:
+        starfile (Path): The STAR file
+
+    Returns:
+        Path: The absolute path of the project dir
+    """
+    starfile = starfile.resolve()
+    for parent in starfile.parents:
+        if (parent / "default_pipeline.star").is_file():
+            return parent
+    return starfile.parents[2]
+
+
+def expand_input_files(patterns: List[str]) -> List[Path]:
+    """Get the STAR files matching a list of file names and glob patterns
+
+    Args:
+        patterns (List[str]): The files or patterns, "**" matches any number of dirs
+
+    Returns:
+        List[Path]: The matching files with duplicates removed, in the order given.
+            Files matching a single pattern are sorted
+
+    Raises:
+        FileNotFoundError: If a pattern doesn't match any files
+    """
+    files: Dict[Path, None] = {}
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        if not matches:
+            raise FileNotFoundError(f"No files found matching {pattern}")
+        files.update((Path(x).resolve(), None) for x in matches)
+    return list(files)
+
+
+@contextmanager
+def working_dir(path: Path) -> Iterator[None]:
+    """Run a block of code in a different working dir
+
+    Args:
+        path (Path): The dir to change to
+    """
+    orig_dir = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(orig_dir)
+
+
+class _Task(NamedTuple):
+    """A tilt series to convert in a worker process"""
+
+    project: BatchProject
+    ts_name: str
+    ts_file: str
+    gainfile: Optional[GainFile]
+    defectfile: Optional[DefectFile]
+
+
+class BatchConverter(object):
+    """Converts the tilt series in many RELION projects with shared caches
+
+    Attributes:
+        projects (List[BatchProject]): The projects to convert
+        output_dir (Path): The dir the output dir for each project is made in
+        header_cache (HeaderCache): Shared by all the projects, if a persistent
+            cache is not provided an in-memory one is used so files used by more than
+            one project, like gain references, are only read once
+        star_cache (StarFileCache): Shared by all the projects
+        interner (ModelInterner): Shared by all the projects
+        probe_workers (int): The number of threads used to read image headers
+        jobs (int): The number of worker processes shared by all the projects
+        compact_movies (bool): Make CompactMovieStack objects for the movies
+        validation (ValidationLevel): How to validate the converted objects
+        deduplicate (bool): Write shared objects once in the output files
+        compact_json (bool): Write the json without indentation or spaces
+        json_backend (str): The JSON encoder to use
+        array_sidecar (bool): Write the numeric arrays to sidecar files
+        profiler (ConversionProfiler): Records the time taken by each stage of all
+            the conversions, disabled unless a profiler is provided
+        status (Dict[str, Dict[str, Any]]): The status of each project {project
+            name: status}, see :meth:`new_status`
+    """
+
+    def __init__(
+        self,
+        input_files: List[Path],
+        output_dir: Path,
+        header_cache: Optional[HeaderCache] = None,
+        probe_workers: int = 8,
+        jobs: int = 1,
+        compact_movies: bool = False,
+        validation: ValidationLevel = ValidationLevel.full,
+        deduplicate: bool = False,
+        profiler: Optional[ConversionProfiler] = None,
+        compact_json: bool = False,
+        json_backend: str = "pydantic",
+        array_sidecar: bool = False,
+    ) -> None:
+        self.output_dir = output_dir.resolve()
+        self.projects = self.get_projects(input_files)
+        self.header_cache = (
+            HeaderCache(":memory:") if header_cache is None else header_cache
+        )
+        self.star_cache = StarFileCache()
+        self.interner = ModelInterner()
+        self.probe_workers = probe_workers
+        self.jobs = jobs
+        self.compact_movies = compact_movies
+        self.validation = ValidationLevel(validation)
+        self.deduplicate = deduplicate
+        self.compact_json = compact_json
+        self.json_backend = json_backend
+        self.array_sidecar = array_sidecar
+        self.profiler = (
+            ConversionProfiler(enabled=False) if profiler is None else profiler
+        )
+        self.status: Dict[str, Dict[str, Any]] = {}
+
+    def get_projects(self, input_files: List[Path]) -> List[BatchProject]:
+        """Find the project for each input file and give each one an output dir
+
+        The output dirs are named after the project dirs, with a number added if
+        more than one project has the same name.
+
+        Args:
+            input_files (List[Path]): The tilt series group STAR files
+
+        Returns:
+            List[BatchProject]: The projects
+        """
+        projects = []
+        names: Dict[str, int] = {}
+        for input_file in input_files:
+            project_dir = find_project_dir(input_file)
+            name = project_dir.name
+            names[name] = names.get(name, 0) + 1
+            if names[name] > 1:
+                name = f"{name}_{names[name]}"
+            projects.append(
+                BatchProject(
+                    name=name,
+                    project_dir=project_dir,
+                    input_file=input_file.resolve().relative_to(project_dir),
+                    output_dir=self.output_dir / name,
+                )
+            )
+        return projects
+
+    def make_converter(
+        self, project: BatchProject
+    ) -> PipelinerTiltSeriesGroupConverter:
+        """Make a converter for a project that uses the shared caches
+
+        Args:
+            project (BatchProject): The project
+
+        Returns:
+            PipelinerTiltSeriesGroupConverter: The converter, it must be used with
+                the project dir as the working dir
+        """
+        converter = PipelinerTiltSeriesGroupConverter(
+            input_file=project.input_file,
+            header_cache=self.header_cache,
+            probe_workers=self.probe_workers,
+            star_cache=self.star_cache,
+            compact_movies=self.compact_movies,
+            validation=self.validation,
+            profiler=self.profiler,
+        )
+        converter.interner = self.interner
+        return converter
+
+    @staticmethod
+    def new_status(project: BatchProject) -> Dict[str, Any]:
+        """Get the initial status for a project
+
+        Args:
+            project (BatchProject): The project
+
+        Returns:
+            Dict[str, Any]: The status. "status" is one of "pending", "running",
+                "complete", "partial" (some tilt series failed) or "failed"
+        """
+        return {
+            "status": "pending",
+            "input_file": str(project.project_dir / project.input_file),
+            "project_dir": str(project.project_dir),
+            "output_dir": str(project.output_dir),
+            "tilt_series": 0,
+            "converted": [],
+            "errors": {},
+            "seconds": None,
+        }
+
+    def save_status(self) -> None:
+        """Write the status of all the projects to the batch status file"""
+        summary = {
+            "projects": self.status,
+            "counts": {
+                x: sum(y["status"] == x for y in self.status.values())
+                for x in ("pending", "running", "complete", "partial", "failed")
+            },
+        }
+        status_file = self.output_dir / BATCH_STATUS_FILE
+        tmp = status_file.with_name(status_file.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(summary, f, indent=4)
+        os.replace(tmp, status_file)
+
+    def prepare_project(
+        self, project: BatchProject
+    ) -> Tuple[
+        PipelinerTiltSeriesGroupConverter, Optional[GainFile], Optional[DefectFile]
+    ]:
+        """Read a project's tilt series group file and gain and defect files
+
+        Args:
+            project (BatchProject): The project
+
+        Returns:
+            Tuple[PipelinerTiltSeriesGroupConverter, Optional[GainFile],
+                Optional[DefectFile]]: The converter for the project, with its
+                ts_files set, and the gain and defect files
+        """
+        status = self.status[project.name]
+        status["status"] = "running"
+        status["started"] = time.time()
+        converter = self.make_converter(project)
+        with working_dir(project.project_dir):
+            converter.select_tilt_series(None)
+            gainfile, defectfile = converter.get_gain_ref_and_defect_file()
+        status["tilt_series"] = len(converter.ts_files)
+        project.output_dir.mkdir(parents=True, exist_ok=True)
+        return converter, gainfile, defectfile
+
+    def finish_project(self, project: BatchProject) -> None:
+        """Set the final status of a project and save the batch status
+
+        Args:
+            project (BatchProject): The project
+        """
+        status = self.status[project.name]
+        if status["errors"] and not status["converted"]:
+            status["status"] = "failed"
+        elif status["errors"]:
+            status["status"] = "partial"
+        else:
+            status["status"] = "complete"
+        status["seconds"] = time.time() - status.pop("started")
+        logger.info(
+            f"{project.name}: {len(status['converted'])} of {status['tilt_series']}"
+            " tilt series converted"
+        )
+        self.save_status()
+
+    def project_failed(self, project: BatchProject, err: Exception) -> None:
+        """Record an error that stopped a whole project being converted
+
+        Args:
+            project (BatchProject): The project
+            err (Exception): The error
+        """
+        msg = f"{type(err).__name__}: {err}"
+        logger.error(f"Error converting project {project.name}: {msg}")
+        status = self.status[project.name]
+        status["status"] = "failed"
+        status["errors"]["project"] = msg
+        status.pop("started", None)
+        self.save_status()
+
+    def write_outputs(
+        self,
+        project: BatchProject,
+        ts_name: str,
+        movie_set: MovieStackSet,
+        tilt_series: TiltSeriesMicrographStack,
+    ) -> None:
+        """Write the outputs for a converted tilt series and update its status
+
+        Args:
+            project (BatchProject): The project
+            ts_name (str): The tilt series
+            movie_set (MovieStackSet): The CETS objects for its movies
+            tilt_series (TiltSeriesMicrographStack): The CETS tilt series object
+        """
+        write_tilt_series_outputs(
+            project.output_dir,
+            ts_name,
+            movie_set,
+            tilt_series,
+            self.deduplicate,
+            self.profiler,
+            self.compact_json,
+            self.json_backend,
+            self.array_sidecar,
+        )
+        self.status[project.name]["converted"].append(ts_name)
+
+    def tilt_series_failed(
+        self, project: BatchProject, ts_name: str, err: Exception
+    ) -> None:
+        """Record an error converting a tilt series
+
+        Args:
+            project (BatchProject): The project
+            ts_name (str): The tilt series
+            err (Exception): The error
+        """
+        msg = f"{type(err).__name__}: {err}"
+        logger.error(f"Error converting {project.name} tilt series {ts_name}: {msg}")
+        self.status[project.name]["errors"][ts_name] = msg
+
+    def run(self) -> Dict[str, Dict[str, Any]]:
+        """Convert all the projects
+
+        An error in one tilt series or project doesn't stop the others from being
+        converted, it is recorded in the project's status instead.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: The status of each project
+        """
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.status = {x.name: self.new_status(x) for x in self.projects}
+        self.save_status()
+        if self.jobs > 1:
+            self._run_parallel()
+        else:
+            self._run_serial()
+        self.header_cache.flush()
+        return self.status
+
+    def _run_serial(self) -> None:
+        for project in self.projects:
+            try:
+                converter, gainfile, defectfile = self.prepare_project(project)
+            except Exception as err:
+                self.project_failed(project, err)
+                continue
+            with working_dir(project.project_dir):
+                for ts_name in converter.ts_files:
+                    try:
+                        movie_set, tilt_series = converter.convert_tilt_series(
+                            ts_name, gainfile, defectfile
+                        )
+                    except Exception as err:
+                        self.tilt_series_failed(project, ts_name, err)
+                        continue
+                    self.write_outputs(project, ts_name, movie_set, tilt_series)
+            self.finish_project(project)
+
+    def _iter_tasks(self) -> Iterator[Tuple[_Task, bool]]:
+        """Get the tilt series to convert from all the projects, in order
+
+        Projects are only read when their first tilt series is needed.
+
+        Yields:
+            Tuple[_Task, bool]: The task and whether it is the last one for the
+                project
+        """
+        for project in self.projects:
+            try:
+                converter, gainfile, defectfile = self.prepare_project(project)
+            except Exception as err:
+                self.project_failed(project, err)
+                continue
+            if not converter.ts_files:
+                self.finish_project(project)
+                continue
+            ts_files = list(converter.ts_files.items())
+            for n, (ts_name, ts_file) in enumerate(ts_files, start=1):
+                task = _Task(project, ts_name, ts_file, gainfile, defectfile)
+                yield task, n == len(ts_files)
+
+    def _run_parallel(self) -> None:
+        """Convert the tilt series from all the projects in one pool of workers
+
+        Results are handled in the order the tasks were submitted, and only a few
+        tasks per worker are submitted ahead so results don't pile up in memory.
+        """
+        cache = self.header_cache
+        settings = _BatchWorkerSettings(
+            header_cache_path=None
+            if str(cache.path) == ":memory:"
+            else str(cache.path),
+            header_cache_size=cache.max_entries,
+            probe_workers=self.probe_workers,
+            compact_movies=self.compact_movies,
+            validation=self.validation,
+            profile=self.profiler.enabled,
+        )
+        cache.flush()
+        tasks = self._iter_tasks()
+        with ProcessPoolExecutor(
+            max_workers=self.jobs,
+            initializer=_init_batch_worker,
+            initargs=(settings,),
+        ) as executor:
+            pending: Deque[Tuple[_Task, bool, Future]] = deque()
+
+            def submit_next() -> None:
+                for task, last in tasks:
+                    future = executor.submit(_convert_batch_task, task)
+                    pending.append((task, last, future))
+                    return
+
+            for _ in range(2 * self.jobs):
+                submit_next()
+            while pending:
+                task, last, future = pending.popleft()
+                submit_next()
+                try:
+                    with self.profiler.stage("wait_for_workers"):
+                        movie_set, tilt_series, profile = future.result()
+                except Exception as err:
+                    self.tilt_series_failed(task.project, task.ts_name, err)
+                else:
+                    if profile is not None:
+                        self.profiler.merge(profile)
+                    self.write_outputs(
+                        task.project, task.ts_name, movie_set, tilt_series
+                    )
+                if last:
+                    self.finish_project(task.project)
+
+
+class _BatchWorkerSettings(NamedTuple):
+    """The settings shared by all the projects in a batch, for the worker processes"""
+
+    header_cache_path: Optional[str]
+    header_cache_size: int
+    probe_workers: int
+    compact_movies: bool
+    validation: ValidationLevel
+    profile: bool
+
+
+# Each worker process keeps a converter for each project it has seen, with caches
+# shared between them
+_batch_settings: Optional[_BatchWorkerSettings] = None
+_batch_converters: Dict[Tuple[Path, Path], PipelinerTiltSeriesGroupConverter] = {}
+_batch_star_cache: Optional[StarFileCache] = None
+_batch_header_cache: Optional[HeaderCache] = None
+
+
+def _init_batch_worker(settings: _BatchWorkerSettings) -> None:
+    global _batch_settings, _batch_star_cache, _batch_header_cache
+    _batch_settings = settings
+    _batch_converters.clear()
+    _batch_star_cache = StarFileCache()
+    _batch_header_cache = None
+    if settings.header_cache_path is not None:
+        _batch_header_cache = HeaderCache(
+            path=settings.header_cache_path, max_entries=settings.header_cache_size
+        )
+
+
+def _convert_batch_task(
+    task: _Task,
+) -> Tuple[MovieStackSet, TiltSeriesMicrographStack, Optional[Dict]]:
+    """Convert a single tilt series from a batch in a worker process
+
+    Args:
+        task (_Task): The tilt series to convert
+
+    Returns:
+        Tuple[MovieStackSet, TiltSeriesMicrographStack, Optional[Dict]]: The CETS
+            objects for the movies and the tilt series, and the profile of the
+            conversion if profiling is enabled
+    """
+    assert _batch_settings is not None
+    project = task.project
+    key = (project.project_dir, project.input_file)
+    converter = _batch_converters.get(key)
+    if converter is None:
+        converter = PipelinerTiltSeriesGroupConverter(
+            input_file=project.input_file,
+            header_cache=_batch_header_cache,
+            probe_workers=_batch_settings.probe_workers,
+            star_cache=_batch_star_cache,
+            compact_movies=_batch_settings.compact_movies,
+            validation=_batch_settings.validation,
+            profiler=ConversionProfiler(enabled=_batch_settings.profile),
+        )
+        _batch_converters[key] = converter
+    converter.ts_files[task.ts_name] = task.ts_file
+    converter.profiler.reset()
+    try:
+        with working_dir(project.project_dir):
+            ms_series, ts_obj = converter.convert_tilt_series(
+                task.ts_name, task.gainfile, task.defectfile
+            )
+        profile = converter.profiler.to_dict() if converter.profiler.enabled else None
+        return ms_series, ts_obj, profile
+    finally:
+        if _batch_header_cache is not None:
+            _batch_header_cache.flush()
+
+
+def get_arguments() -> argparse.ArgumentParser:
+    """Get the args for running
+
+    --input_starfiles: TiltSeriesGroupMetadata STAR files or glob patterns
+    --input_list (optional): A file listing more STAR files or patterns, one per line
+    --output_dir: Where to write the outputs and the batch status
+    --header_cache (optional): Use a persistent cache of image headers
+    --probe_workers (optional): Number of threads for reading image headers
+    --jobs (optional): Number of processes shared by all the projects
+    --compact_movies (optional): Store per-frame values in arrays
+    --validation (optional): How to validate the converted objects
+    --deduplicate (optional): Write shared objects once in the output files
+    --compact_json (optional): Write the JSON without indentation
+    --json_backend (optional): The JSON encoder to use
+    --array_sidecar (optional): Write numeric arrays to .npz files
+    --profile (optional): Write a report of the time taken by each stage
+
+    Returns:
+        argparse.ArgumentParser: Contains the args
+    """
+    parser = argparse.ArgumentParser(
+        description="Convert the tilt series in many RELION projects"
+    )
+    parser.add_argument(
+        "--input_starfiles",
+        "-i",
+        help=(
+            "RELION tilt series group STAR files, glob patterns can be used, EG:"
+            " 'projects/*/AlignTiltSeries/job*/aligned_tilt_series.star'"
+        ),
+        nargs="*",
+        default=[],
+    )
+    parser.add_argument(
+        "--input_list",
+        help="A file listing tilt series group STAR files or patterns, one per line",
+        metavar="Input list file",
+    )
+    parser.add_argument(
+        "--output_dir",
+        "-o",
+        help=(
+            "The outputs for each project are written to a dir in here named after"
+            f" the project, with a summary of their status in {BATCH_STATUS_FILE}"
+        ),
+        required=True,
+        metavar="Output dir",
+    )
+    add_header_cache_arguments(parser)
+    add_jobs_argument(parser)
+    add_compact_movies_argument(parser)
+    add_validation_argument(parser)
+    add_profile_argument(parser)
+    add_json_arguments(parser)
+    parser.add_argument(
+        "--deduplicate",
+        help="Write objects that are shared by many frames once in each output file",
+        action="store_true",
+    )
+    return parser
+
+
+def main(in_args=None) -> BatchConverter:
+    if in_args is None:
+        in_args = sys.argv[1:]
+    args = get_arguments().parse_args(in_args)
+    patterns = list(args.input_starfiles)
+    if args.input_list:
+        with open(args.input_list) as f:
+            patterns += [x.strip() for x in f if x.strip()]
+    if not patterns:
+        raise ValueError("No input STAR files given")
+
+    header_cache = get_header_cache(args)
+    batch = BatchConverter(
+        expand_input_files(patterns),
+        Path(args.output_dir),
+        header_cache=header_cache,
+        probe_workers=args.probe_workers,
+        jobs=args.jobs,
+        compact_movies=args.compact_movies,
+        validation=args.validation,
+        deduplicate=args.deduplicate,
+        profiler=ConversionProfiler() if args.profile else None,
+        compact_json=args.compact_json,
+        json_backend=args.json_backend,
+        array_sidecar=args.array_sidecar,
+    )
+    try:
+        batch.run()
+    finally:
+        batch.header_cache.close()
+    if args.profile:
+        batch.profiler.write(args.profile)
+    return batch
+
+
+if __name__ == "__main__":
+    main()
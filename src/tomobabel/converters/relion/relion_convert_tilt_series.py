@@ -1,14 +1,20 @@
 import argparse
+import hashlib
 import json
 import logging
 import sys
+import time
 import numpy as np
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import Optional, List, Dict, Tuple
+from typing import Optional, List, Dict, Deque, Iterator, NamedTuple, Tuple, Union
 
 from gemmi import cif
 
 from src.tomobabel.models.tomo_images import (
+    CompactMovieStack,
     MovieStack,
     MovieFrame,
     CTFMetadata,
@@ -18,11 +24,27 @@ from src.tomobabel.models.tomo_images import (
     TiltSeriesMicrographStack,
     MovieStackSet,
 )
-from src.tomobabel.models.top_level import TomoImageSet
 from src.tomobabel.models.tomo_images import TiltSeriesMicrographAlignment
 from src.tomobabel.models.transformations import Transformation, TransformationType
 from src.tomobabel.models.annotation import Annotation
-from src.tomobabel.utils import get_mrc_dims, NumpyEncoder
+from src.tomobabel.models.basemodels import (
+    ValidationLevel,
+    build_model,
+    validate_model_tree,
+)
+from src.tomobabel.converters.relion.relion_manifest import (
+    MANIFEST_VERSION,
+    ConversionManifest,
+)
+from src.tomobabel.converters.relion.relion_starfiles import (
+    StarFileCache,
+    TiltSeriesTable,
+)
+from src.tomobabel.interning import ModelInterner, dump_deduplicated
+from src.tomobabel.mrc_headers import HeaderCache
+from src.tomobabel.profiling import ConversionProfiler, count_objects
+from src.tomobabel.serialization import JSON_BACKENDS, get_sidecar_path, write_json
+from src.tomobabel.utils import get_mrc_dims, probe_mrc_headers
 
 """Convert a RELION starfile describing a set of tomographic tilt series into CETS
 metadata format.
@@ -84,6 +106,20 @@ to be collected
 logger = logging.getLogger(__name__)
 
 
+class TiltSeriesConversionError(RuntimeError):
+    """Raised when some tilt series could not be converted
+
+    Attributes:
+        errors (Dict[str, str]): The error for each tilt series that failed
+    """
+
+    def __init__(self, errors: Dict[str, str]) -> None:
+        self.errors = errors
+        super().__init__(
+            f"{len(errors)} tilt series could not be converted: {', '.join(errors)}"
+        )
+
+
 class RelionTiltSeriesMovie(object):
     """A movie that represents one tilt image in the tilt series
 
@@ -98,8 +134,11 @@ class RelionTiltSeriesMovie(object):
         width (int): Image x dimension in px
         n_frames (int): Number of frames in the movie IE: Stack z dimension
         apix (float): Movie pixel size in Å/px
-        czii_movie_stack (MovieStack): A CETS MovieStack object that will hold the
-            MovieFrames
+        czii_movie_stack (Union[MovieStack, CompactMovieStack]): A CETS MovieStack
+            object that will hold the MovieFrames, or a CompactMovieStack
+
+    If the movie dimensions are not provided they are read from the movie file, or
+    from the HeaderCache if one is provided.
     """
 
     def __init__(
@@ -111,21 +150,26 @@ class RelionTiltSeriesMovie(object):
         n_frames: int,
         apix: float,
         czii_movie_frames: Optional[List[MovieFrame]] = None,
+        header_cache: Optional[HeaderCache] = None,
+        dims: Optional[Tuple[Optional[int], ...]] = None,
     ) -> None:
         self.dose_per_frame = dose_per_frame
         self.stack_file_path = str(stack_file_path)
         self.czii_movie_frames = [] if czii_movie_frames is None else czii_movie_frames
         self.tilt = tilt
         self.pre_exp = pre_exp
-        try:
-            dims = get_mrc_dims(stack_file_path)
-        except FileNotFoundError:
-            dims = None, None, None
+        if dims is None:
+            try:
+                dims = get_mrc_dims(stack_file_path, header_cache=header_cache)
+            except FileNotFoundError:
+                dims = None, None, None
         self.height = dims[1]
         self.width = dims[0]
         self.n_frames = n_frames
         self.apix = apix
-        self.czii_movie_stack = MovieStack(frame_images=[], path=str(stack_file_path))
+        self.czii_movie_stack: Union[MovieStack, CompactMovieStack] = MovieStack(
+            frame_images=[], path=str(stack_file_path)
+        )
 
 
 class PipelinerTiltSeriesGroupConverter(object):
@@ -138,14 +182,34 @@ class PipelinerTiltSeriesGroupConverter(object):
         all_movie_sets (Dict[str, MovieStackCollection]): The CETS
             MovieStackCollection for each tiltseries in the input file
             {tilt_series_name: MovieStackCollection}
-        all_tilt_series (Dict[str, TiltSeries]): The CETS TiltSeries for each tiltseries
-            in the input file.
+        all_tilt_series (Dict[str, TiltSeriesMicrographStack]): The CETS tilt series
+            for each tiltseries in the input file.
         ts_files (Dict[str, str]): The TiltSeriesMetadata node for each tilt series in
             the input file. {tilt_series_name: file path}
         gain_file (Optional[str]): Path to a gain reference file, which must be
             explicitly defined unless the input is from a motion corr job
         defect file (Optional[str]): Path to a detector defect file, which must be
             explicitly defined unless the input is from a motion corr job
+        header_cache (Optional[HeaderCache]): A persistent cache of MRC headers, if
+            provided image files that are unchanged since they were cached are not
+            read
+        probe_workers (int): The number of threads used to read the headers of the
+            movies in a tilt series
+        star_cache (StarFileCache): Holds the parsed STAR files so each one is only
+            parsed once.  A cache can be shared between converters.
+        jobs (int): The number of processes used to convert tilt series in parallel
+        conversion_errors (Dict[str, str]): Errors for tilt series that could not be
+            converted in parallel mode {tilt_series_name: error}
+        interner (ModelInterner): Provides shared instances of identical CTF and
+            transformation objects, so they are not duplicated for every frame
+        compact_movies (bool): Make CompactMovieStack objects, which hold the
+            per-frame values in arrays, rather than a MovieFrame object for every
+            frame of every movie
+        validation (ValidationLevel): How the objects made from the STAR file data
+            are validated. "full" validates every object as it is made, "construct"
+            skips validation and "final" validates each finished tilt series once
+        profiler (ConversionProfiler): Records the time taken by each stage of the
+            conversion, disabled unless a profiler is provided
     """
 
     def __init__(
@@ -154,14 +218,32 @@ class PipelinerTiltSeriesGroupConverter(object):
         gain_file: Optional[str] = None,
         defect_file: Optional[str] = None,
         motion_correction_job: Optional[str] = None,
+        header_cache: Optional[HeaderCache] = None,
+        probe_workers: int = 8,
+        star_cache: Optional[StarFileCache] = None,
+        jobs: int = 1,
+        compact_movies: bool = False,
+        validation: ValidationLevel = ValidationLevel.full,
+        profiler: Optional[ConversionProfiler] = None,
     ) -> None:
         self.input_file = input_file
         self.all_movie_sets: Dict[str, MovieStackSet] = {}
-        self.all_tilt_series: Dict[str, TomoImageSet] = {}
+        self.all_tilt_series: Dict[str, TiltSeriesMicrographStack] = {}
         self.ts_files: Dict[str, str] = {}
         self.gain_file = gain_file
         self.defect_file = defect_file
         self.motion_correction_job = motion_correction_job
+        self.header_cache = header_cache
+        self.probe_workers = probe_workers
+        self.star_cache = StarFileCache() if star_cache is None else star_cache
+        self.jobs = jobs
+        self.conversion_errors: Dict[str, str] = {}
+        self.interner = ModelInterner()
+        self.compact_movies = compact_movies
+        self.validation = ValidationLevel(validation)
+        self.profiler = (
+            ConversionProfiler(enabled=False) if profiler is None else profiler
+        )
 
     def get_motioncorr_transformation(self, stack_name: str, frame: int):
         """
@@ -170,108 +252,130 @@ class PipelinerTiltSeriesGroupConverter(object):
         self.motioncorrection_job...
         """
         # TODO: Replace this placeholder with actual function
-        return Transformation(
-            transform_type=TransformationType.translation,
-            trans_matrix=np.identity(2),
-            annotations=[
-                Annotation(
-                    description="<PLACEHOLDER FOR TRANSFORMATION DONE BY MOTIONCORR>"
-                )
-            ],
+        # the placeholder is the same for every frame so one instance is shared
+        return self.interner.shared(
+            "motioncorr_placeholder",
+            lambda: Transformation(
+                transform_type=TransformationType.translation,
+                trans_matrix=np.identity(2),
+                annotations=[
+                    Annotation(
+                        description="<PLACEHOLDER FOR TRANSFORMATION DONE BY MOTIONCORR>"
+                    )
+                ],
+            ),
         )
 
+    def probe_movie_dims(
+        self, movie_files: List[str]
+    ) -> List[Tuple[Optional[int], Optional[int], Optional[int]]]:
+        """Get the dimensions of a set of movies, reading their headers concurrently
+
+        The headers are read by :func:`~tomobabel.utils.probe_mrc_headers`, using a
+        pool of self.probe_workers threads.
+
+        Args:
+            movie_files (List[str]): The movie files
+
+        Returns:
+            List[Tuple[Optional[int], Optional[int], Optional[int]]]: The dimensions of
+                each movie, in the same order as movie_files, (None, None, None) if
+                the file was not found
+        """
+        headers = probe_mrc_headers(
+            [Path(x) for x in movie_files],
+            header_cache=self.header_cache,
+            max_workers=self.probe_workers,
+            profiler=self.profiler,
+        )
+        return [(None, None, None) if x is None else x.dims for x in headers]
+
     def get_movies_data(
-        self, tilt_series_block: cif.Block
+        self, tilt_series_block: Union[cif.Block, TiltSeriesTable]
     ) -> List[RelionTiltSeriesMovie]:
         """Get a RelionTiltSeriesMovie object for each tilt image in a tilt series
 
+        The headers of all the movies are read before the RelionTiltSeriesMovie
+        objects are created, see :meth:`probe_movie_dims`
+
         Args:
-            tilt_series_block (cif.Block): The data block from the
-                TiltSeriesMetadata node for a single tilt series
+            tilt_series_block (Union[cif.Block, TiltSeriesTable]): The data block from
+                the TiltSeriesMetadata node for a single tilt series, or the table
+                made from it
 
         Returns:
             List[RelionTiltSeriesMovie]: A RelionTiltSeriesMovie for each tilt image in
                 the tilt series
 
         """
-        movie_data = tilt_series_block.find(
-            "_rln",
-            [
-                "MicrographMovieName",
-                "TomoNominalStageTiltAngle",
-                "MicrographPreExposure",
-                "TomoTiltMovieFrameCount",
-                "MicrographPreExposure",
-                "TomoTiltMovieFrameCount",
-            ],
-        )
+        table = TiltSeriesTable.of(tilt_series_block)
 
         # get pixel sizes
-        ts_file = cif.read_file(str(self.input_file)).find_block("global")
+        ts_file = self.star_cache.get_block(self.input_file, "global")
         ts_loop = ts_file.find(
             prefix="_rln",
             tags=["TomoName", "MicrographOriginalPixelSize"],
         )
         pxsizes = dict(list(ts_loop))
 
-        exposures = [float(x[2]) for x in movie_data]
-        all_movs = [x[0] for x in movie_data]
-        frame_counts = [int(x[3]) for x in movie_data]
-        tilts = [float(x[1]) for x in movie_data]
-        pre_exp = [float(x[4]) for x in movie_data]
-        n_frames = [int(x[5]) for x in movie_data]
-        img_dose_per_frame = {}
-        for n, dose in enumerate(exposures[:-1]):
-            add_dose = exposures[n + 1] - dose
-            dpf = add_dose / frame_counts[n]
-            img_dose_per_frame[all_movs[n]] = dpf
-
-        # assume the last frame move has the same dose rate as prev
-        img_dose_per_frame[all_movs[-1]] = img_dose_per_frame[all_movs[-2]]
+        all_movs = table["MicrographMovieName"].tolist()
+        tilts = table["TomoNominalStageTiltAngle"].astype(float).tolist()
+        exposures = table["MicrographPreExposure"].astype(float)
+        frame_counts = table["TomoTiltMovieFrameCount"].astype(int)
+
+        # dose per frame from the difference in pre-exposure to the next tilt, assume
+        # the last movie has the same dose rate as the one before
+        dose_per_frame = np.empty(len(exposures))
+        dose_per_frame[:-1] = np.diff(exposures) / frame_counts[:-1]
+        dose_per_frame[-1] = dose_per_frame[-2]
+
+        movie_dims = self.probe_movie_dims(all_movs)
+        apix = float(pxsizes[table.name])
 
         tilt_movies = []
-        for mov in all_movs:
-            index = all_movs.index(mov)
+        for index, mov in enumerate(all_movs):
             tilt_movies.append(
                 RelionTiltSeriesMovie(
                     stack_file_path=Path(mov),
-                    dose_per_frame=img_dose_per_frame[mov],
+                    dose_per_frame=float(dose_per_frame[index]),
                     tilt=tilts[index],
-                    pre_exp=pre_exp[index],
-                    n_frames=n_frames[index],
-                    apix=float(pxsizes[tilt_series_block.name]),
+                    pre_exp=float(exposures[index]),
+                    n_frames=int(frame_counts[index]),
+                    apix=apix,
+                    dims=movie_dims[index],
                 )
             )
 
         return tilt_movies
 
     @staticmethod
-    def get_ctf_data(data_block: cif.Block, index: int) -> Optional[CTFMetadata]:
+    def get_ctf_data(
+        data_block: Union[cif.Block, TiltSeriesTable],
+        index: int,
+        validation: ValidationLevel = ValidationLevel.full,
+    ) -> Optional[CTFMetadata]:
         """Get CTF information for a tilt series
 
         Args:
-            tilt_series_block (cif.Block): The data block from the
-                TiltSeriesMetadata node for a single tilt series
+            data_block (Union[cif.Block, TiltSeriesTable]): The data block from the
+                TiltSeriesMetadata node for a single tilt series, or the table made
+                from it
             index (int): Which tilt image to get the CTF data for
+            validation (ValidationLevel): Whether to validate the CTFMetadata object
 
         Returns:
             Optional[CTFMetadata]: A CETS CTFMetadata for the tilt image
         """
+        table = TiltSeriesTable.of(data_block)
         ctf_obj: Optional[CTFMetadata] = None
 
-        if data_block.find("_rln", ["DefocusU"]):
-            ctf_data = data_block.find(
-                "_rln",
-                [
-                    "DefocusU",
-                    "DefocusV",
-                    "DefocusAngle",
-                ],
-            )
-            ctf_obj = CTFMetadata(
-                defocus_u=float(ctf_data[index][0]),
-                defocus_v=float(ctf_data[index][1]),
-                defocus_angle=float(ctf_data[index][2]),
+        if table.has("DefocusU", "DefocusV", "DefocusAngle"):
+            ctf_obj = build_model(
+                CTFMetadata,
+                validation,
+                defocus_u=float(table["DefocusU"][index]),
+                defocus_v=float(table["DefocusV"][index]),
+                defocus_angle=float(table["DefocusAngle"][index]),
             )
         return ctf_obj
 
@@ -296,7 +400,7 @@ class PipelinerTiltSeriesGroupConverter(object):
         if not jobstar.is_file():
             return None, None
         try:
-            params = cif.read_file(str(jobstar))
+            params = self.star_cache.read(jobstar)
             jobtype = params.find_block("job").find_pair("_rlnJobTypeLabel")[1]
             # if the job is a motioncorr job use it and ignore the defined files
             if jobtype.startswith("relion.motioncorr"):
@@ -315,12 +419,16 @@ class PipelinerTiltSeriesGroupConverter(object):
                         )
             gainfile, defectfile = None, None
             if self.gain_file is not None:
-                gain_height, gain_width = get_mrc_dims(Path(self.gain_file))[:2]
+                gain_height, gain_width = get_mrc_dims(
+                    Path(self.gain_file), header_cache=self.header_cache
+                )[:2]
                 gainfile = GainFile(
                     path=self.gain_file, height=gain_height, width=gain_width
                 )
             if self.defect_file is not None:
-                defect_height, defect_width = get_mrc_dims(Path(self.defect_file))[:2]
+                defect_height, defect_width = get_mrc_dims(
+                    Path(self.defect_file), header_cache=self.header_cache
+                )[:2]
                 defectfile = DefectFile(
                     path=self.defect_file, height=defect_height, width=defect_width
                 )
@@ -331,12 +439,13 @@ class PipelinerTiltSeriesGroupConverter(object):
 
     @staticmethod
     def get_alignment_transformation_data(
-        data_block: cif.Block, index: int, apix: float
+        data_block: Union[cif.Block, TiltSeriesTable], index: int, apix: float
     ) -> TiltSeriesMicrographAlignment:
         """Get transformation data for a single frame in a tilt series movie
 
         Args:
-            data_block(cif.Block): From the tilt series starfile
+            data_block (Union[cif.Block, TiltSeriesTable]): From the tilt series
+                starfile, or the table made from it
             index (int): The index of the frame in the data_block
             apix (float): The movie pixel size
 
@@ -345,19 +454,17 @@ class PipelinerTiltSeriesGroupConverter(object):
                 it couldn't be calculated.
 
         """
+        table = TiltSeriesTable.of(data_block)
         transformation_obj = TiltSeriesMicrographAlignment()
-        trans_data = data_block.find(
-            "_rln",
-            [
-                "TomoXShiftAngst",
-                "TomoYShiftAngst",
-                "TomoXTilt",
-                "TomoyTilt",
-                "TomoZRot",
-            ],
-        )
-        if trans_data:
-            xshift, yshift, xtilt, ytilt, rot = [float(x) for x in trans_data[index]]
+        labels = [
+            "TomoXShiftAngst",
+            "TomoYShiftAngst",
+            "TomoXTilt",
+            "TomoYTilt",
+            "TomoZRot",
+        ]
+        if table.has(*labels):
+            xshift, yshift, xtilt, ytilt, rot = [float(table[x][index]) for x in labels]
             xshift = xshift / apix  # TODO: make sure that this should be in pixels
             yshift = yshift / apix  # TODO: make sure that this should be in pixels
             transformation_obj.y_tilt = ytilt
@@ -370,27 +477,56 @@ class PipelinerTiltSeriesGroupConverter(object):
         return transformation_obj
 
     def make_movie_sets(
-        self, tilt_series_block: cif.Block, section: int, mov: RelionTiltSeriesMovie
+        self,
+        tilt_series_block: Union[cif.Block, TiltSeriesTable],
+        section: int,
+        mov: RelionTiltSeriesMovie,
     ) -> None:
         """Make a CETS MovieStackSet Object for each tilt series and update its
         RelionTiltSeriesMovie object
 
-        CTF and transformation are the same for every frame in the movie
+        CTF and transformation are the same for every frame in the movie. If
+        self.compact_movies is set the movie's stack is replaced with a
+        CompactMovieStack and no MovieFrame objects are made.
 
         Args:
-            tilt_series_block (cif.Block): The data block from the
-                TiltSeriesMetadata node for a single tilt series
+            tilt_series_block (Union[cif.Block, TiltSeriesTable]): The data block from
+                the TiltSeriesMetadata node for a single tilt series, or the table made
+                from it
+            section (int): The index of the movie in the tilt series
             mov (RelionTiltSeriesMovie): The movie object to update
         """
-        ctf_obj = self.get_ctf_data(tilt_series_block, section)
+        ctf_obj = self.get_ctf_data(tilt_series_block, section, self.validation)
+        if ctf_obj is not None:
+            ctf_obj = self.interner.intern(ctf_obj)
         mov.czii_movie_frames = []
+        if self.compact_movies:
+            frames = np.arange(mov.n_frames)
+            mov.czii_movie_stack = build_model(
+                CompactMovieStack,
+                self.validation,
+                path=mov.stack_file_path,
+                sections=frames,
+                accumulated_doses=mov.dose_per_frame * (frames + 1.0) + mov.pre_exp,
+                nominal_tilt_angle=mov.tilt,
+                height=mov.height,
+                width=mov.width,
+                ctf_metadata=ctf_obj,
+                motion_correction_transformations=[
+                    self.get_motioncorr_transformation(mov.stack_file_path, 0)
+                ],
+            )
+            return
+
         for n in range(mov.n_frames):
             mocorrxform = self.get_motioncorr_transformation(
                 stack_name=mov.stack_file_path,
                 frame=n,
             )
             mov.czii_movie_frames.append(
-                MovieFrame(
+                build_model(
+                    MovieFrame,
+                    self.validation,
                     path=mov.stack_file_path,
                     section=n,
                     nominal_tilt_angle=mov.tilt,
@@ -403,7 +539,12 @@ class PipelinerTiltSeriesGroupConverter(object):
             )
 
         # update the MovieStack
-        mov.czii_movie_stack.frame_images = mov.czii_movie_frames
+        mov.czii_movie_stack = build_model(
+            MovieStack,
+            self.validation,
+            frame_images=mov.czii_movie_frames,
+            path=mov.stack_file_path,
+        )
 
     def make_tilt_series_object(self, path, stacks) -> TiltSeriesMicrographStack:
         """Make a CETS TiltSeriesMicrographStack object for a tilt series
@@ -415,10 +556,17 @@ class PipelinerTiltSeriesGroupConverter(object):
         Returns:
             TiltSeriesMicrographStack: A CETS tilt serie object for the tilt series
         """
-        ts_obj = TiltSeriesMicrographStack(path=path, micrographs=[])
+        ts_obj = build_model(
+            TiltSeriesMicrographStack, self.validation, path=path, micrographs=[]
+        )
         for mss in stacks.movie_stacks:
-            img = mss.frame_images[-1]
-            proj_img = TiltSeriesMicrograph(
+            if isinstance(mss, CompactMovieStack):
+                img = mss.frame(-1)
+            else:
+                img = mss.frame_images[-1]
+            proj_img = build_model(
+                TiltSeriesMicrograph,
+                self.validation,
                 path=img.path,
                 nominal_tilt_angle=img.nominal_tilt_angle,
                 total_accumulated_dose=img.accumulated_dose,
@@ -437,21 +585,27 @@ class PipelinerTiltSeriesGroupConverter(object):
         {tilt series name: TiltSeriesMetadata star file}
 
         """
-        infile_cif = cif.read_file(str(self.input_file))
-        glob_block = infile_cif.find_block("global")
-        ts_files = list(glob_block.find("_rln", ["TomoName", "TomoTiltSeriesStarFile"]))
+        parses = self.star_cache.n_parses
+        with self.profiler.stage("read_star"):
+            infile_cif = self.star_cache.read(self.input_file)
+            glob_block = infile_cif.find_block("global")
+            ts_files = list(
+                glob_block.find("_rln", ["TomoName", "TomoTiltSeriesStarFile"])
+            )
+        self.profiler.count("star_files_parsed", self.star_cache.n_parses - parses)
         self.ts_files = {key: val for key, val in ts_files}
 
-    def do_conversion(self, tilt_series_names: Optional[List[str]] = None) -> None:
-        """Get the data in tilt series in CETS data model format
+    def select_tilt_series(self, tilt_series_names: Optional[List[str]]) -> None:
+        """Get the tilt series starfiles and limit them to the requested tilt series
 
         Args:
             tilt_series_names (Optional[List[str]]): Which tilt series to get the data
-                for.  If None operates on all tilt series in the input file.
+                for.  If None all tilt series in the input file are used.
+
+        Raises:
+            ValueError: If any of the tilt series are not in the input file
         """
         self.get_tilt_series_files()
-        # decide which tilt series to operate on, if user didn't specify any do all of
-        # them
         if tilt_series_names is not None:
             ts_starfiles = {}
             errs = []
@@ -460,7 +614,7 @@ class PipelinerTiltSeriesGroupConverter(object):
                     ts_starfiles[tilt_series] = self.ts_files[tilt_series]
                 except KeyError:
                     errs.append(tilt_series)
-                self.ts_files = ts_starfiles
+            self.ts_files = ts_starfiles
 
             if errs:
                 missing = ", ".join(errs)
@@ -468,22 +622,47 @@ class PipelinerTiltSeriesGroupConverter(object):
                     f"Tilt series {missing} not found in tilt series group starfile"
                 )
 
-        # operate on each tilt series separately
-        for ts_name in self.ts_files.keys():
-            # read the starfile for that tilt series and get data
-            tilt_series_sf = cif.read_file(self.ts_files[ts_name])
-            tilt_series_block = tilt_series_sf.find_block(ts_name)
+    def convert_tilt_series(
+        self,
+        ts_name: str,
+        gainfile: Optional[GainFile] = None,
+        defectfile: Optional[DefectFile] = None,
+    ) -> Tuple[MovieStackSet, TiltSeriesMicrographStack]:
+        """Convert a single tilt series
 
-            # get an RelionTiltSeriesMovie object to handle each movie
-            movies = self.get_movies_data(tilt_series_block)
+        Args:
+            ts_name (str): The name of the tilt series, it must be in self.ts_files
+            gainfile (Optional[GainFile]): The gain reference for the movies
+            defectfile (Optional[DefectFile]): The defect file for the movies
 
+        Returns:
+            Tuple[MovieStackSet, TiltSeriesMicrographStack]: The CETS objects for the
+                movies and the tilt series
+        """
+        start = time.perf_counter()
+        profiler = self.profiler
+        # read the starfile for that tilt series and get data
+        parses = self.star_cache.n_parses
+        with profiler.stage("read_star"):
+            tilt_series_block = self.star_cache.get_block(
+                self.ts_files[ts_name], ts_name
+            )
+            # extract all the columns in a single pass
+            ts_table = TiltSeriesTable.from_block(tilt_series_block)
+        profiler.count("star_files_parsed", self.star_cache.n_parses - parses)
+
+        # get an RelionTiltSeriesMovie object to handle each movie
+        movies = self.get_movies_data(ts_table)
+
+        with profiler.stage("build_models"):
             # make the MovieFrame Object for each frame in every movie
             for n, mov in enumerate(movies):
-                self.make_movie_sets(tilt_series_block, n, mov)
+                self.make_movie_sets(ts_table, n, mov)
 
             # make the MovieStackSet objects
-            gainfile, defectfile = self.get_gain_ref_and_defect_file()
-            ms_series = MovieStackSet(
+            ms_series = build_model(
+                MovieStackSet,
+                self.validation,
                 movie_stacks=[x.czii_movie_stack for x in movies],
                 annotations=[
                     Annotation(
@@ -497,8 +676,292 @@ class PipelinerTiltSeriesGroupConverter(object):
             ts_obj = self.make_tilt_series_object(
                 path=self.ts_files[ts_name], stacks=ms_series
             )
-            self.all_tilt_series[str(ts_name)] = ts_obj
-            self.all_movie_sets[str(ts_name)] = ms_series
+        if self.validation == ValidationLevel.final:
+            with profiler.stage("validate"):
+                validate_model_tree(ms_series)
+                validate_model_tree(ts_obj)
+
+        if profiler.enabled:
+            seconds = time.perf_counter() - start
+            profiler.add_time("convert_tilt_series", seconds)
+            profiler.record_tilt_series(
+                str(ts_name),
+                seconds=seconds,
+                movies=len(movies),
+                frames=sum(x.n_frames for x in movies),
+                objects=count_objects(ms_series, ts_obj),
+            )
+        return ms_series, ts_obj
+
+    def fingerprint_tilt_series(
+        self,
+        ts_names: List[str],
+        gainfile: Optional[GainFile] = None,
+        defectfile: Optional[DefectFile] = None,
+    ) -> Dict[str, str]:
+        """Get a fingerprint of all the inputs for a set of tilt series
+
+        The fingerprint is a hash of the tilt series' STAR block, its row in the tilt
+        series group STAR file, the job.star file, the headers of its movies and the
+        gain and defect files.  If none of these have changed converting the tilt
+        series again would give the same result.
+
+        Args:
+            ts_names (List[str]): The tilt series, they must be in self.ts_files
+            gainfile (Optional[GainFile]): The gain reference for the movies
+            defectfile (Optional[DefectFile]): The defect file for the movies
+
+        Returns:
+            Dict[str, str]: The fingerprint for each tilt series
+                {tilt_series_name: sha256 hex digest}
+        """
+        global_rows: Dict[str, str] = {}
+        for item in self.star_cache.get_block(self.input_file, "global"):
+            if item.loop is not None:
+                loop = item.loop
+                width = loop.width()
+                name_col = [x.lower() for x in loop.tags].index("_rlntomoname")
+                values = list(loop.values)
+                for row_start in range(0, len(values), width):
+                    row = values[row_start : row_start + width]
+                    global_rows[row[name_col]] = "\t".join(loop.tags + row)
+                break
+
+        jobstar = self.input_file.parent / "job.star"
+        job_hash = (
+            hashlib.sha256(jobstar.read_bytes()).hexdigest()
+            if jobstar.is_file()
+            else ""
+        )
+        shared = [
+            f"manifest:{MANIFEST_VERSION}",
+            job_hash,
+            gainfile.model_dump_json() if gainfile is not None else "",
+            defectfile.model_dump_json() if defectfile is not None else "",
+        ]
+
+        fingerprints = {}
+        for ts_name in ts_names:
+            block = self.star_cache.get_block(self.ts_files[ts_name], ts_name)
+            table = TiltSeriesTable.from_block(block)
+            movies = (
+                table["MicrographMovieName"].tolist()
+                if "MicrographMovieName" in table
+                else []
+            )
+            digest = hashlib.sha256()
+            for part in shared + [
+                global_rows.get(ts_name, ""),
+                block.as_string(),
+                json.dumps(self.probe_movie_dims(movies)),
+            ]:
+                digest.update(part.encode())
+                digest.update(b"\0")
+            fingerprints[ts_name] = digest.hexdigest()
+        return fingerprints
+
+    def iter_conversions(
+        self, tilt_series_names: Optional[List[str]] = None
+    ) -> Iterator[Tuple[str, MovieStackSet, TiltSeriesMicrographStack]]:
+        """Convert tilt series one at a time, yielding the results as they are made
+
+        The results are not stored in the converter, so only the tilt series being
+        converted needs to be held in memory.  They are yielded in the same order as
+        the tilt series are listed in the input file.
+
+        If self.jobs > 1 the tilt series are converted in parallel in separate
+        processes.  In this case an error converting a tilt series does not stop the
+        others being converted, the error is recorded in self.conversion_errors
+        instead and the tilt series is skipped.
+
+        Args:
+            tilt_series_names (Optional[List[str]]): Which tilt series to get the data
+                for.  If None operates on all tilt series in the input file.
+
+        Yields:
+            Tuple[str, MovieStackSet, TiltSeriesMicrographStack]: The name of the tilt
+                series and the CETS objects for its movies and tilt series
+        """
+        # decide which tilt series to operate on, if user didn't specify any do all of
+        # them
+        self.select_tilt_series(tilt_series_names)
+
+        # the gain and defect files are the same for every tilt series
+        gainfile, defectfile = self.get_gain_ref_and_defect_file()
+
+        if self.jobs > 1 and len(self.ts_files) > 1:
+            yield from self._iter_parallel_conversions(gainfile, defectfile)
+            return
+
+        # operate on each tilt series separately
+        for ts_name in self.ts_files.keys():
+            ms_series, ts_obj = self.convert_tilt_series(ts_name, gainfile, defectfile)
+            yield str(ts_name), ms_series, ts_obj
+
+    def do_conversion(self, tilt_series_names: Optional[List[str]] = None) -> None:
+        """Get the data in tilt series in CETS data model format
+
+        The results are stored in self.all_movie_sets and self.all_tilt_series, see
+        :meth:`iter_conversions` to convert the tilt series without keeping them all
+        in memory.
+
+        Args:
+            tilt_series_names (Optional[List[str]]): Which tilt series to get the data
+                for.  If None operates on all tilt series in the input file.
+        """
+        for ts_name, ms_series, ts_obj in self.iter_conversions(tilt_series_names):
+            self.all_tilt_series[ts_name] = ts_obj
+            self.all_movie_sets[ts_name] = ms_series
+
+    def check_conversion_errors(self) -> None:
+        """Log a summary of the tilt series that could not be converted, if any
+
+        Raises:
+            TiltSeriesConversionError: If any tilt series could not be converted
+        """
+        if not self.conversion_errors:
+            return
+        logger.error(
+            f"{len(self.conversion_errors)} of {len(self.ts_files)} tilt series could"
+            " not be converted:"
+        )
+        for ts_name, err in self.conversion_errors.items():
+            logger.error(f"    {ts_name}: {err}")
+        raise TiltSeriesConversionError(self.conversion_errors)
+
+    def _get_worker_settings(
+        self, gainfile: Optional[GainFile], defectfile: Optional[DefectFile]
+    ) -> "_WorkerSettings":
+        cache = self.header_cache
+        return _WorkerSettings(
+            input_file=self.input_file,
+            ts_files=dict(self.ts_files),
+            gainfile=gainfile,
+            defectfile=defectfile,
+            header_cache_path=None if cache is None else str(cache.path),
+            header_cache_size=200000 if cache is None else cache.max_entries,
+            probe_workers=self.probe_workers,
+            compact_movies=self.compact_movies,
+            validation=self.validation,
+            profile=self.profiler.enabled,
+        )
+
+    def _iter_parallel_conversions(
+        self, gainfile: Optional[GainFile], defectfile: Optional[DefectFile]
+    ) -> Iterator[Tuple[str, MovieStackSet, TiltSeriesMicrographStack]]:
+        """Convert the tilt series in a pool of self.jobs worker processes
+
+        The results are yielded in the same order as the tilt series are listed in
+        self.ts_files, whatever order the workers finish in.  Only a few tilt series
+        per worker are submitted ahead so finished results don't pile up in memory.
+        If profiling is enabled each worker returns the profile for its tilt series,
+        which is merged into self.profiler.
+
+        Args:
+            gainfile (Optional[GainFile]): The gain reference for the movies
+            defectfile (Optional[DefectFile]): The defect file for the movies
+
+        Yields:
+            Tuple[str, MovieStackSet, TiltSeriesMicrographStack]: The name of the tilt
+                series and the CETS objects for its movies and tilt series
+        """
+        if self.header_cache is not None:
+            self.header_cache.flush()
+        settings = self._get_worker_settings(gainfile, defectfile)
+        n_workers = min(self.jobs, len(self.ts_files))
+        to_submit = iter(list(self.ts_files))
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_worker,
+            initargs=(settings,),
+        ) as executor:
+            pending: Deque[Tuple[str, Future]] = deque()
+            for ts_name in islice(to_submit, 2 * n_workers):
+                pending.append((ts_name, executor.submit(_convert_in_worker, ts_name)))
+            while pending:
+                ts_name, future = pending.popleft()
+                next_ts = next(to_submit, None)
+                if next_ts is not None:
+                    pending.append(
+                        (next_ts, executor.submit(_convert_in_worker, next_ts))
+                    )
+                try:
+                    with self.profiler.stage("wait_for_workers"):
+                        ms_series, ts_obj, profile = future.result()
+                except Exception as e:
+                    err = f"{type(e).__name__}: {e}"
+                    logger.error(f"Error converting tilt series {ts_name}: {err}")
+                    self.conversion_errors[str(ts_name)] = err
+                    continue
+                if profile is not None:
+                    self.profiler.merge(profile)
+                yield str(ts_name), ms_series, ts_obj
+
+
+class _WorkerSettings(NamedTuple):
+    """Everything a worker process needs to convert tilt series from a project"""
+
+    input_file: Path
+    ts_files: Dict[str, str]
+    gainfile: Optional[GainFile]
+    defectfile: Optional[DefectFile]
+    header_cache_path: Optional[str]
+    header_cache_size: int
+    probe_workers: int
+    compact_movies: bool
+    validation: ValidationLevel
+    profile: bool
+
+
+# Each worker process has its own converter, so STAR files are only parsed once per
+# process rather than once per tilt series
+_worker_converter: Optional[PipelinerTiltSeriesGroupConverter] = None
+_worker_settings: Optional[_WorkerSettings] = None
+
+
+def _init_worker(settings: _WorkerSettings) -> None:
+    global _worker_converter, _worker_settings
+    header_cache = None
+    if settings.header_cache_path is not None:
+        header_cache = HeaderCache(
+            path=settings.header_cache_path, max_entries=settings.header_cache_size
+        )
+    _worker_converter = PipelinerTiltSeriesGroupConverter(
+        input_file=settings.input_file,
+        header_cache=header_cache,
+        probe_workers=settings.probe_workers,
+        compact_movies=settings.compact_movies,
+        validation=settings.validation,
+        profiler=ConversionProfiler(enabled=settings.profile),
+    )
+    _worker_converter.ts_files = settings.ts_files
+    _worker_settings = settings
+
+
+def _convert_in_worker(
+    ts_name: str,
+) -> Tuple[MovieStackSet, TiltSeriesMicrographStack, Optional[Dict]]:
+    """Convert a single tilt series in a worker process
+
+    Args:
+        ts_name (str): The tilt series to convert
+
+    Returns:
+        Tuple[MovieStackSet, TiltSeriesMicrographStack, Optional[Dict]]: The CETS
+            objects for the movies and the tilt series, and the profile of the
+            conversion if profiling is enabled
+    """
+    assert _worker_converter is not None and _worker_settings is not None
+    profiler = _worker_converter.profiler
+    profiler.reset()
+    try:
+        ms_series, ts_obj = _worker_converter.convert_tilt_series(
+            ts_name, _worker_settings.gainfile, _worker_settings.defectfile
+        )
+        return ms_series, ts_obj, profiler.to_dict() if profiler.enabled else None
+    finally:
+        if _worker_converter.header_cache is not None:
+            _worker_converter.header_cache.flush()
 
 
 def get_arguments() -> argparse.ArgumentParser:
@@ -508,6 +971,24 @@ def get_arguments() -> argparse.ArgumentParser:
     --tilt_series (optional): Which tilt series to operate on, if not use then operate
         on all
     --output (optional): Where to write the json file with the converted data
+    --gain_reference (optional): Path to the gain reference image
+    --defect_file (optional): Path to the defect file
+    --header_cache (optional): Use a persistent cache of image headers
+    --probe_workers (optional): Number of threads for reading image headers
+    --jobs (optional): Number of processes for converting tilt series in parallel
+    --stream (optional): Write each tilt series as it is converted
+    --incremental (optional): Only convert tilt series that have changed
+    --compact_movies (optional): Store per-frame values in arrays
+    --validation (optional): How to validate the converted objects
+    --deduplicate (optional): Write repeated objects once in the output files
+    --compact_json (optional): Write the JSON without indentation
+    --json_backend (optional): The JSON encoder to use
+    --array_sidecar (optional): Write numeric arrays to .npz files
+    --watch (optional): Convert tilt series as a running job writes them
+    --poll_interval (optional): Seconds between checks in --watch mode
+    --settle_time (optional): Seconds a file must be unchanged in --watch mode
+    --watch_timeout (optional): Stop watching after this many seconds
+    --profile (optional): Write a report of the time taken by each stage
 
     Returns:
         argparse.ArgumentParser: Contains the args
@@ -556,45 +1037,508 @@ def get_arguments() -> argparse.ArgumentParser:
         required=False,
         metavar="Defect file",
     )
+    add_header_cache_arguments(parser)
+    add_jobs_argument(parser)
+
+    parser.add_argument(
+        "--stream",
+        help=(
+            "Write the output files for each tilt series as soon as it is converted"
+            " rather than keeping them all in memory until the end. Requires --output"
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--incremental",
+        help=(
+            "Only convert tilt series whose inputs have changed since the last time"
+            " they were converted to this output, the outputs for the others are left"
+            " as they are. A manifest of what has been converted is kept with the"
+            " outputs. Requires --output"
+        ),
+        action="store_true",
+    )
+    add_compact_movies_argument(parser)
+    add_validation_argument(parser)
+    add_profile_argument(parser)
+    add_json_arguments(parser)
+    parser.add_argument(
+        "--deduplicate",
+        help=(
+            "Write objects that are repeated in many frames, such as CTF and"
+            ' transformations, once in a "$defs" section of each output file and refer'
+            ' to them with {"$ref": "#/$defs/<key>"}, which makes the files much'
+            " smaller. Objects are compared by their contents"
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--watch",
+        help=(
+            "Keep running and convert tilt series as they are written or updated by"
+            " a running RELION job. Implies --incremental and --stream, so converted"
+            " tilt series are not kept in memory. Requires --output"
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--poll_interval",
+        help="Seconds between checks for new or updated tilt series in --watch mode",
+        type=float,
+        default=10.0,
+        metavar="Poll interval",
+    )
+    parser.add_argument(
+        "--settle_time",
+        help=(
+            "Seconds a STAR file must be unchanged before it is read in --watch mode,"
+            " so files that are still being written are not converted"
+        ),
+        type=float,
+        default=30.0,
+        metavar="Settle time",
+    )
+    parser.add_argument(
+        "--watch_timeout",
+        help="Stop watching after this many seconds, if not set watch until stopped",
+        type=float,
+        metavar="Watch timeout",
+    )
 
     return parser
 
 
+def add_compact_movies_argument(parser: argparse.ArgumentParser) -> None:
+    """Add the argument for making compact movie stacks to a parser
+
+    Args:
+        parser (argparse.ArgumentParser): The parser to update
+    """
+    parser.add_argument(
+        "--compact_movies",
+        help=(
+            "Store the per-frame values of each movie in arrays rather than making an"
+            " object for every frame. Uses much less memory for movies with many"
+            " frames, and writes movie stacks in the compact format"
+        ),
+        action="store_true",
+    )
+
+
+def add_validation_argument(parser: argparse.ArgumentParser) -> None:
+    """Add the argument for the validation level of the converted objects to a parser
+
+    Args:
+        parser (argparse.ArgumentParser): The parser to update
+    """
+    parser.add_argument(
+        "--validation",
+        help=(
+            "How to validate the converted objects: 'full' validates every object as"
+            " it is made, 'construct' skips validation of the data read from the STAR"
+            " files, 'final' skips it while converting then validates each finished"
+            " tilt series once"
+        ),
+        choices=[x.value for x in ValidationLevel],
+        default=ValidationLevel.full.value,
+    )
+
+
+def add_profile_argument(parser: argparse.ArgumentParser) -> None:
+    """Add the argument for writing a profiling report to a parser
+
+    Args:
+        parser (argparse.ArgumentParser): The parser to update
+    """
+    parser.add_argument(
+        "--profile",
+        help=(
+            "Write a JSON report of the time taken and number of calls for each stage"
+            " of the conversion, the bytes read from image headers and the number of"
+            " objects made for each tilt series to this file"
+        ),
+        metavar="Profile report file",
+    )
+
+
+def add_json_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the arguments for how the JSON output is written to a parser
+
+    Args:
+        parser (argparse.ArgumentParser): The parser to update
+    """
+    parser.add_argument(
+        "--compact_json",
+        help=(
+            "Write the JSON output without indentation or spaces, which makes the files"
+            " smaller and quicker to write"
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--json_backend",
+        help=(
+            "The JSON encoder to use: 'pydantic' encodes the objects directly and is"
+            " the fastest, 'orjson' uses orjson if it is installed, it indents by 2"
+            " spaces, 'json' uses the json module, which is much slower but writes"
+            " floats exactly as earlier versions did"
+        ),
+        choices=JSON_BACKENDS,
+        default="pydantic",
+    )
+    parser.add_argument(
+        "--array_sidecar",
+        help=(
+            "Write the numeric arrays, such as transformation matrices, to a .npz file"
+            " next to each JSON file rather than as lists in the JSON, where they are"
+            " referred to by key. The JSON files are much smaller and quicker to read"
+        ),
+        action="store_true",
+    )
+
+
+def add_jobs_argument(parser: argparse.ArgumentParser) -> None:
+    """Add the argument for converting tilt series in parallel to a parser
+
+    Args:
+        parser (argparse.ArgumentParser): The parser to update
+    """
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        help=(
+            "Number of processes to use to convert tilt series in parallel. If more"
+            " than 1 a tilt series that fails to convert is reported and skipped"
+            " rather than stopping the conversion"
+        ),
+        type=int,
+        default=1,
+        metavar="Number of processes",
+    )
+
+
+def add_header_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the arguments for the persistent image header cache to a parser
+
+    Args:
+        parser (argparse.ArgumentParser): The parser to update
+    """
+    parser.add_argument(
+        "--header_cache",
+        help=(
+            "Cache image headers so unchanged files are not read again on later runs."
+            " Optionally give the path of the cache database, if no path is given the"
+            " default in the user's cache dir is used"
+        ),
+        nargs="?",
+        const="",
+        metavar="Header cache file",
+    )
+    parser.add_argument(
+        "--header_cache_size",
+        help="Maximum number of image headers to keep in the header cache",
+        type=int,
+        default=200000,
+        metavar="Header cache size",
+    )
+    parser.add_argument(
+        "--probe_workers",
+        help="Number of threads used to read image headers concurrently",
+        type=int,
+        default=8,
+        metavar="Header probe threads",
+    )
+
+
+def get_header_cache(args: argparse.Namespace) -> Optional[HeaderCache]:
+    """Get the header cache requested by the command line arguments, if any
+
+    Args:
+        args (argparse.Namespace): Parsed args from a parser updated with
+            :func:`add_header_cache_arguments`
+
+    Returns:
+        Optional[HeaderCache]: The header cache or None if one wasn't requested
+    """
+    if args.header_cache is None:
+        return None
+    return HeaderCache(
+        path=args.header_cache or None, max_entries=args.header_cache_size
+    )
+
+
+def get_output_prefix(output: str) -> Path:
+    """Check the output prefix and make the output dir if one is requested
+
+    Args:
+        output (str): The output prefix or dir name, dir names end with "/"
+
+    Returns:
+        Path: The output prefix or dir
+
+    Raises:
+        ValueError: If the output looks like a file name
+    """
+    out = Path(output)
+    if bool(out.suffix):
+        raise ValueError("Output should be a prefix or dir name, not a file name")
+    if output.endswith("/"):
+        out.mkdir(parents=True, exist_ok=True)
+    return out
+
+
+def write_tilt_series_outputs(
+    out: Path,
+    ts_name: str,
+    movie_set: MovieStackSet,
+    tilt_series: TiltSeriesMicrographStack,
+    deduplicate: bool = False,
+    profiler: Optional[ConversionProfiler] = None,
+    compact_json: bool = False,
+    json_backend: str = "pydantic",
+    array_sidecar: bool = False,
+) -> Tuple[Path, Path]:
+    """Write the json files for a converted tilt series
+
+    Args:
+        out (Path): The output prefix or dir
+        ts_name (str): The name of the tilt series
+        movie_set (MovieStackSet): The CETS MovieStackSet for the tilt series
+        tilt_series (TiltSeriesMicrographStack): The CETS tilt series object
+        deduplicate (bool): Write objects that are used by several frames once,
+            and refer to them with {"$ref": "#/$defs/<key>"}.  Objects with the same
+            contents are written once even if they are different instances, see
+            :func:`~src.tomobabel.interning.dump_deduplicated`
+        profiler (Optional[ConversionProfiler]): Records the time taken to serialise
+            and write the objects
+        compact_json (bool): Write the json without indentation or spaces
+        json_backend (str): The JSON encoder to use, see
+            :data:`~src.tomobabel.serialization.JSON_BACKENDS`
+        array_sidecar (bool): Write the numeric arrays to a .npz sidecar next to each
+            json file, see :class:`~src.tomobabel.serialization.ArraySidecar`
+
+    Returns:
+        Tuple[Path, Path]: The tilt series and movie set files written
+    """
+    if profiler is None:
+        profiler = ConversionProfiler(enabled=False)
+    if out.is_dir():
+        ts_file = out / f"{ts_name}_tilt_series.json"
+        ms_file = out / f"{ts_name}_movie_set.json"
+    else:
+        ts_file = Path(str(out) + f"_{ts_name}_tilt_series.json")
+        ms_file = Path(str(out) + f"_{ts_name}_movie_set.json")
+
+    for outfile, obj in ((ts_file, tilt_series), (ms_file, movie_set)):
+        with profiler.stage("serialize"):
+            data = dump_deduplicated(obj, by_value=True) if deduplicate else obj
+        write_json(outfile, data, compact_json, json_backend, profiler, array_sidecar)
+    return ts_file, ms_file
+
+
+def get_manifest_path(out: Path) -> Path:
+    """Get the path of the conversion manifest for an output prefix or dir
+
+    Args:
+        out (Path): The output prefix or dir
+
+    Returns:
+        Path: The manifest file
+    """
+    if out.is_dir():
+        return out / "conversion_manifest.json"
+    return Path(str(out) + "_conversion_manifest.json")
+
+
+def run_incremental_conversion(
+    converter: PipelinerTiltSeriesGroupConverter,
+    out: Path,
+    tilt_series_names: Optional[List[str]] = None,
+    stream: bool = False,
+    deduplicate: bool = False,
+    compact_json: bool = False,
+    json_backend: str = "pydantic",
+    array_sidecar: bool = False,
+) -> List[str]:
+    """Convert only the tilt series whose inputs have changed since the last run
+
+    The fingerprint of each tilt series' inputs is compared with the one recorded in
+    the manifest in the output dir.  Tilt series that are unchanged, and whose output
+    files still exist, are skipped and their existing output files are left as they
+    are. The rest are converted and written, and the manifest is updated.  If the
+    manifest was written with different output settings, for example without
+    deduplication, all the tilt series are converted again.
+
+    Args:
+        converter (PipelinerTiltSeriesGroupConverter): The converter to use
+        out (Path): The output prefix or dir
+        tilt_series_names (Optional[List[str]]): Which tilt series to operate on. If
+            None operates on all tilt series in the input file.
+        stream (bool): Don't keep the converted tilt series in the converter
+        deduplicate (bool): Write shared objects once in the output files
+        compact_json (bool): Write the json without indentation or spaces
+        json_backend (str): The JSON encoder to use
+        array_sidecar (bool): Write the numeric arrays to sidecar files
+
+    Returns:
+        List[str]: The names of the tilt series that were converted
+    """
+    settings = {
+        "deduplicate": deduplicate,
+        "compact_movies": converter.compact_movies,
+        "validation": converter.validation.value,
+        "compact_json": compact_json,
+        "json_backend": json_backend,
+        "array_sidecar": array_sidecar,
+    }
+    manifest = ConversionManifest.load(get_manifest_path(out), settings)
+    converter.select_tilt_series(tilt_series_names)
+    gainfile, defectfile = converter.get_gain_ref_and_defect_file()
+    with converter.profiler.stage("fingerprint"):
+        fingerprints = converter.fingerprint_tilt_series(
+            list(converter.ts_files), gainfile, defectfile
+        )
+    changed = [x for x in fingerprints if not manifest.is_current(x, fingerprints[x])]
+    logger.info(
+        f"{len(fingerprints) - len(changed)} tilt series unchanged,"
+        f" {len(changed)} to convert"
+    )
+
+    converted = []
+    # the manifest is saved even if a tilt series fails, so the ones already written
+    # aren't converted again next time
+    try:
+        if changed:
+            for ts_name, movie_set, tilt_series in converter.iter_conversions(changed):
+                outputs = list(
+                    write_tilt_series_outputs(
+                        out,
+                        ts_name,
+                        movie_set,
+                        tilt_series,
+                        deduplicate,
+                        converter.profiler,
+                        compact_json,
+                        json_backend,
+                        array_sidecar,
+                    )
+                )
+                if array_sidecar:
+                    outputs += [get_sidecar_path(x) for x in outputs]
+                manifest.update(ts_name, fingerprints[ts_name], outputs)
+                converted.append(ts_name)
+                if not stream:
+                    converter.all_tilt_series[ts_name] = tilt_series
+                    converter.all_movie_sets[ts_name] = movie_set
+    finally:
+        manifest.save()
+    return converted
+
+
 def main(in_args=None) -> PipelinerTiltSeriesGroupConverter:
+    """Convert a RELION tilt series group and write the outputs
+
+    The outputs for the tilt series that were converted are written even if others
+    failed, then the failures are reported.
+
+    Returns:
+        PipelinerTiltSeriesGroupConverter: The converter
+
+    Raises:
+        TiltSeriesConversionError: If some tilt series could not be converted, except
+            in --watch mode where they are tried again
+    """
     if in_args is None:
         in_args = sys.argv[1:]
     parser = get_arguments()
     args = parser.parse_args(in_args)
+    for opt in ("stream", "incremental", "watch"):
+        if getattr(args, opt) and not args.output:
+            raise ValueError(f"An output must be specified to use --{opt}")
+    out = get_output_prefix(args.output) if args.output else None
 
     # get converter object and do the conversion
+    header_cache = get_header_cache(args)
     converter = PipelinerTiltSeriesGroupConverter(
-        Path(args.input_starfile), args.gain_reference, args.defect_file
+        Path(args.input_starfile),
+        args.gain_reference,
+        args.defect_file,
+        header_cache=header_cache,
+        probe_workers=args.probe_workers,
+        jobs=args.jobs,
+        compact_movies=args.compact_movies,
+        validation=args.validation,
+        profiler=ConversionProfiler() if args.profile else None,
     )
-    converter.do_conversion(args.tilt_series)
-
-    if args.output:
-        out = Path(args.output)
-        if bool(Path(args.output).suffix):
-            raise ValueError("Output should be a prefix or dir name, not a file name")
-        if args.output.endswith("/"):
-            out.mkdir(parents=True, exist_ok=True)
-
-        for tilt_series in converter.all_tilt_series:
-            if out.is_dir():
-                outfile = out / f"{tilt_series}_tilt_series.json"
-            else:
-                outfile = Path(str(out) + f"_{tilt_series}_tilt_series.json")
-            ts_dict = converter.all_tilt_series[tilt_series].model_dump()
-            with open(outfile, "w") as to_write:
-                json.dump(ts_dict, to_write, indent=4, cls=NumpyEncoder)
-
-        for movie_set in converter.all_movie_sets:
-            if out.is_dir():
-                outfile = out / f"{movie_set}_movie_set.json"
-            else:
-                outfile = Path(str(out) + f"_{movie_set}_movie_set.json")
-            mc_dict = converter.all_movie_sets[movie_set].model_dump()
-            with open(outfile, "w") as to_write:
-                json.dump(mc_dict, to_write, indent=4, cls=NumpyEncoder)
+    try:
+        if out is None or not (args.watch or args.incremental or args.stream):
+            converter.do_conversion(args.tilt_series)
+        elif args.watch:
+            # imported here as the watcher uses this module
+            from src.tomobabel.converters.relion.relion_watch import (
+                TiltSeriesWatcher,
+            )
+
+            TiltSeriesWatcher(
+                converter,
+                out,
+                tilt_series_names=args.tilt_series,
+                poll_interval=args.poll_interval,
+                settle_time=args.settle_time,
+                deduplicate=args.deduplicate,
+                compact_json=args.compact_json,
+                json_backend=args.json_backend,
+                array_sidecar=args.array_sidecar,
+            ).run(timeout=args.watch_timeout)
+        elif args.incremental:
+            run_incremental_conversion(
+                converter,
+                out,
+                args.tilt_series,
+                args.stream,
+                args.deduplicate,
+                args.compact_json,
+                args.json_backend,
+                args.array_sidecar,
+            )
+        else:
+            # write each tilt series as soon as it is converted and don't keep it
+            for ts_name, movie_set, tilt_series in converter.iter_conversions(
+                args.tilt_series
+            ):
+                write_tilt_series_outputs(
+                    out,
+                    ts_name,
+                    movie_set,
+                    tilt_series,
+                    args.deduplicate,
+                    converter.profiler,
+                    args.compact_json,
+                    args.json_backend,
+                    args.array_sidecar,
+                )
+    finally:
+        if header_cache is not None:
+            header_cache.close()
+            converter.header_cache = None
+
+    if out is not None and not (args.stream or args.incremental or args.watch):
+        for ts_name in converter.all_tilt_series:
+            write_tilt_series_outputs(
+                out,
+                ts_name,
+                converter.all_movie_sets[ts_name],
+                converter.all_tilt_series[ts_name],
+                args.deduplicate,
+                converter.profiler,
+                args.compact_json,
+                args.json_backend,
+                args.array_sidecar,
+            )
 
+    if args.profile:
+        converter.profiler.write(args.profile)
+    # in watch mode tilt series that fail are tried again rather than reported
+    if not args.watch:
+        converter.check_conversion_errors()
     return converter
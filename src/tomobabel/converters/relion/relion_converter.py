@@ -1,14 +1,29 @@
 import argparse
-import json
+import logging
 import sys
 from pathlib import Path
-from typing import Optional, List
+from typing import Dict, Optional, List, Mapping, Sequence
 
 from src.tomobabel.converters.relion.relion_convert_tilt_series import (
     PipelinerTiltSeriesGroupConverter,
+    add_compact_movies_argument,
+    add_header_cache_arguments,
+    add_jobs_argument,
+    add_json_arguments,
+    add_profile_argument,
+    add_validation_argument,
+    get_header_cache,
 )
+from src.tomobabel.converters.relion.relion_particles import RelionParticleConverter
+from src.tomobabel.converters.relion.relion_starfiles import StarFileCache
+from src.tomobabel.converters.relion.relion_tomograms import RelionTomogramConverter
+from src.tomobabel.mrc_headers import HeaderCache
+from src.tomobabel.models.basemodels import ValidationLevel
 from src.tomobabel.models.top_level import DataSet, Region, TomoImageSet
-from src.tomobabel.utils import NumpyEncoder
+from src.tomobabel.profiling import ConversionProfiler
+from src.tomobabel.serialization import write_json
+
+logger = logging.getLogger(__name__)
 
 
 def get_tilt_series_data(
@@ -16,6 +31,13 @@ def get_tilt_series_data(
     tilt_series: Optional[List[str]],
     gain_file: Optional[str],
     defect_file: Optional[str],
+    header_cache: Optional[HeaderCache] = None,
+    probe_workers: int = 8,
+    star_cache: Optional[StarFileCache] = None,
+    jobs: int = 1,
+    compact_movies: bool = False,
+    validation: ValidationLevel = ValidationLevel.full,
+    profiler: Optional[ConversionProfiler] = None,
 ) -> PipelinerTiltSeriesGroupConverter:
     """Get data about the tilt series, including movie frames
 
@@ -30,17 +52,114 @@ def get_tilt_series_data(
         defect_file (Optional[str]): Path for the detector defect file. This info can
             only be gathered automatically if the input file is for a MotionCorr job,
             so it must be specified
+        header_cache (Optional[HeaderCache]): A persistent cache of MRC headers to use
+            instead of reading unchanged image files
+        probe_workers (int): Number of threads used to read the image headers
+        star_cache (Optional[StarFileCache]): A cache of parsed STAR files to share
+            with other conversions, if None a new one is used
+        jobs (int): Number of processes used to convert the tilt series in parallel
+        compact_movies (bool): Make CompactMovieStack objects for the movies
+        validation (ValidationLevel): How to validate the converted objects
+        profiler (Optional[ConversionProfiler]): Records the time taken by each stage
+            of the conversion
 
     """
     converter = PipelinerTiltSeriesGroupConverter(
-        input_file=Path(input_file), gain_file=gain_file, defect_file=defect_file
+        input_file=Path(input_file),
+        gain_file=gain_file,
+        defect_file=defect_file,
+        header_cache=header_cache,
+        probe_workers=probe_workers,
+        star_cache=star_cache,
+        jobs=jobs,
+        compact_movies=compact_movies,
+        validation=validation,
+        profiler=profiler,
     )
     converter.do_conversion(tilt_series_names=tilt_series)
     return converter
 
 
-# TODO: currently only does tilt series, need to add tomograms, particles, averages, and
-#  other data  types
+def get_tomogram_data(
+    input_file: str,
+    header_cache: Optional[HeaderCache] = None,
+    probe_workers: int = 8,
+    star_cache: Optional[StarFileCache] = None,
+    validation: ValidationLevel = ValidationLevel.full,
+    profiler: Optional[ConversionProfiler] = None,
+) -> RelionTomogramConverter:
+    """Get data about the tomograms, reading only the headers of the tomogram files
+
+    Args:
+        input_file (str): Path to the RELION tomograms STAR file
+        header_cache (Optional[HeaderCache]): A persistent cache of MRC headers to use
+            instead of reading unchanged tomograms
+        probe_workers (int): Number of threads used to read the tomogram headers
+        star_cache (Optional[StarFileCache]): A cache of parsed STAR files to share
+            with other conversions, if None a new one is used
+        validation (ValidationLevel): How to validate the converted objects
+        profiler (Optional[ConversionProfiler]): Records the time taken by each stage
+            of the conversion
+
+    Returns:
+        RelionTomogramConverter: The converter with a tomogram set for each tilt series
+    """
+    converter = RelionTomogramConverter(
+        input_file=Path(input_file),
+        header_cache=header_cache,
+        probe_workers=probe_workers,
+        star_cache=star_cache,
+        validation=validation,
+        profiler=profiler,
+    )
+    converter.do_conversion()
+    return converter
+
+
+def get_particle_data(
+    input_file: str,
+    tomogram_sizes: Optional[Mapping[str, Sequence[int]]] = None,
+    tomogram_size: Optional[Sequence[int]] = None,
+    star_cache: Optional[StarFileCache] = None,
+    particle_objects: bool = False,
+    validation: ValidationLevel = ValidationLevel.full,
+    profiler: Optional[ConversionProfiler] = None,
+) -> RelionParticleConverter:
+    """Get the particle coordinates in each tomogram
+
+    Args:
+        input_file (str): Path to the RELION particles STAR file
+        tomogram_sizes (Optional[Mapping[str, Sequence[int]]]): The x, y, z size of each
+            tomogram in unbinned tilt series pixels, only needed if the particle
+            coordinates are in pixels
+        tomogram_size (Optional[Sequence[int]]): The size of any tomograms not in
+            tomogram_sizes
+        star_cache (Optional[StarFileCache]): A cache of parsed STAR files to share
+            with other conversions, if None a new one is used
+        particle_objects (bool): Make a Particle object for every particle rather than
+            holding them in arrays
+        validation (ValidationLevel): How to validate the converted objects
+        profiler (Optional[ConversionProfiler]): Records the time taken by each stage
+            of the conversion
+
+    Returns:
+        RelionParticleConverter: The converter with a particle set for each tomogram
+    """
+    converter = RelionParticleConverter(
+        input_file=Path(input_file),
+        tomogram_sizes=tomogram_sizes,
+        tomogram_size=tomogram_size,
+        star_cache=star_cache,
+        particle_objects=particle_objects,
+        validation=validation,
+        profiler=profiler,
+    )
+    converter.do_conversion()
+    return converter
+
+
+# TODO: currently only does tilt series, tomograms and particles, need to add averages
+#  and other data types
 def get_arguments() -> argparse.ArgumentParser:
     """Get the args for running
 
@@ -50,6 +169,20 @@ def get_arguments() -> argparse.ArgumentParser:
     --output (optional): Where to write the json file with the converted data
     --gain_reference (optional): Path to the gain reference image
     --defect_file (optional): Path to the defect file
+    --header_cache (optional): Use a persistent cache of image headers
+    --probe_workers (optional): Number of threads for reading image headers
+    --jobs (optional): Number of processes for converting tilt series in parallel
+    --compact_movies (optional): Store per-frame values in arrays
+    --validation (optional): How to validate the converted objects
+    --profile (optional): Write a report of the time taken by each stage
+    --compact_json (optional): Write the JSON without indentation
+    --json_backend (optional): The JSON encoder to use
+    --array_sidecar (optional): Write numeric arrays to a .npz file
+    --tomograms_starfile (optional): A RELION tomograms STAR file to convert
+    --particles_starfile (optional): A RELION particles STAR file to convert
+    --tomogram_size (optional): The size of the tomograms, for particle coordinates in
+        pixels
+    --particle_objects (optional): Make an object for every particle
 
     Returns:
         argparse.ArgumentParser: Contains the args
@@ -93,6 +226,49 @@ def get_arguments() -> argparse.ArgumentParser:
         required=False,
         metavar="Defect file",
     )
+    add_header_cache_arguments(parser)
+    add_jobs_argument(parser)
+    add_compact_movies_argument(parser)
+    add_validation_argument(parser)
+    add_profile_argument(parser)
+    add_json_arguments(parser)
+
+    parser.add_argument(
+        "--tomograms_starfile",
+        help=(
+            "RELION tomograms STAR file from a reconstruction job, the tomograms are"
+            " added to their tilt series"
+        ),
+        nargs="?",
+        required=False,
+    )
+    parser.add_argument(
+        "--particles_starfile",
+        "-p",
+        help="RELION particles STAR file, the particles are added to the regions",
+        nargs="?",
+        required=False,
+    )
+    parser.add_argument(
+        "--tomogram_size",
+        help=(
+            "The x, y, z size of the tomograms in unbinned tilt series pixels, only"
+            " needed if the particle coordinates are in pixels rather than centered"
+            " coordinates in Å and the sizes are not in --tomograms_starfile"
+        ),
+        nargs=3,
+        type=int,
+        metavar=("X", "Y", "Z"),
+    )
+    parser.add_argument(
+        "--particle_objects",
+        help=(
+            "Make a Particle object for every particle, rather than holding the"
+            " particles in each tomogram in arrays.  This is much slower and uses much"
+            " more memory for large numbers of particles"
+        ),
+        action="store_true",
+    )
 
     return parser
 
@@ -100,43 +276,114 @@ def get_arguments() -> argparse.ArgumentParser:
 def main(in_args=None) -> DataSet:
     """Do conversions and output a single czii Dataset object
 
-    Each tilt series/tomogram is given a Region.
+    Each tilt series/tomogram is given a Region.  Each tilt series is added to the
+    MovieStackSet of its movies, tomograms are added to the tilt series they were
+    reconstructed from, and the particles picked in a tomogram are added to the
+    annotations of its Region.
+
+    The output is written even if some tilt series could not be converted, then the
+    failures are reported.
 
     Returns:
         Dataset: CETS Dataset object
+
+    Raises:
+        TiltSeriesConversionError: If some tilt series could not be converted
     """
     if in_args is None:
         in_args = sys.argv[1:]
     parser = get_arguments()
     args = parser.parse_args(in_args)  # create the DataSet object
 
+    profiler = ConversionProfiler(enabled=bool(args.profile))
+
     # write the tilt series data to the Dataset
-    converted_tilt_series = get_tilt_series_data(
-        args.tilt_series_starfile,
-        args.tilt_series_names,
-        args.gain_reference,
-        args.defect_file,
-    )
-    regions = []
-    for tilt_series in converted_tilt_series.all_tilt_series:
-        movie_stack_collections = converted_tilt_series.all_movie_sets[tilt_series]
-        tiltseries_container = TomoImageSet(raw_movies=movie_stack_collections)
-        region = Region(tomo_imaging=[tiltseries_container])
-        regions.append(region)
-    dataset = DataSet(regions=regions)
+    header_cache = get_header_cache(args)
+    try:
+        converted_tilt_series = get_tilt_series_data(
+            args.tilt_series_starfile,
+            args.tilt_series_names,
+            args.gain_reference,
+            args.defect_file,
+            header_cache=header_cache,
+            probe_workers=args.probe_workers,
+            jobs=args.jobs,
+            compact_movies=args.compact_movies,
+            validation=ValidationLevel(args.validation),
+            profiler=profiler,
+        )
+        tomograms = None
+        if args.tomograms_starfile:
+            tomograms = get_tomogram_data(
+                args.tomograms_starfile,
+                header_cache=header_cache,
+                probe_workers=args.probe_workers,
+                star_cache=converted_tilt_series.star_cache,
+                validation=ValidationLevel(args.validation),
+                profiler=profiler,
+            )
+            unlinked = tomograms.link_to_tilt_series(
+                converted_tilt_series.all_tilt_series
+            )
+            if unlinked:
+                logger.warning(
+                    f"Tomograms with no tilt series were left out: {', '.join(unlinked)}"
+                )
+    finally:
+        if header_cache is not None:
+            header_cache.close()
+    particle_sets = {}
+    if args.particles_starfile:
+        particle_sets = get_particle_data(
+            args.particles_starfile,
+            tomogram_sizes=None if tomograms is None else tomograms.tomogram_sizes,
+            tomogram_size=args.tomogram_size,
+            star_cache=converted_tilt_series.star_cache,
+            particle_objects=args.particle_objects,
+            validation=ValidationLevel(args.validation),
+            profiler=profiler,
+        ).particle_sets
+
+    with profiler.stage("build_dataset"):
+        regions: Dict[str, Region] = {}
+        for tilt_series in converted_tilt_series.all_tilt_series:
+            movie_stack_collections = converted_tilt_series.all_movie_sets[tilt_series]
+            # the tilt series is held with its movies, and holds the tomograms that
+            # were reconstructed from it, if any
+            ts_obj = converted_tilt_series.all_tilt_series[tilt_series]
+            movie_stack_collections.tilt_series.append(ts_obj)
+            tiltseries_container = TomoImageSet(raw_movies=movie_stack_collections)
+            regions[tilt_series] = Region(tomo_imaging=[tiltseries_container])
+        # tomograms are named after their tilt series
+        for tomogram, particle_set in particle_sets.items():
+            if tomogram not in regions:
+                regions[tomogram] = Region()
+            regions[tomogram].add_annotation(particle_set)
+        dataset = DataSet(regions=list(regions.values()))
 
     # TODO: Add the other data types to the appropriate Regions
 
     # write output if requested
     if args.output:
-        out = Path(args.output_name)
+        out = Path(args.output)
         if out.suffix != ".json":
-            out = Path(args.output_name + ".json")
+            out = Path(args.output + ".json")
         out.parent.mkdir(exist_ok=True)
-        data = dataset.model_dump()
-        with open(out, "w") as outfile:
-            json.dump(data, outfile, indent=4, cls=NumpyEncoder)
+        # the dataset is written a region at a time so the whole of the JSON is
+        # never held in memory, other backends can only encode it all at once
+        write_json(
+            out,
+            dataset,
+            args.compact_json,
+            args.json_backend,
+            profiler,
+            args.array_sidecar,
+            stream=args.json_backend == "pydantic",
+        )
 
+    if args.profile:
+        profiler.write(args.profile)
+    converted_tilt_series.check_conversion_errors()
     return dataset
 
 
@@ -0,0 +1,123 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+"""Records what has already been converted so unchanged tilt series can be skipped
+
+The manifest is a json file written alongside the converted outputs.  For each tilt
+series it holds a fingerprint of all the inputs that went into the conversion and the
+output files that were written.  The settings that change what is written, such as
+deduplication or the JSON format, are recorded for the whole manifest; if they differ
+from the current settings every tilt series is converted again:
+
+    {
+        "version": 1,
+        "settings": {"deduplicate": false, "compact_json": false, ...},
+        "tilt_series": {
+            "TS_01": {
+                "fingerprint": "<sha256 hex digest>",
+                "outputs": ["out/TS_01_tilt_series.json", "out/TS_01_movie_set.json"]
+            }
+        }
+    }
+"""
+
+MANIFEST_VERSION = 1
+
+
+class ConversionManifest(object):
+    """The fingerprints and outputs of previously converted tilt series
+
+    Attributes:
+        path (Path): The manifest file
+        settings (Dict[str, Any]): The output settings the tilt series were
+            converted with
+        entries (Dict[str, Dict[str, Union[str, List[str]]]]): The fingerprint and
+            output files for each tilt series {tilt_series_name: {"fingerprint": str,
+            "outputs": [file, ...]}}
+    """
+
+    def __init__(self, path: Path, settings: Optional[Dict[str, Any]] = None) -> None:
+        self.path = path
+        self.settings = settings if settings is not None else {}
+        self.entries: Dict[str, Dict[str, Union[str, List[str]]]] = {}
+
+    @classmethod
+    def load(
+        cls, path: Path, settings: Optional[Dict[str, Any]] = None
+    ) -> "ConversionManifest":
+        """Read a manifest file
+
+        If the file doesn't exist, can't be read, is from a different version of
+        the manifest format or was written with different output settings an empty
+        manifest is returned, so everything will be converted again.
+
+        Args:
+            path (Path): The manifest file
+            settings (Optional[Dict[str, Any]]): The current output settings
+
+        Returns:
+            ConversionManifest: The manifest, with the current settings
+        """
+        manifest = cls(path, settings)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return manifest
+        if (
+            isinstance(data, dict)
+            and data.get("version") == MANIFEST_VERSION
+            and data.get("settings", {}) == manifest.settings
+        ):
+            manifest.entries = data.get("tilt_series", {})
+        return manifest
+
+    def is_current(self, ts_name: str, fingerprint: str) -> bool:
+        """Check if the outputs for a tilt series are up to date
+
+        Args:
+            ts_name (str): The name of the tilt series
+            fingerprint (str): The fingerprint of the tilt series' current inputs
+
+        Returns:
+            bool: True if the tilt series was converted from the same inputs and all
+                of its output files still exist
+        """
+        entry = self.entries.get(ts_name)
+        if entry is None or entry.get("fingerprint") != fingerprint:
+            return False
+        return all(Path(x).is_file() for x in entry.get("outputs", []))
+
+    def update(self, ts_name: str, fingerprint: str, outputs: List[Path]) -> None:
+        """Record the conversion of a tilt series
+
+        Args:
+            ts_name (str): The name of the tilt series
+            fingerprint (str): The fingerprint of the tilt series' inputs
+            outputs (List[Path]): The files written for the tilt series
+        """
+        self.entries[ts_name] = {
+            "fingerprint": fingerprint,
+            "outputs": [str(x) for x in outputs],
+        }
+
+    def save(self) -> None:
+        """Write the manifest
+
+        It is written to a temporary file first, so an interrupted write never leaves
+        a partial manifest.
+        """
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(
+                {
+                    "version": MANIFEST_VERSION,
+                    "settings": self.settings,
+                    "tilt_series": self.entries,
+                },
+                f,
+                indent=4,
+            )
+        os.replace(tmp, self.path)
@@ -0,0 +1,328 @@
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Sequence, Union
+
+import numpy as np
+
+from src.tomobabel.converters.relion.relion_starfiles import (
+    StarFileCache,
+    read_loop_columns,
+)
+from src.tomobabel.models.annotation import (
+    CompactParticleCoordinatesSet,
+    ParticleCoordinatesSet,
+)
+from src.tomobabel.models.basemodels import (
+    AnnotationSetTypes,
+    ValidationLevel,
+    build_model,
+    validate_model_tree,
+)
+from src.tomobabel.profiling import ConversionProfiler
+
+"""Convert a RELION tomography particles STAR file into CETS particle coordinate sets
+
+The particles file has a data_particles block with a row for each particle and a
+data_optics block with the pixel size of each optics group:
+
+    data_particles
+    loop_
+    _rlnTomoName
+    _rlnCenteredCoordinateXAngst  (or _rlnCoordinateX in pixels)
+    _rlnCenteredCoordinateYAngst
+    _rlnCenteredCoordinateZAngst
+    _rlnAngleRot
+    _rlnAngleTilt
+    _rlnAnglePsi
+    _rlnAutopickFigureOfMerit
+    _rlnOpticsGroup
+
+Only the columns that are needed are read, and they are read straight into NumPy
+arrays.  The particles in each tomogram are held in a single
+CompactParticleCoordinatesSet, so no objects are made for individual particles unless
+they are asked for.
+"""
+
+PARTICLES_BLOCK = "particles"
+OPTICS_BLOCK = "optics"
+
+AXES = ("X", "Y", "Z")
+ANGLES = ("Rot", "Tilt", "Psi")
+# RELION 5 particles have the orientation of their subtomogram as well as their own
+SUBTOMOGRAM_ANGLES = [f"TomoSubtomogram{x}" for x in ANGLES]
+PARTICLE_ANGLES = [f"Angle{x}" for x in ANGLES]
+CENTERED_COORDS = [f"CenteredCoordinate{x}Angst" for x in AXES]
+PIXEL_COORDS = [f"Coordinate{x}" for x in AXES]
+ORIGINS = [f"Origin{x}Angst" for x in AXES]
+FOM = "AutopickFigureOfMerit"
+
+
+def euler_matrices(angles: np.ndarray) -> np.ndarray:
+    """Get the rotation matrices for RELION Euler angles
+
+    RELION uses intrinsic ZYZ Euler angles.  The matrices rotate the reference into the
+    orientation of each particle, they are the same as
+    ``Rotation.from_euler("ZYZ", angles, degrees=True).as_matrix()`` but are made with
+    a few array operations, which is much faster for millions of particles.
+
+    Args:
+        angles (np.ndarray): The rot, tilt and psi angles of each particle in degrees,
+            an Nx3 array
+
+    Returns:
+        np.ndarray: The Nx3x3 rotation matrices
+    """
+    radians = np.deg2rad(angles)
+    cos_a, cos_b, cos_c = np.cos(radians).T
+    sin_a, sin_b, sin_c = np.sin(radians).T
+    matrices = np.empty((len(angles), 3, 3))
+    matrices[:, 0, 0] = cos_a * cos_b * cos_c - sin_a * sin_c
+    matrices[:, 0, 1] = -cos_a * cos_b * sin_c - sin_a * cos_c
+    matrices[:, 0, 2] = cos_a * sin_b
+    matrices[:, 1, 0] = sin_a * cos_b * cos_c + cos_a * sin_c
+    matrices[:, 1, 1] = -sin_a * cos_b * sin_c + cos_a * cos_c
+    matrices[:, 1, 2] = sin_a * sin_b
+    matrices[:, 2, 0] = -sin_b * cos_c
+    matrices[:, 2, 1] = sin_b * sin_c
+    matrices[:, 2, 2] = cos_b
+    return matrices
+
+
+class RelionParticleConverter(object):
+    """Converts a RELION tomography particles STAR file into a particle coordinate set
+    for each tomogram
+
+    Coordinates are converted to the CETS logical coordinate system, in Ångstrom with
+    0,0,0 at the center of the tomogram.  RELION 5 centered coordinates in Ångstrom are
+    used when the file has them.  Coordinates in pixels, as written by RELION 4, are
+    converted using the tilt series pixel size of the particle's optics group and the
+    size of its tomogram, which must be given.  Origin offsets are applied to the
+    coordinates if the file has them.
+
+    Attributes:
+        input_file (Path): The RELION particles STAR file
+        tomogram_sizes (Mapping[str, Sequence[int]]): The x, y, z size of each tomogram
+            in unbinned tilt series pixels, needed for coordinates in pixels
+            {tomogram name: size}
+        tomogram_size (Optional[Sequence[int]]): The size of any tomograms not in
+            tomogram_sizes, for datasets where all the tomograms are the same size
+        star_cache (StarFileCache): Holds the parsed STAR files
+        set_name (str): The name for the particle sets, EG: "Ribosomes"
+        particle_objects (bool): Make ParticleCoordinatesSets with a Particle object for
+            each particle rather than CompactParticleCoordinatesSets
+        validation (ValidationLevel): How the particle sets are validated
+        profiler (ConversionProfiler): Records the time taken by each stage of the
+            conversion, disabled unless a profiler is provided
+        particle_sets (Dict[str, Union[CompactParticleCoordinatesSet,
+            ParticleCoordinatesSet]]): The converted particles for each tomogram
+            {tomogram name: particle set}
+    """
+
+    def __init__(
+        self,
+        input_file: Path,
+        tomogram_sizes: Optional[Mapping[str, Sequence[int]]] = None,
+        tomogram_size: Optional[Sequence[int]] = None,
+        star_cache: Optional[StarFileCache] = None,
+        set_name: str = AnnotationSetTypes.particle_coords,
+        particle_objects: bool = False,
+        validation: ValidationLevel = ValidationLevel.full,
+        profiler: Optional[ConversionProfiler] = None,
+    ) -> None:
+        self.input_file = input_file
+        self.tomogram_sizes = {} if tomogram_sizes is None else tomogram_sizes
+        self.tomogram_size = tomogram_size
+        self.star_cache = StarFileCache() if star_cache is None else star_cache
+        self.set_name = set_name
+        self.particle_objects = particle_objects
+        self.validation = ValidationLevel(validation)
+        self.profiler = (
+            ConversionProfiler(enabled=False) if profiler is None else profiler
+        )
+        self.particle_sets: Dict[
+            str, Union[CompactParticleCoordinatesSet, ParticleCoordinatesSet]
+        ] = {}
+
+    def read_columns(self) -> Dict[str, np.ndarray]:
+        """Read the particle columns that are needed from the STAR file
+
+        Returns:
+            Dict[str, np.ndarray]: The columns {label without _rln: values}
+
+        Raises:
+            ValueError: If the file has no particles block, or no tomogram names or
+                coordinates
+        """
+        with self.profiler.stage("read_star"):
+            block = self.star_cache.find_block(self.input_file, PARTICLES_BLOCK)
+            if block is None:
+                raise ValueError(
+                    f"{self.input_file} has no data_{PARTICLES_BLOCK} block"
+                )
+            columns = read_loop_columns(block, ["TomoName"], dtype=str)
+            columns.update(read_loop_columns(block, ["OpticsGroup"], dtype=np.int64))
+            numeric = CENTERED_COORDS + ORIGINS + PARTICLE_ANGLES + SUBTOMOGRAM_ANGLES
+            columns.update(read_loop_columns(block, numeric + [FOM], dtype=np.float64))
+            if not all(x in columns for x in CENTERED_COORDS):
+                columns.update(read_loop_columns(block, PIXEL_COORDS, dtype=np.float64))
+        self.profiler.count("star_files_parsed")
+        if "TomoName" not in columns:
+            raise ValueError(f"{self.input_file} has no _rlnTomoName column")
+        if not all(x in columns for x in CENTERED_COORDS) and not all(
+            x in columns for x in PIXEL_COORDS
+        ):
+            raise ValueError(f"{self.input_file} has no particle coordinates")
+        return columns
+
+    def get_pixel_sizes(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """Get the tilt series pixel size for each particle from its optics group
+
+        Args:
+            columns (Dict[str, np.ndarray]): The particle columns
+
+        Returns:
+            np.ndarray: The pixel size of each particle in Å/px
+
+        Raises:
+            ValueError: If the pixel sizes aren't in the optics block
+        """
+        block = self.star_cache.find_block(self.input_file, OPTICS_BLOCK)
+        optics = {}
+        if block is not None:
+            optics = read_loop_columns(
+                block, ["OpticsGroup", "TomoTiltSeriesPixelSize"], dtype=np.float64
+            )
+        if "TomoTiltSeriesPixelSize" not in optics:
+            raise ValueError(
+                f"{self.input_file} has coordinates in pixels but no"
+                f" _rlnTomoTiltSeriesPixelSize in the data_{OPTICS_BLOCK} block"
+            )
+        sizes = optics["TomoTiltSeriesPixelSize"]
+        n_particles = len(columns["TomoName"])
+        if "OpticsGroup" not in columns or "OpticsGroup" not in optics:
+            if len(sizes) != 1:
+                raise ValueError(
+                    f"The particles in {self.input_file} have no optics groups"
+                )
+            return np.full(n_particles, sizes[0])
+        groups = optics["OpticsGroup"].astype(np.int64)
+        by_group = np.full(max(groups.max(), columns["OpticsGroup"].max()) + 1, np.nan)
+        by_group[groups] = sizes
+        pixel_sizes = by_group[columns["OpticsGroup"]]
+        if np.isnan(pixel_sizes).any():
+            raise ValueError(
+                f"Some of the particles in {self.input_file} have optics groups that"
+                " are not in the optics block"
+            )
+        return pixel_sizes
+
+    def get_coordinates(
+        self, columns: Dict[str, np.ndarray], tomograms: Dict[str, np.ndarray]
+    ) -> np.ndarray:
+        """Get the logical coordinates of the particles
+
+        Args:
+            columns (Dict[str, np.ndarray]): The particle columns
+            tomograms (Dict[str, np.ndarray]): The indices of the particles in each
+                tomogram {tomogram name: indices}
+
+        Returns:
+            np.ndarray: The x, y, z coordinates of each particle in Å, an Nx3 array
+
+        Raises:
+            ValueError: If the coordinates are in pixels and the size of a tomogram
+                is not known
+        """
+        if all(x in columns for x in CENTERED_COORDS):
+            coords = np.column_stack([columns[x] for x in CENTERED_COORDS])
+        else:
+            sizes = {
+                x: self.tomogram_sizes.get(x, self.tomogram_size) for x in tomograms
+            }
+            missing = [x for x, size in sizes.items() if size is None]
+            if missing:
+                raise ValueError(
+                    f"The particle coordinates in {self.input_file} are in pixels, the"
+                    f" sizes of these tomograms are needed: {', '.join(missing)}"
+                )
+            pixel_sizes = self.get_pixel_sizes(columns)
+            coords = np.column_stack([columns[x] for x in PIXEL_COORDS])
+            for name, indices in tomograms.items():
+                center = np.asarray(sizes[name], dtype=np.float64) / 2
+                coords[indices] -= center
+            coords *= pixel_sizes[:, np.newaxis]
+        if all(x in columns for x in ORIGINS):
+            coords -= np.column_stack([columns[x] for x in ORIGINS])
+        return coords
+
+    @staticmethod
+    def get_rotations(columns: Dict[str, np.ndarray]) -> Optional[np.ndarray]:
+        """Get the rotation matrix for each particle from its Euler angles
+
+        If the particles have subtomogram orientations as well as their own, the two
+        are combined.
+
+        Args:
+            columns (Dict[str, np.ndarray]): The particle columns
+
+        Returns:
+            Optional[np.ndarray]: The Nx3x3 rotation matrices, None if the particles
+                have no angles
+        """
+        rotations = None
+        for labels in (SUBTOMOGRAM_ANGLES, PARTICLE_ANGLES):
+            if all(x in columns for x in labels):
+                matrices = euler_matrices(np.column_stack([columns[x] for x in labels]))
+                rotations = matrices if rotations is None else rotations @ matrices
+        return rotations
+
+    @staticmethod
+    def group_by_tomogram(names: np.ndarray) -> Dict[str, np.ndarray]:
+        """Find the particles in each tomogram
+
+        Args:
+            names (np.ndarray): The tomogram name of each particle
+
+        Returns:
+            Dict[str, np.ndarray]: The indices of the particles in each tomogram, in
+                the order they are in the file {tomogram name: indices}
+        """
+        unique, first, inverse = np.unique(
+            names, return_index=True, return_inverse=True
+        )
+        order = np.argsort(inverse, kind="stable")
+        splits = np.split(order, np.cumsum(np.bincount(inverse))[:-1])
+        return {str(unique[n]): splits[n] for n in np.argsort(first)}
+
+    def do_conversion(self, tomogram_names: Optional[List[str]] = None) -> None:
+        """Convert the particles, the results are put in self.particle_sets
+
+        Args:
+            tomogram_names (Optional[List[str]]): Only convert the particles in these
+                tomograms, if None the particles in all tomograms are converted
+        """
+        columns = self.read_columns()
+        tomograms = self.group_by_tomogram(columns["TomoName"])
+        if tomogram_names is not None:
+            tomograms = {x: y for x, y in tomograms.items() if x in tomogram_names}
+        with self.profiler.stage("particle_arrays"):
+            coords = self.get_coordinates(columns, tomograms)
+            rotations = self.get_rotations(columns)
+            foms = columns.get(FOM)
+        with self.profiler.stage("build_models"):
+            for name, indices in tomograms.items():
+                compact = build_model(
+                    CompactParticleCoordinatesSet,
+                    self.validation,
+                    name=self.set_name,
+                    coords=coords[indices],
+                    foms=None if foms is None else foms[indices],
+                    rotations=None if rotations is None else rotations[indices],
+                )
+                self.particle_sets[name] = (
+                    compact.to_particle_set() if self.particle_objects else compact
+                )
+                self.profiler.count("particles", len(indices))
+        if self.validation == ValidationLevel.final:
+            with self.profiler.stage("validate"):
+                for particle_set in self.particle_sets.values():
+                    validate_model_tree(particle_set)
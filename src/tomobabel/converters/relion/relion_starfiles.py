@@ -0,0 +1,280 @@
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from gemmi import cif
+
+"""Tools for reading the STAR files in a RELION project efficiently"""
+
+
+class StarFileCache(object):
+    """Parses STAR files once and keeps the parsed documents for reuse
+
+    Documents are keyed by the absolute path of the file along with its size and
+    modification time, so a file that changes on disk is parsed again the next time it
+    is read.  The least recently used documents are dropped when the cache is full.
+
+    A single cache can be shared by several converters and between threads.
+
+    Attributes:
+        max_documents (int): The maximum number of parsed documents to keep
+        parse_counts (Dict[str, int]): The number of times each file has been parsed,
+            {absolute path: count}
+    """
+
+    def __init__(self, max_documents: int = 256) -> None:
+        self.max_documents = max_documents
+        self.parse_counts: Dict[str, int] = {}
+        self._docs: "OrderedDict[str, Tuple[Tuple[int, int], cif.Document]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    @property
+    def n_parses(self) -> int:
+        """The total number of files that have been parsed"""
+        return sum(self.parse_counts.values())
+
+    def parse_count(self, star_file: Union[Path, str]) -> int:
+        """Get the number of times a file has been parsed
+
+        Args:
+            star_file (Union[Path, str]): The file
+
+        Returns:
+            int: The number of parses
+        """
+        return self.parse_counts.get(os.path.abspath(star_file), 0)
+
+    def read(self, star_file: Union[Path, str]) -> cif.Document:
+        """Get the parsed document for a STAR file
+
+        Args:
+            star_file (Union[Path, str]): The file to read
+
+        Returns:
+            cif.Document: The parsed file. This is shared with any other callers so it
+                should not be modified.
+
+        Raises:
+            FileNotFoundError: If the file doesn't exist
+        """
+        key = os.path.abspath(star_file)
+        st = os.stat(key)
+        stamp = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            cached = self._docs.get(key)
+            if cached is not None and cached[0] == stamp:
+                self._docs.move_to_end(key)
+                return cached[1]
+        doc = cif.read_file(key)
+        with self._lock:
+            self.parse_counts[key] = self.parse_counts.get(key, 0) + 1
+            self._docs[key] = (stamp, doc)
+            self._docs.move_to_end(key)
+            while len(self._docs) > self.max_documents:
+                self._docs.popitem(last=False)
+        return doc
+
+    def find_block(
+        self, star_file: Union[Path, str], block_name: str
+    ) -> Optional[cif.Block]:
+        """Get a single data block from a STAR file
+
+        Args:
+            star_file (Union[Path, str]): The file to read
+            block_name (str): The name of the block, without the data_ prefix
+
+        Returns:
+            Optional[cif.Block]: The block, or None if it is not in the file
+        """
+        return self.read(star_file).find_block(block_name)
+
+    def get_block(self, star_file: Union[Path, str], block_name: str) -> cif.Block:
+        """Get a single data block from a STAR file, which must have it
+
+        Args:
+            star_file (Union[Path, str]): The file to read
+            block_name (str): The name of the block, without the data_ prefix
+
+        Returns:
+            cif.Block: The block
+
+        Raises:
+            ValueError: If the block is not in the file
+        """
+        block = self.find_block(star_file, block_name)
+        if block is None:
+            raise ValueError(f"{star_file} has no data_{block_name} block")
+        return block
+
+    def clear(self) -> None:
+        """Remove all parsed documents and reset the parse counts"""
+        with self._lock:
+            self._docs.clear()
+            self.parse_counts = {}
+
+
+def _typed_column(values: List[str], as_str: bool = False) -> np.ndarray:
+    """Convert the raw values of a STAR file column to the most specific array type
+
+    Args:
+        values (List[str]): The column values as they appear in the file
+        as_str (bool): Always make an array of the unquoted strings, for names that
+            can look like numbers, EG: "01"
+
+    Returns:
+        np.ndarray: An int64 array if all the values are integers, float64 if they
+            are all numbers, otherwise an array of the unquoted strings
+    """
+    if as_str:
+        return np.array([cif.as_string(x) for x in values])
+    raw = np.array(values)
+    for dtype in (np.int64, np.float64):
+        try:
+            return raw.astype(dtype)
+        except ValueError:
+            continue
+    return np.array([cif.as_string(x) for x in values])
+
+
+class TiltSeriesTable(object):
+    """The columns of a RELION tilt series loop as NumPy arrays
+
+    All the columns are extracted in a single pass over the loop when the table is
+    made, so getting the value for any tilt image is just an array lookup.  Columns are
+    typed as int64, float64 or str arrays depending on their contents and are looked
+    up by their RELION label without the _rln prefix, EG: "DefocusU".  As in STAR
+    files the labels are not case-sensitive.
+
+    Attributes:
+        name (str): The name of the data block, which is the tilt series name
+        columns (Dict[str, np.ndarray]): The column arrays {label: values}
+    """
+
+    def __init__(self, name: str, columns: Dict[str, np.ndarray]) -> None:
+        self.name = name
+        self.columns = columns
+        self._lookup = {x.lower(): x for x in columns}
+
+    @classmethod
+    def from_block(
+        cls,
+        block: cif.Block,
+        prefix: str = "_rln",
+        str_columns: Sequence[str] = (),
+    ) -> "TiltSeriesTable":
+        """Make a table from the first loop in a data block
+
+        Args:
+            block (cif.Block): The data block for a tilt series
+            prefix (str): The prefix to remove from the column labels
+            str_columns (Sequence[str]): Labels of columns that are always read as
+                strings, such as names and file paths, so "01" isn't read as 1
+
+        Returns:
+            TiltSeriesTable: The table, with no columns if the block has no loop
+        """
+        as_str = {x.lower() for x in str_columns}
+        columns: Dict[str, np.ndarray] = {}
+        for item in block:
+            loop = item.loop
+            if loop is None:
+                continue
+            values = list(loop.values)
+            width = loop.width()
+            for n, tag in enumerate(loop.tags):
+                label = tag[len(prefix) :] if tag.startswith(prefix) else tag
+                columns[label] = _typed_column(
+                    values[n::width], label.lower() in as_str
+                )
+            break
+        return cls(name=block.name, columns=columns)
+
+    @classmethod
+    def of(cls, data: Union[cif.Block, "TiltSeriesTable"]) -> "TiltSeriesTable":
+        """Get a table for a data block, or return the table if it already is one
+
+        Args:
+            data (Union[cif.Block, TiltSeriesTable]): The data block or table
+
+        Returns:
+            TiltSeriesTable: The table
+        """
+        return data if isinstance(data, TiltSeriesTable) else cls.from_block(data)
+
+    def __len__(self) -> int:
+        if not self.columns:
+            return 0
+        return len(next(iter(self.columns.values())))
+
+    def __contains__(self, label: object) -> bool:
+        return isinstance(label, str) and label.lower() in self._lookup
+
+    def __getitem__(self, label: str) -> np.ndarray:
+        try:
+            return self.columns[self._lookup[label.lower()]]
+        except KeyError:
+            raise KeyError(f"Column {label} not found in tilt series {self.name}")
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.columns)
+
+    def has(self, *labels: str) -> bool:
+        """Check that the table has all the named columns and at least one row
+
+        Args:
+            *labels (str): The column labels
+
+        Returns:
+            bool: True if all the columns are present and the table isn't empty
+        """
+        return len(self) > 0 and all(x in self for x in labels)
+
+
+def read_loop_columns(
+    block: cif.Block,
+    labels: List[str],
+    dtype: Optional[type] = None,
+    prefix: str = "_rln",
+) -> Dict[str, np.ndarray]:
+    """Read some of the columns of a loop as NumPy arrays
+
+    Only the columns asked for are extracted, so this is much faster than making a
+    :class:`TiltSeriesTable` for a loop with many columns and millions of rows, such as
+    a particles file.
+
+    Args:
+        block (cif.Block): The data block with the loop
+        labels (List[str]): The column labels without the prefix, EG: "CoordinateX"
+        dtype (Optional[type]): The type of the arrays, if None each column is typed
+            as int64, float64 or str depending on its contents
+        prefix (str): The prefix of the column labels
+
+    Returns:
+        Dict[str, np.ndarray]: The column arrays {label: values}, columns that are not
+            in the block are left out
+
+    Raises:
+        ValueError: If a column can't be converted to dtype
+    """
+    columns: Dict[str, np.ndarray] = {}
+    for label in labels:
+        tag = prefix + label
+        column = block.find_values(tag)
+        # an empty column can be from a loop with no rows
+        if not column and block.find_loop(tag).get_loop() is None:
+            continue
+        values = list(column)
+        if dtype is None:
+            columns[label] = _typed_column(values)
+            continue
+        try:
+            columns[label] = np.array(values, dtype=dtype)
+        except ValueError:
+            # quoted values
+            columns[label] = np.array([cif.as_string(x) for x in values], dtype=dtype)
+    return columns
@@ -0,0 +1,252 @@
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from src.tomobabel.converters.relion.relion_starfiles import (
+    StarFileCache,
+    TiltSeriesTable,
+)
+from src.tomobabel.models.annotation import Annotation
+from src.tomobabel.models.basemodels import (
+    ValidationLevel,
+    build_model,
+    validate_model_tree,
+)
+from src.tomobabel.models.tomo_images import (
+    TiltSeriesMicrographStack,
+    Tomogram,
+    TomogramSet,
+)
+from src.tomobabel.mrc_headers import HeaderCache, MrcHeader
+from src.tomobabel.profiling import ConversionProfiler
+from src.tomobabel.utils import probe_mrc_headers
+
+"""Convert a RELION tomograms STAR file into CETS tomogram sets
+
+The tomograms STAR file written by a RELION reconstruction job has a row for each
+tomogram in its data_global block, with the paths of the reconstructed tomogram and
+its half tomograms:
+
+    data_global
+    loop_
+    _rlnTomoName
+    _rlnTomoTiltSeriesStarFile
+    _rlnTomoTiltSeriesPixelSize
+    _rlnTomoTomogramBinning
+    _rlnTomoSizeX
+    _rlnTomoSizeY
+    _rlnTomoSizeZ
+    _rlnTomoReconstructedTomogram
+    _rlnTomoReconstructedTomogramHalf1
+    _rlnTomoReconstructedTomogramHalf2
+
+The dimensions of the tomograms are read from their MRC headers.  The headers of all
+the tomograms are read in a single batch by a pool of threads, and only the 1024 byte
+main header of each file is read, so the multi-GB volumes are never loaded.  Each
+tomogram is linked to its tilt series by its name.
+"""
+
+logger = logging.getLogger(__name__)
+
+# the tomogram file columns and the description given to each type of tomogram
+TOMOGRAM_FILES = {
+    "TomoReconstructedTomogram": "",
+    "TomoReconstructedTomogramDenoised": "Denoised tomogram",
+    "TomoReconstructedTomogramHalf1": "Half tomogram 1",
+    "TomoReconstructedTomogramHalf2": "Half tomogram 2",
+}
+SIZE_COLUMNS = ("TomoSizeX", "TomoSizeY", "TomoSizeZ")
+
+
+class RelionTomogramConverter(object):
+    """Converts a RELION tomograms STAR file into a TomogramSet for each tilt series
+
+    Attributes:
+        input_file (Path): The RELION tomograms STAR file
+        header_cache (Optional[HeaderCache]): A persistent cache of MRC headers, if
+            provided tomograms that are unchanged since they were cached are not read
+        probe_workers (int): The number of threads used to read the tomogram headers
+        star_cache (StarFileCache): Holds the parsed STAR files
+        validation (ValidationLevel): How the tomogram objects are validated
+        profiler (ConversionProfiler): Records the time taken by each stage of the
+            conversion, disabled unless a profiler is provided
+        tomogram_sets (Dict[str, TomogramSet]): The tomograms reconstructed from each
+            tilt series {tilt series name: tomogram set}
+        tomogram_sizes (Dict[str, Tuple[int, int, int]]): The x, y, z size of each
+            tomogram in unbinned tilt series pixels, from the STAR file
+            {tilt series name: size}
+        ts_files (Dict[str, str]): The tilt series STAR file for each tomogram
+            {tilt series name: file path}
+    """
+
+    def __init__(
+        self,
+        input_file: Path,
+        header_cache: Optional[HeaderCache] = None,
+        probe_workers: int = 8,
+        star_cache: Optional[StarFileCache] = None,
+        validation: ValidationLevel = ValidationLevel.full,
+        profiler: Optional[ConversionProfiler] = None,
+    ) -> None:
+        self.input_file = input_file
+        self.header_cache = header_cache
+        self.probe_workers = probe_workers
+        self.star_cache = StarFileCache() if star_cache is None else star_cache
+        self.validation = ValidationLevel(validation)
+        self.profiler = (
+            ConversionProfiler(enabled=False) if profiler is None else profiler
+        )
+        self.tomogram_sets: Dict[str, TomogramSet] = {}
+        self.tomogram_sizes: Dict[str, Tuple[int, int, int]] = {}
+        self.ts_files: Dict[str, str] = {}
+
+    def read_table(self) -> TiltSeriesTable:
+        """Read the global block of the tomograms STAR file
+
+        Returns:
+            TiltSeriesTable: The columns of the global block
+
+        Raises:
+            ValueError: If the file has no global block with tomogram names
+        """
+        parses = self.star_cache.n_parses
+        with self.profiler.stage("read_star"):
+            block = self.star_cache.find_block(self.input_file, "global")
+            if block is None:
+                raise ValueError(f"{self.input_file} has no data_global block")
+            table = TiltSeriesTable.from_block(
+                block,
+                str_columns=["TomoName", "TomoTiltSeriesStarFile", *TOMOGRAM_FILES],
+            )
+        self.profiler.count("star_files_parsed", self.star_cache.n_parses - parses)
+        if "TomoName" not in table:
+            raise ValueError(f"{self.input_file} has no _rlnTomoName column")
+        return table
+
+    @staticmethod
+    def get_voxel_size(
+        table: TiltSeriesTable, row: int, header: Optional[MrcHeader]
+    ) -> Optional[float]:
+        """Get the voxel size of a tomogram
+
+        This is the tilt series pixel size times the binning if the STAR file has them,
+        otherwise the voxel size from the MRC header
+
+        Args:
+            table (TiltSeriesTable): The tomograms table
+            row (int): The tomogram's row in the table
+            header (Optional[MrcHeader]): The tomogram's header, None if the file was
+                not found
+
+        Returns:
+            Optional[float]: The voxel size in Å, None if it is not known
+        """
+        if table.has("TomoTiltSeriesPixelSize", "TomoTomogramBinning"):
+            pixel_size = float(table["TomoTiltSeriesPixelSize"][row])
+            return pixel_size * float(table["TomoTomogramBinning"][row])
+        if header is not None and header.voxel_size[0] > 0:
+            return float(header.voxel_size[0])
+        return None
+
+    def do_conversion(self, tomogram_names: Optional[List[str]] = None) -> None:
+        """Convert the tomograms, the results are put in self.tomogram_sets
+
+        Args:
+            tomogram_names (Optional[List[str]]): Only convert these tomograms, if None
+                all the tomograms in the file are converted
+
+        Raises:
+            ValueError: If any of the tomograms are not in the file
+        """
+        table = self.read_table()
+        names = [str(x) for x in table["TomoName"]]
+        if tomogram_names is not None:
+            missing = [x for x in tomogram_names if x not in names]
+            if missing:
+                raise ValueError(
+                    f"Tomograms {', '.join(missing)} not found in {self.input_file}"
+                )
+        selected = set(names if tomogram_names is None else tomogram_names)
+        rows = [n for n, x in enumerate(names) if x in selected]
+        if "TomoTiltSeriesStarFile" in table:
+            self.ts_files = {
+                names[n]: str(table["TomoTiltSeriesStarFile"][n]) for n in rows
+            }
+        if table.has(*SIZE_COLUMNS):
+            xs, ys, zs = (table[x] for x in SIZE_COLUMNS)
+            self.tomogram_sizes = {
+                names[n]: (int(xs[n]), int(ys[n]), int(zs[n])) for n in rows
+            }
+
+        # every tomogram file in the table, so all the headers are read in one batch
+        files = [
+            (n, column, str(table[column][n]))
+            for n in rows
+            for column in TOMOGRAM_FILES
+            if column in table and str(table[column][n]) not in ("", "None")
+        ]
+        headers = probe_mrc_headers(
+            [Path(x[2]) for x in files],
+            header_cache=self.header_cache,
+            max_workers=self.probe_workers,
+            profiler=self.profiler,
+        )
+
+        with self.profiler.stage("build_models"):
+            tomograms: Dict[int, List[Tomogram]] = {}
+            for (row, column, path), header in zip(files, headers):
+                if header is None:
+                    logger.warning(f"Tomogram {path} not found")
+                description = TOMOGRAM_FILES[column]
+                tomograms.setdefault(row, []).append(
+                    build_model(
+                        Tomogram,
+                        self.validation,
+                        file=path,
+                        width=None if header is None else header.nx,
+                        height=None if header is None else header.ny,
+                        depth=None if header is None else header.nz,
+                        voxel_size=self.get_voxel_size(table, row, header),
+                        annotations=(
+                            [Annotation(description=description)] if description else []
+                        ),
+                    )
+                )
+            for row, tomos in tomograms.items():
+                self.tomogram_sets[names[row]] = build_model(
+                    TomogramSet,
+                    self.validation,
+                    tomograms=tomos,
+                    annotations=[
+                        Annotation(
+                            description=f"Tomograms for tilt series name: {names[row]}"
+                        )
+                    ],
+                )
+                self.profiler.count("tomograms", len(tomos))
+        if self.validation == ValidationLevel.final:
+            with self.profiler.stage("validate"):
+                for tomogram_set in self.tomogram_sets.values():
+                    validate_model_tree(tomogram_set)
+
+    def link_to_tilt_series(
+        self, tilt_series: Dict[str, TiltSeriesMicrographStack]
+    ) -> List[str]:
+        """Add each tomogram set to the tilt series it was reconstructed from
+
+        Tomograms are matched to tilt series by name
+
+        Args:
+            tilt_series (Dict[str, TiltSeriesMicrographStack]): The tilt series
+                {tilt series name: tilt series}
+
+        Returns:
+            List[str]: The names of the tomograms that have no tilt series
+        """
+        unlinked = []
+        for name, tomogram_set in self.tomogram_sets.items():
+            if name in tilt_series:
+                tilt_series[name].Tomograms.append(tomogram_set)
+            else:
+                unlinked.append(name)
+        return unlinked
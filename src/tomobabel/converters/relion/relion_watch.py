@@ -0,0 +1,215 @@
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from src.tomobabel.converters.relion.relion_convert_tilt_series import (
+    PipelinerTiltSeriesGroupConverter,
+    run_incremental_conversion,
+)
+
+"""Convert tilt series while the RELION job that produces them is still running
+
+The tilt series group STAR file and the STAR file for each tilt series are polled with
+os.stat, so no extra services or packages are needed.  A file is only read once its
+size and modification time have stayed the same for the settle time, so files that are
+still being written are not converted.  Files that were last modified longer ago than
+the settle time when they are first seen are read straight away.  The conversion
+itself is incremental (see :mod:`relion_manifest`) so a tilt series is only converted
+again if its inputs have actually changed, and a watcher that is restarted picks up
+where it left off.  As a
+watcher can run for as long as the job does, each tilt series is written as soon as it
+is converted and is not kept in the converter.
+"""
+
+logger = logging.getLogger(__name__)
+
+FileStamp = Tuple[int, int]
+
+
+def get_file_stamp(path: Path) -> Optional[FileStamp]:
+    """Get the size and modification time of a file
+
+    Args:
+        path (Path): The file
+
+    Returns:
+        Optional[FileStamp]: (size, mtime in ns) or None if the file doesn't exist
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class TiltSeriesWatcher(object):
+    """Converts tilt series as they appear in, or change in, a tilt series group
+
+    Attributes:
+        converter (PipelinerTiltSeriesGroupConverter): The converter to use
+        out (Path): The output prefix or dir
+        tilt_series_names (Optional[List[str]]): Only watch these tilt series, if
+            None all the tilt series in the input file are watched
+        poll_interval (float): Seconds between checks of the files
+        settle_time (float): Seconds a file must be unchanged before it is read
+        deduplicate (bool): Write shared objects once in the output files
+        compact_json (bool): Write the json without indentation or spaces
+        json_backend (str): The JSON encoder to use
+        array_sidecar (bool): Write the numeric arrays to sidecar files
+        converted (List[str]): The names of the tilt series converted so far, a tilt
+            series appears again each time it is reconverted
+    """
+
+    def __init__(
+        self,
+        converter: PipelinerTiltSeriesGroupConverter,
+        out: Path,
+        tilt_series_names: Optional[List[str]] = None,
+        poll_interval: float = 10.0,
+        settle_time: float = 30.0,
+        deduplicate: bool = False,
+        compact_json: bool = False,
+        json_backend: str = "pydantic",
+        array_sidecar: bool = False,
+    ) -> None:
+        self.converter = converter
+        self.out = out
+        self.tilt_series_names = tilt_series_names
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.deduplicate = deduplicate
+        self.compact_json = compact_json
+        self.json_backend = json_backend
+        self.array_sidecar = array_sidecar
+        self.converted: List[str] = []
+        # the stamp each file was first seen with, and when: {path: (stamp, time)}
+        self._seen: Dict[Path, Tuple[FileStamp, float]] = {}
+        # the (group file, tilt series file) stamps at the last successful check
+        self._checked: Dict[str, Tuple[FileStamp, FileStamp]] = {}
+
+    def settled_stamp(self, path: Path) -> Optional[FileStamp]:
+        """Get the stamp of a file if it has not changed for the settle time
+
+        A file that was last modified longer ago than the settle time when it is first
+        seen is already settled, so the files of a finished job are read at once.
+
+        Args:
+            path (Path): The file
+
+        Returns:
+            Optional[FileStamp]: The stamp of the file, or None if it doesn't exist
+                or has changed too recently
+        """
+        stamp = get_file_stamp(path)
+        if stamp is None:
+            self._seen.pop(path, None)
+            return None
+        now = time.monotonic()
+        seen = self._seen.get(path)
+        if seen is None and time.time() - stamp[1] / 1e9 >= self.settle_time:
+            self._seen[path] = (stamp, now - self.settle_time)
+            seen = self._seen[path]
+        elif seen is None or seen[0] != stamp:
+            self._seen[path] = (stamp, now)
+            seen = self._seen[path]
+        return stamp if now - seen[1] >= self.settle_time else None
+
+    def poll(self) -> List[str]:
+        """Check the files once and convert any tilt series that are ready
+
+        Returns:
+            List[str]: The tilt series that were converted
+        """
+        group_stamp = self.settled_stamp(self.converter.input_file)
+        if group_stamp is None:
+            return []
+        try:
+            self.converter.get_tilt_series_files()
+        except Exception as err:
+            logger.warning(f"Could not read {self.converter.input_file}: {err}")
+            return []
+
+        ready = {}
+        for ts_name, ts_file in self.converter.ts_files.items():
+            if (
+                self.tilt_series_names is not None
+                and ts_name not in self.tilt_series_names
+            ):
+                continue
+            ts_stamp = self.settled_stamp(Path(ts_file))
+            if ts_stamp is not None and self._checked.get(ts_name) != (
+                group_stamp,
+                ts_stamp,
+            ):
+                ready[ts_name] = (group_stamp, ts_stamp)
+        if not ready:
+            return []
+        converted = self._convert(ready)
+        self.converted.extend(converted)
+        return converted
+
+    def _convert(self, ready: Dict[str, Tuple[FileStamp, FileStamp]]) -> List[str]:
+        """Convert a set of tilt series, isolating any that fail
+
+        Tilt series that fail are not marked as checked so they are tried again on
+        the next poll.
+
+        Args:
+            ready (Dict[str, Tuple[FileStamp, FileStamp]]): The tilt series to
+                convert and the stamps of their files
+
+        Returns:
+            List[str]: The tilt series that were converted
+        """
+        self.converter.conversion_errors = {}
+        try:
+            converted = run_incremental_conversion(
+                self.converter,
+                self.out,
+                list(ready),
+                True,
+                self.deduplicate,
+                self.compact_json,
+                self.json_backend,
+                self.array_sidecar,
+            )
+        except Exception as err:
+            if len(ready) > 1:
+                converted = []
+                for ts_name, stamps in ready.items():
+                    converted.extend(self._convert({ts_name: stamps}))
+                return converted
+            logger.warning(
+                f"Could not convert tilt series {list(ready)[0]}, it will be tried"
+                f" again: {err}"
+            )
+            return []
+
+        for ts_name, stamps in ready.items():
+            if ts_name not in self.converter.conversion_errors:
+                self._checked[ts_name] = stamps
+        return converted
+
+    def run(self, timeout: Optional[float] = None) -> List[str]:
+        """Poll the files until stopped
+
+        Args:
+            timeout (Optional[float]): Stop after this many seconds. If None keep
+                going until interrupted
+
+        Returns:
+            List[str]: The tilt series that were converted
+        """
+        start = time.monotonic()
+        try:
+            while True:
+                for ts_name in self.poll():
+                    logger.info(f"Converted tilt series {ts_name}")
+                if timeout is not None and time.monotonic() - start >= timeout:
+                    break
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            logger.info("Stopped watching")
+        return self.converted
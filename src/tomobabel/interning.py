@@ -0,0 +1,387 @@
+import threading
+import typing
+from typing import Any, Callable, Dict, Hashable, List, Optional, Type, TypeVar
+
+import numpy as np
+from pydantic import BaseModel
+
+"""Share identical model objects rather than keeping a copy for each use
+
+Converted datasets contain many identical sub-objects, for example every frame in a
+movie has the same CTF and motion correction transformation.  Pydantic does not copy
+model instances that are assigned to fields, so one instance can be used by all of
+them.  Shared instances should be treated as immutable, changing one changes it
+everywhere it is used.
+
+When a dataset is written the shared instances can be written once, in a "$defs"
+section, with a {"$ref": "#/$defs/<key>"} object in each place they are used.
+Instances that are equal but not shared, such as those made by different worker
+processes or read back from a file, can also be written once by comparing their
+contents.  :func:`load_deduplicated` reads the data back, with a single shared
+instance for each entry in "$defs".
+"""
+
+M = TypeVar("M", bound=BaseModel)
+
+_SCALARS = frozenset((str, int, float, bool, type(None)))
+
+
+class ModelInterner(object):
+    """Returns a single shared instance for each distinct model value
+
+    Attributes:
+        max_values (int): The maximum number of distinct values to keep, when there
+            are more the interned values are forgotten, so a long running conversion
+            doesn't keep every object it has ever made
+        hits (int): The number of times an existing instance was returned
+    """
+
+    def __init__(self, max_values: int = 10000) -> None:
+        self.max_values = max_values
+        self.hits = 0
+        self._values: Dict[Hashable, BaseModel] = {}
+        self._keyed: Dict[Hashable, BaseModel] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._values) + len(self._keyed)
+
+    def intern(self, obj: M) -> M:
+        """Get the shared instance with the same value as a model object
+
+        Args:
+            obj (M): The object
+
+        Returns:
+            M: The shared instance, this is obj if no equal object has been interned
+        """
+        key = (type(obj), obj.model_dump_json())
+        with self._lock:
+            shared = self._values.get(key)
+            if shared is not None:
+                self.hits += 1
+                return shared  # type: ignore[return-value]
+            if len(self._values) >= self.max_values:
+                self._values.clear()
+            self._values[key] = obj
+        return obj
+
+    def shared(self, key: Hashable, factory: Callable[[], M]) -> M:
+        """Get a shared instance by key, only making it the first time it is needed
+
+        This avoids making an object at all when the value is known to be constant.
+
+        Args:
+            key (Hashable): The key for the object
+            factory (Callable[[], M]): Makes the object
+
+        Returns:
+            M: The shared instance
+        """
+        with self._lock:
+            shared = self._keyed.get(key)
+            if shared is not None:
+                self.hits += 1
+                return shared  # type: ignore[return-value]
+        obj = factory()
+        with self._lock:
+            return self._keyed.setdefault(key, obj)  # type: ignore[return-value]
+
+    def clear(self) -> None:
+        """Forget all the shared instances"""
+        with self._lock:
+            self._values.clear()
+            self._keyed.clear()
+            self.hits = 0
+
+
+def _content_key(value: Any, ids: Dict[int, int], table: Dict[Hashable, int]) -> Any:
+    """Get a hashable key for a field value, equal values have equal keys
+
+    Args:
+        value (Any): The value
+        ids (Dict[int, int]): The content ids of the instances already seen
+            {id(instance): content id}
+        table (Dict[Hashable, int]): The content id for each distinct instance key
+
+    Returns:
+        Any: The key
+    """
+    if isinstance(value, BaseModel):
+        return ("model", _content_id(value, ids, table))
+    if isinstance(value, (list, tuple)):
+        return ("list", tuple(_content_key(x, ids, table) for x in value))
+    if isinstance(value, dict):
+        return (
+            "dict",
+            tuple((k, _content_key(v, ids, table)) for k, v in value.items()),
+        )
+    if isinstance(value, np.ndarray):
+        return ("array", value.dtype.str, value.shape, value.tobytes())
+    # the type is included so 1, 1.0 and True are different, NaN != NaN
+    return (type(value), value if value == value else "nan")
+
+
+def _content_id(obj: BaseModel, ids: Dict[int, int], table: Dict[Hashable, int]) -> int:
+    """Get a number identifying the type and contents of a model instance
+
+    Instances with the same type and field values get the same number.  The ids of
+    the sub-objects are used in the key of an instance, so each instance in a tree
+    is only hashed once.
+
+    Args:
+        obj (BaseModel): The instance
+        ids (Dict[int, int]): The content ids of the instances already seen, which
+            is updated {id(instance): content id}
+        table (Dict[Hashable, int]): The content id for each distinct instance key,
+            which is updated
+
+    Returns:
+        int: The content id
+    """
+    content_id = ids.get(id(obj))
+    if content_id is None:
+        key: List[Any] = [type(obj)]
+        for name in type(obj).model_fields:
+            value = getattr(obj, name)
+            cls = type(value)
+            # most fields are scalars, these are added without making a key for them
+            if cls in _SCALARS:
+                key.append(cls)
+                key.append(value if value == value else "nan")
+            else:
+                key.append(_content_key(value, ids, table))
+        content_id = ids[id(obj)] = table.setdefault(tuple(key), len(table))
+    return content_id
+
+
+def _count_models(
+    obj: Any,
+    counts: Dict[int, int],
+    order: List[BaseModel],
+    ids: Optional[Dict[int, int]] = None,
+) -> None:
+    """Count how many times each model instance is used in a tree of objects
+
+    The contents of an instance are only counted the first time it is seen, as it
+    will only be written once.
+
+    Args:
+        obj (Any): The object to search
+        counts (Dict[int, int]): The counts to update {id(instance): count}, or
+            {content id: count} if ids are given
+        order (List[BaseModel]): The instances in the order they were first seen
+        ids (Optional[Dict[int, int]]): Count equal instances together, using
+            these content ids {id(instance): content id}
+    """
+    if isinstance(obj, BaseModel):
+        key = id(obj) if ids is None else ids[id(obj)]
+        if key in counts:
+            counts[key] += 1
+            return
+        counts[key] = 1
+        order.append(obj)
+        for name in type(obj).model_fields:
+            _count_models(getattr(obj, name), counts, order, ids)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            _count_models(item, counts, order, ids)
+    elif isinstance(obj, dict):
+        for item in obj.values():
+            _count_models(item, counts, order, ids)
+
+
+def distinct_models(*models: BaseModel) -> List[BaseModel]:
+    """Get the distinct model instances in one or more model trees
+
+    Instances that are used in more than one place are only included once.
+
+    Args:
+        *models (BaseModel): The models to search
+
+    Returns:
+        List[BaseModel]: The instances, in the order they were first seen
+    """
+    counts: Dict[int, int] = {}
+    order: List[BaseModel] = []
+    for model in models:
+        _count_models(model, counts, order)
+    return order
+
+
+def _replace_shared(
+    obj: Any, dumped: Any, keys: Dict[int, str], defs: Dict[str, Any]
+) -> Any:
+    """Replace the dumped data for shared instances with references
+
+    The object tree and its model_dump() output are walked together, so the data
+    for every field is exactly as pydantic dumps it.
+
+    Args:
+        obj (Any): The object
+        dumped (Any): The model_dump() data for obj
+        keys (Dict[int, str]): The $defs keys of the shared instances
+            {id(instance): key}
+        defs (Dict[str, Any]): The $defs to update {key: dumped instance}
+
+    Returns:
+        Any: The updated data
+    """
+    if isinstance(obj, BaseModel):
+        key = keys.get(id(obj))
+        if key is not None:
+            if key not in defs:
+                defs[key] = None  # reserve the key so the order is first use
+                defs[key] = _replace_fields(obj, dumped, keys, defs)
+            return {"$ref": f"#/$defs/{key}"}
+        return _replace_fields(obj, dumped, keys, defs)
+    if isinstance(obj, (list, tuple)):
+        return [_replace_shared(o, d, keys, defs) for o, d in zip(obj, dumped)]
+    if isinstance(obj, dict):
+        return {k: _replace_shared(obj[k], dumped[k], keys, defs) for k in dumped}
+    return dumped
+
+
+def _replace_fields(
+    obj: BaseModel, dumped: Dict[str, Any], keys: Dict[int, str], defs: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Replace shared instances in the fields of a dumped model
+
+    Args:
+        obj (BaseModel): The model
+        dumped (Dict[str, Any]): The model_dump() data for obj
+        keys (Dict[int, str]): The $defs keys of the shared instances
+        defs (Dict[str, Any]): The $defs to update
+
+    Returns:
+        Dict[str, Any]: The updated data
+    """
+    for name in type(obj).model_fields:
+        if name in dumped:
+            dumped[name] = _replace_shared(getattr(obj, name), dumped[name], keys, defs)
+    return dumped
+
+
+def dump_deduplicated(model: BaseModel, by_value: bool = False) -> Dict[str, Any]:
+    """Dump a model, writing instances that are used more than once only once
+
+    Each instance that appears in more than one place is dumped in the "$defs" entry
+    of the returned dict, and each place it is used has {"$ref": "#/$defs/<key>"}.
+    If nothing is shared the result is the same as model.model_dump().
+
+    Args:
+        model (BaseModel): The model to dump
+        by_value (bool): Write instances with the same type and contents once, even
+            if they are different objects.  Each instance is hashed once, from its
+            field values and the hashes of its sub-objects
+
+    Returns:
+        Dict[str, Any]: The dumped data
+    """
+    ids: Optional[Dict[int, int]] = None
+    if by_value:
+        ids = {}
+        _content_id(model, ids, {})
+    counts: Dict[int, int] = {}
+    order: List[BaseModel] = []
+    _count_models(model, counts, order, ids)
+    keys: Dict[int, str] = {}
+    for obj in order[1:]:
+        count_key = id(obj) if ids is None else ids[id(obj)]
+        if counts[count_key] > 1:
+            keys[count_key] = f"{type(obj).__name__}_{len(keys)}"
+    if ids is not None:
+        # every instance with shared contents is replaced, not only the first
+        keys = {k: keys[v] for k, v in ids.items() if v in keys}
+
+    dumped = model.model_dump()
+    if not keys:
+        return dumped
+    defs: Dict[str, Any] = {}
+    dumped = _replace_fields(model, dumped, keys, defs)
+    return {"$defs": defs, **dumped}
+
+
+def _model_classes(
+    annotation: Any, classes: Optional[Dict[str, Type[BaseModel]]] = None
+) -> Dict[str, Type[BaseModel]]:
+    """Get the model classes that can appear in a field, by name
+
+    Args:
+        annotation (Any): The field's type
+        classes (Optional[Dict[str, Type[BaseModel]]]): The classes found so far,
+            which is updated
+
+    Returns:
+        Dict[str, Type[BaseModel]]: The models used in the type, their subclasses
+            and the models in their fields {class name: class}
+    """
+    classes = {} if classes is None else classes
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        if annotation.__name__ not in classes:
+            classes[annotation.__name__] = annotation
+            for field in annotation.model_fields.values():
+                _model_classes(field.annotation, classes)
+            for subclass in annotation.__subclasses__():
+                _model_classes(subclass, classes)
+    else:
+        for arg in typing.get_args(annotation):
+            _model_classes(arg, classes)
+    return classes
+
+
+def load_deduplicated(
+    data: Dict[str, Any],
+    model_class: Type[M],
+    classes: Optional[Dict[str, Type[BaseModel]]] = None,
+) -> M:
+    """Validate data written by :func:`dump_deduplicated`
+
+    Each entry in "$defs" is validated once, and the same instance is used in every
+    place that refers to it, so the loaded model shares objects as the one that was
+    written did.
+
+    Args:
+        data (Dict[str, Any]): The data, EG: read from a JSON file
+        model_class (Type[M]): The model to validate the data as
+        classes (Optional[Dict[str, Type[BaseModel]]]): The model class for each
+            type name used in the "$defs" keys, by default all the subclasses of
+            the base model of model_class
+
+    Returns:
+        M: The validated model
+
+    Raises:
+        ValueError: If a reference is not in "$defs", or the type of an entry is
+            not known
+    """
+    defs = data.get("$defs")
+    if not defs:
+        return model_class.model_validate(data)
+    if classes is None:
+        classes = _model_classes(model_class)
+    instances: Dict[str, BaseModel] = {}
+
+    def resolve(value: Any) -> Any:
+        if isinstance(value, dict):
+            ref = value.get("$ref")
+            if ref is None or len(value) != 1:
+                return {k: resolve(v) for k, v in value.items()}
+            key = ref.rsplit("/", 1)[-1]
+            instance = instances.get(key)
+            if instance is None:
+                if key not in defs:
+                    raise ValueError(f"Reference {ref} is not in $defs")
+                type_name = key.rsplit("_", 1)[0]
+                if type_name not in classes:
+                    raise ValueError(f"Unknown model type {type_name} in $defs")
+                instance = classes[type_name].model_validate(resolve(defs[key]))
+                instances[key] = instance
+            return instance
+        if isinstance(value, list):
+            return [resolve(x) for x in value]
+        return value
+
+    return model_class.model_validate(
+        resolve({k: v for k, v in data.items() if k != "$defs"})
+    )
@@ -0,0 +1,387 @@
+import fnmatch
+import json
+import logging
+import mmap
+import os
+import re
+import typing
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type, Union
+
+from pydantic import BaseModel, TypeAdapter
+
+from src.tomobabel.serialization import get_sidecar_path, read_sidecar
+
+"""Random access to the parts of a large converted JSON file
+
+Converted datasets can be hundreds of MB, but a downstream tool often only needs one
+region or one tilt series.  An :class:`IndexedJsonFile` scans the file once for the
+byte offsets of the objects in it, down to a limited depth of nested lists, and saves
+them in an index file next to the JSON file.  A part of the file can then be read
+with a single seek and parsed and validated on its own:
+
+    indexed = IndexedJsonFile("dataset.json", model=DataSet)
+    movies = indexed.load("/regions/3/tomo_imaging/0/raw_movies")
+
+Parts are identified by JSON pointers, the keys and list indices from the root of the
+file to the object.  The scan finds the brackets in the file with a regular
+expression that skips strings, so building the index is much faster than parsing
+the file, and the index is only rebuilt if the file's size or modification time
+changes.
+"""
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".index"
+
+# the characters before a bracket (whole strings, which may contain brackets, lists
+# of numbers or anything else) then the bracket itself
+_BRACKET = re.compile(rb'(?:[^"\[\]{}]+|"(?:[^"\\]+|\\.)*"|\[[^"\[\]{}]*\])*([\[\]{}])')
+_STRING = re.compile(rb'"(?:[^"\\]+|\\.)*"')
+
+
+def get_index_path(json_file: Path) -> Path:
+    """Get the path of the index file for a JSON file
+
+    Args:
+        json_file (Path): The JSON file
+
+    Returns:
+        Path: The index file, the JSON file with .index added to its name
+    """
+    return json_file.with_name(json_file.name + INDEX_SUFFIX)
+
+
+def _escape(key: str) -> str:
+    """Escape a key for use in a JSON pointer"""
+    return key.replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(key: str) -> str:
+    """Get the key from a JSON pointer segment"""
+    return key.replace("~1", "/").replace("~0", "~")
+
+
+def _member_key(data: Union[bytes, mmap.mmap], start: int, end: int) -> Optional[str]:
+    """Get the key of an object member from the text before its value
+
+    Args:
+        data (Union[bytes, mmap.mmap]): The JSON text
+        start (int): Where to start looking, this must not be inside a string
+        end (int): The position of the value
+
+    Returns:
+        Optional[str]: The key, None if the text does not end with a key
+    """
+    last = None
+    for last in _STRING.finditer(data, start, end):
+        pass
+    if last is None or data[last.end() : end].strip() != b":":
+        return None
+    return json.loads(last.group())
+
+
+def build_index(
+    data: Union[bytes, mmap.mmap], max_depth: int = 3
+) -> Dict[str, Tuple[int, int]]:
+    """Find the byte offsets of the objects in a JSON document
+
+    Args:
+        data (Union[bytes, mmap.mmap]): The JSON text
+        max_depth (int): Only index objects inside at most this many nested lists,
+            EG: with max_depth=3 the movie stacks of a DataSet are indexed
+            (regions/tomo_imaging/raw_movies/movie_stacks) but not their frames
+
+    Returns:
+        Dict[str, Tuple[int, int]]: The start and end of each object {JSON pointer:
+            (start, end)}, the root object has the pointer ""
+    """
+    index: Dict[str, Tuple[int, int]] = {}
+    # [bracket, pointer, number of items, number of enclosing lists, start]
+    stack: List[List[Any]] = []
+    # the nesting level inside a list or object that is not indexed, these are
+    # only counted, which keeps the scan of the bulk of the file fast
+    skipped = 0
+    for match in _BRACKET.finditer(data):
+        bracket = match.group(1)
+        if skipped:
+            skipped += 1 if bracket in b"[{" else -1
+            continue
+        pos = match.start(1)
+        if bracket in b"]}":
+            if not stack:
+                raise ValueError(f"Unmatched {bracket.decode()} at byte {pos}")
+            frame = stack.pop()
+            if frame[0] == b"{":
+                index[frame[1]] = (frame[4], pos + 1)
+            continue
+
+        pointer: Optional[str] = ""
+        depth = 0
+        if stack:
+            parent = stack[-1]
+            depth = parent[3] + (parent[0] == b"[")
+            pointer = parent[1]
+            if pointer is None or depth > max_depth:
+                pointer = None
+            elif parent[0] == b"[":
+                # lists with other values between the brackets can't be counted
+                if data[match.start() : pos].strip(b", \t\r\n"):
+                    parent[1] = pointer = None
+                else:
+                    pointer += f"/{parent[2]}"
+                    parent[2] += 1
+            else:
+                key = _member_key(data, match.start(), pos)
+                pointer = None if key is None else f"{pointer}/{_escape(key)}"
+        if pointer is None:
+            skipped = 1
+        else:
+            stack.append([bracket, pointer, 0, depth, pos])
+    if stack or skipped:
+        raise ValueError("The JSON document is incomplete")
+    return index
+
+
+def _pointer_type(model: Type[BaseModel], pointer: str) -> Any:
+    """Get the type of the object at a JSON pointer from the fields of a model
+
+    Args:
+        model (Type[BaseModel]): The model of the whole document
+        pointer (str): The JSON pointer
+
+    Returns:
+        Any: The annotation of the object, a model or a Union of models
+
+    Raises:
+        ValueError: If the pointer does not match the fields of the model
+    """
+    annotation: Any = model
+    for segment in pointer.split("/")[1:]:
+        key = _unescape(segment)
+        # the models a value could be, with any Optional and SerializeAsAny removed
+        options: List[Any] = [annotation]
+        while any(typing.get_origin(x) in (Union, typing.Annotated) for x in options):
+            unwrapped: List[Any] = []
+            for option in options:
+                if typing.get_origin(option) is Union:
+                    unwrapped.extend(typing.get_args(option))
+                elif typing.get_origin(option) is typing.Annotated:
+                    unwrapped.append(typing.get_args(option)[0])
+                else:
+                    unwrapped.append(option)
+            options = unwrapped
+        for option in options:
+            if typing.get_origin(option) in (list, List) and key.isdigit():
+                annotation = typing.get_args(option)[0]
+                break
+            if isinstance(option, type) and issubclass(option, BaseModel):
+                if key in option.model_fields:
+                    annotation = option.model_fields[key].annotation
+                    break
+        else:
+            raise ValueError(f"{pointer} is not a location in a {model.__name__}")
+    return annotation
+
+
+class IndexedJsonFile(object):
+    """A JSON file whose objects can be loaded one at a time
+
+    Attributes:
+        json_file (Path): The JSON file
+        model (Optional[Type[BaseModel]]): The model of the whole file, used to find
+            the type of each object that is loaded
+        max_depth (int): Objects inside at most this many nested lists are indexed
+        index (Dict[str, Tuple[int, int]]): The start and end of each object
+            {JSON pointer: (start, end)}
+        index_built (bool): The index was built when the file was opened, rather
+            than read from the index file
+    """
+
+    def __init__(
+        self,
+        json_file: Union[Path, str],
+        model: Optional[Type[BaseModel]] = None,
+        max_depth: int = 3,
+        rebuild: bool = False,
+    ) -> None:
+        """Open a JSON file, building its index if it doesn't have an up to date one
+
+        Args:
+            json_file (Union[Path, str]): The JSON file
+            model (Optional[Type[BaseModel]]): The model of the whole file, EG:
+                DataSet or MovieStackSet
+            max_depth (int): Index the objects inside at most this many nested lists
+            rebuild (bool): Build the index even if the index file is up to date
+        """
+        self.json_file = Path(json_file)
+        self.model = model
+        self.max_depth = max_depth
+        self.index_built = False
+        self._adapters: Dict[str, TypeAdapter] = {}
+        self._arrays: Optional[Dict[str, Any]] = None
+        self._defs: Optional[Dict[str, Any]] = None
+
+        stat = self.json_file.stat()
+        self._stamp = [stat.st_size, stat.st_mtime_ns, max_depth]
+        index = None if rebuild else self._read_index()
+        if index is None:
+            index = self._build_index()
+        self.index: Dict[str, Tuple[int, int]] = index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, pointer: str) -> bool:
+        return pointer in self.index
+
+    def _read_index(self) -> Optional[Dict[str, Tuple[int, int]]]:
+        """Read the index file, if it matches the JSON file
+
+        Returns:
+            Optional[Dict[str, Tuple[int, int]]]: The index, None if there is no
+                index file or it is out of date
+        """
+        try:
+            with open(get_index_path(self.json_file), "rb") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if saved.get("version") != INDEX_VERSION or saved.get("stamp") != self._stamp:
+            return None
+        return {k: (v[0], v[1]) for k, v in saved["index"].items()}
+
+    def _build_index(self) -> Dict[str, Tuple[int, int]]:
+        """Scan the JSON file for its objects and save the index file
+
+        The index is only kept in memory if the index file can't be written
+
+        Returns:
+            Dict[str, Tuple[int, int]]: The index
+        """
+        with open(self.json_file, "rb") as f:
+            if self._stamp[0] == 0:
+                raise ValueError(f"{self.json_file} is empty")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                index = build_index(data, self.max_depth)
+        self.index_built = True
+
+        index_file = get_index_path(self.json_file)
+        tmp_file = index_file.with_name(index_file.name + ".tmp")
+        saved = {"version": INDEX_VERSION, "stamp": self._stamp, "index": index}
+        try:
+            with open(tmp_file, "w") as f:
+                json.dump(saved, f, separators=(",", ":"))
+            os.replace(tmp_file, index_file)
+        except OSError as e:
+            logger.warning(f"Could not write the index file {index_file}: {e}")
+        return index
+
+    def paths(self, pattern: str = "*") -> List[str]:
+        """Get the JSON pointers of the indexed objects that match a pattern
+
+        Each segment of the pattern is matched to one segment of the pointers with
+        fnmatch, EG: "/regions/*" matches the regions of a DataSet but not the
+        objects inside them
+
+        Args:
+            pattern (str): The pattern, "*" for every object
+
+        Returns:
+            List[str]: The matching pointers, in the order the objects are in the file
+        """
+        if pattern == "*":
+            pointers: Iterator[str] = iter(self.index)
+        else:
+            segments = pattern.split("/")
+            pointers = (
+                x
+                for x in self.index
+                if len(x.split("/")) == len(segments)
+                and all(
+                    fnmatch.fnmatchcase(s, p) for s, p in zip(x.split("/"), segments)
+                )
+            )
+        return sorted(pointers, key=lambda x: self.index[x][0])
+
+    def read_bytes(self, pointer: str) -> bytes:
+        """Read the JSON text of an object
+
+        Args:
+            pointer (str): The object's JSON pointer
+
+        Returns:
+            bytes: The object's JSON
+
+        Raises:
+            KeyError: If there is no indexed object at the pointer
+        """
+        if pointer not in self.index:
+            raise KeyError(f"No indexed object at {pointer} in {self.json_file}")
+        start, end = self.index[pointer]
+        with open(self.json_file, "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def _object_hook(self, obj: Dict[str, Any]) -> Any:
+        """Replace references to sidecar arrays and shared objects"""
+        if "$array" in obj:
+            if self._arrays is None:
+                self._arrays = read_sidecar(get_sidecar_path(self.json_file))
+            return self._arrays[obj["$array"]][obj["index"]]
+        if "$ref" in obj:
+            return self._get_def(obj["$ref"].rsplit("/", 1)[-1])
+        return obj
+
+    def _get_def(self, key: str) -> Any:
+        """Get a shared object from the $defs section of a deduplicated file"""
+        if self._defs is None:
+            self._defs = json.loads(
+                self.read_bytes("/$defs"), object_hook=self._object_hook
+            )
+        return self._defs[key]
+
+    def load_data(self, pointer: str) -> Any:
+        """Parse an object without validating it
+
+        Arrays in the file's .npz sidecar, and shared objects in a deduplicated
+        file, are put in place of the references to them
+
+        Args:
+            pointer (str): The object's JSON pointer
+
+        Returns:
+            Any: The parsed data
+        """
+        return json.loads(self.read_bytes(pointer), object_hook=self._object_hook)
+
+    def load(self, pointer: str, model_class: Optional[Any] = None) -> Any:
+        """Load and validate an object
+
+        Args:
+            pointer (str): The object's JSON pointer
+            model_class (Optional[Any]): The type of the object, any type pydantic
+                can validate.  If None the type is found from the fields of
+                self.model
+
+        Returns:
+            Any: The validated object
+
+        Raises:
+            ValueError: If no type is given and the file has no model, or the
+                pointer does not match the fields of the model
+        """
+        if model_class is None:
+            if self.model is None:
+                raise ValueError(
+                    "A model_class is needed to load objects from a file with no model"
+                )
+            model_class = _pointer_type(self.model, pointer)
+        key = repr(model_class)
+        adapter = self._adapters.get(key)
+        if adapter is None:
+            adapter = self._adapters[key] = TypeAdapter(model_class)
+        if "/$defs" in self.index or get_sidecar_path(self.json_file).exists():
+            return adapter.validate_python(self.load_data(pointer))
+        return adapter.validate_json(self.read_bytes(pointer))
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from enum import Enum
-from typing import Optional, List, Union
+from typing import Any, Optional, List, Union
 
 import numpy as np
 from pydantic import Field, field_validator, model_validator
@@ -11,8 +11,9 @@ from src.tomobabel.models.basemodels import (
     Annotation,
     AnnotationSet,
     AnnotationSetTypes,
+    NumpyArray,
 )
-from src.tomobabel.models.transformations import Transformation
+from src.tomobabel.models.transformations import Transformation, TransformationType
 
 
 # TODO: give all these helper properties like center, corners vector and etc,
@@ -302,6 +303,163 @@ class ParticleCoordinatesSet(AnnotationSet):
     )
 
 
+class CompactParticleCoordinatesSet(AnnotationSet):
+    """
+    A set of particle coordinates with the values for each particle held in arrays.
+
+    This uses much less memory than a ParticleCoordinatesSet for the millions of
+    particles picked in a large dataset, and it is much faster to make. Particle
+    objects are only made when they are asked for.
+    """
+
+    type: str = AnnotationSetTypes.particle_coords
+    annotations: List[Annotation] = Field(
+        default_factory=list, description="The annotations"
+    )
+    coords: NumpyArray = Field(
+        default=...,
+        description=(
+            "The x, y, z coordinates of each particle in Ångstrom, with 0,0,0 at the"
+            " center of the tomogram"
+        ),
+    )
+    foms: Optional[NumpyArray] = Field(
+        default=None, description="Figure of merit for autopicking of each particle"
+    )
+    rotations: Optional[NumpyArray] = Field(
+        default=None,
+        description="The 3x3 rotation matrix that aligns each particle",
+    )
+
+    @field_validator("coords", mode="before")
+    @classmethod
+    def coords_array(cls, value: Any) -> np.ndarray:
+        return np.asarray(value, dtype=np.float64).reshape(-1, 3)
+
+    @field_validator("foms", mode="before")
+    @classmethod
+    def foms_array(cls, value: Any) -> Optional[np.ndarray]:
+        return None if value is None else np.asarray(value, dtype=np.float64)
+
+    @field_validator("rotations", mode="before")
+    @classmethod
+    def rotations_array(cls, value: Any) -> Optional[np.ndarray]:
+        if value is None:
+            return None
+        return np.asarray(value, dtype=np.float64).reshape(-1, 3, 3)
+
+    @model_validator(mode="after")
+    def check_particle_counts(self) -> CompactParticleCoordinatesSet:
+        n_particles = len(self.coords)
+        if self.foms is not None and len(self.foms) != n_particles:
+            raise ValueError("There must be a figure of merit for each particle")
+        if self.rotations is not None and len(self.rotations) != n_particles:
+            raise ValueError("There must be a rotation for each particle")
+        return self
+
+    @property
+    def n_particles(self) -> int:
+        return len(self.coords)
+
+    def particle(self, index: int) -> Particle:
+        """
+        Make the Particle object for a single particle
+
+        Args:
+            index (int): The index of the particle in the arrays, negative indices
+                count from the end
+
+        Returns:
+            Particle: The particle
+        """
+        x, y, z = self.coords[index]
+        xforms = []
+        if self.rotations is not None:
+            matrix = np.identity(4)
+            matrix[:3, :3] = self.rotations[index]
+            xforms.append(
+                Transformation(
+                    transform_type=TransformationType.rotation, trans_matrix=matrix
+                )
+            )
+        return Particle(
+            coords=CoordsLogical(x=float(x), y=float(y), z=float(z)),
+            fom=None if self.foms is None else float(self.foms[index]),
+            alignment_transformations=xforms,
+        )
+
+    @property
+    def particles(self) -> List[Particle]:
+        """
+        The Particle objects for all the particles, these are made each time they are
+        asked for
+
+        Returns:
+            List[Particle]: The particles
+        """
+        return [self.particle(n) for n in range(self.n_particles)]
+
+    @classmethod
+    def from_particle_set(
+        cls, particle_set: ParticleCoordinatesSet
+    ) -> CompactParticleCoordinatesSet:
+        """
+        Make a compact set from a ParticleCoordinatesSet
+
+        Args:
+            particle_set (ParticleCoordinatesSet): The set, all its particles must
+                have 3D coordinates and none or one rotation transformation, and either
+                all or none of them must have a figure of merit and a rotation
+
+        Returns:
+            CompactParticleCoordinatesSet: The compact set
+
+        Raises:
+            ValueError: If the particles can't be held in arrays
+        """
+        particles = particle_set.particles
+        if any(x.coords.z is None for x in particles):
+            raise ValueError("Only particles with 3D coordinates can be compacted")
+        foms = [x.fom for x in particles]
+        has_fom = [x is not None for x in foms]
+        n_xforms = [len(x.alignment_transformations) for x in particles]
+        if (
+            len(set(has_fom)) > 1
+            or len(set(n_xforms)) > 1
+            or max(n_xforms, default=0) > 1
+        ):
+            raise ValueError(
+                "Either all or none of the particles must have a figure of merit and a"
+                " single rotation"
+            )
+        rotations = None
+        if particles and n_xforms[0]:
+            rotations = np.array(
+                [x.alignment_transformations[0].trans_matrix[:3, :3] for x in particles]
+            )
+        return cls(
+            name=particle_set.name,
+            annotations=particle_set.annotations,
+            coords=np.array(
+                [[x.coords.x, x.coords.y, x.coords.z] for x in particles],
+                dtype=np.float64,
+            ),
+            foms=np.array(foms, dtype=np.float64) if particles and has_fom[0] else None,
+            rotations=rotations,
+        )
+
+    def to_particle_set(self) -> ParticleCoordinatesSet:
+        """
+        Make a ParticleCoordinatesSet with a Particle object for each particle
+
+        Returns:
+            ParticleCoordinatesSet: The particle set
+        """
+        return ParticleCoordinatesSet(
+            name=self.name, annotations=self.annotations, particles=self.particles
+        )
+
+
 # TODO: Add Surface and Volume Annotation types.  Investigate the best way to do this
 #  probably use the trimesh library and .stl files.
 
@@ -309,6 +467,7 @@ class ParticleCoordinatesSet(AnnotationSet):
 # see https://pydantic-docs.helpmanual.io/usage/models/#rebuilding-a-model
 
 AnnotationSet.model_rebuild()
+CompactParticleCoordinatesSet.model_rebuild()
 Cone.model_rebuild()
 Cuboid.model_rebuild()
 Cylinder.model_rebuild()
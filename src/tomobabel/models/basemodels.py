@@ -1,9 +1,29 @@
+from copy import deepcopy
 from enum import Enum
-from typing import Optional, List, Union
+from typing import (
+    Annotated,
+    Any,
+    Dict,
+    Optional,
+    List,
+    NamedTuple,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
 import numpy as np
-from pydantic import BaseModel, ConfigDict
+from pydantic import (
+    BaseModel,
+    BeforeValidator,
+    ConfigDict,
+    PlainSerializer,
+    SerializationInfo,
+    SerializeAsAny,
+)
 from pydantic import Field
+from pydantic_core import PydanticUndefined
 
 metamodel_version = "None"
 version = "0.0.1"
@@ -15,10 +35,171 @@ basemodel_config = ConfigDict(
     arbitrary_types_allowed=True,
     use_enum_values=True,
     strict=False,
-    json_encoders={np.ndarray: lambda a: a.tolist()},
+    # write NaN and inf as the json module does
+    ser_json_inf_nan="constants",
 )
 
 
+# the serialisation context key for an object that takes the arrays written to a
+# sidecar file, see :class:`~src.tomobabel.serialization.ArraySidecar`
+ARRAY_SIDECAR = "array_sidecar"
+
+
+def _array_to_json(value: np.ndarray, info: SerializationInfo) -> Any:
+    sidecar = info.context.get(ARRAY_SIDECAR) if info.context else None
+    if sidecar is not None:
+        return sidecar.add(value)
+    return value.tolist()
+
+
+# An array field, written as nested lists when a model is dumped to JSON by pydantic's
+# serialiser, or as a reference to an array in a sidecar file, and read back from lists
+# or arrays
+NumpyArray = Annotated[
+    np.ndarray,
+    BeforeValidator(np.asarray),
+    PlainSerializer(_array_to_json, when_used="json"),
+]
+
+
+M = TypeVar("M", bound=BaseModel)
+
+
+class ValidationLevel(str, Enum):
+    """
+    How much validation to do when converters build models
+
+    full: Every object is validated when it is made
+    construct: Objects are made without validation, as model_construct does, for data
+        the converter has already parsed and typed itself
+    final: Objects are made without validation then the finished objects are
+        validated once
+    """
+
+    full = "full"
+    construct = "construct"
+    final = "final"
+
+
+class _ModelFields(NamedTuple):
+    """How to fill in the fields of a model that aren't given when it is built"""
+
+    template: Dict[str, Any]  # immutable defaults, in field order
+    factories: List[Tuple[str, Any]]  # fields with a default factory
+    mutable: List[Tuple[str, Any]]  # fields with a default that must be copied
+    required: List[str]  # fields with no default
+
+
+_model_fields: Dict[type, _ModelFields] = {}
+_IMMUTABLE = (type(None), str, int, float, bool, bytes, tuple, frozenset, Enum)
+
+
+def _get_model_fields(model_class: Type[BaseModel]) -> _ModelFields:
+    fields = _model_fields.get(model_class)
+    if fields is None:
+        fields = _ModelFields({}, [], [], [])
+        for name, field in model_class.model_fields.items():
+            fields.template[name] = field.default
+            if field.default_factory is not None:
+                fields.factories.append((name, field.default_factory))
+            elif field.default is PydanticUndefined:
+                fields.required.append(name)
+            elif not isinstance(field.default, _IMMUTABLE):
+                fields.mutable.append((name, field.default))
+        _model_fields[model_class] = fields
+    return fields
+
+
+def build_model(model_class: Type[M], validation: ValidationLevel, **values: Any) -> M:
+    """
+    Make a model object, validating it only if the validation level requires it
+
+    Unvalidated objects are made the same way as model_construct() makes them, but
+    without its per-call overheads, which make model_construct() slower than
+    validating the small models the converters make.
+
+    Args:
+        model_class (Type[M]): The model to make
+        validation (ValidationLevel): The validation level
+        **values (Any): The field values
+
+    Returns:
+        M: The object
+    """
+    if validation == ValidationLevel.full:
+        return model_class(**values)
+    if model_class.__private_attributes__:
+        return model_class.model_construct(**values)
+
+    fields = _get_model_fields(model_class)
+    # updating a copy of the template keeps the fields in order
+    field_values = fields.template.copy()
+    field_values.update(values)
+    for name, factory in fields.factories:
+        if name not in values:
+            field_values[name] = factory()
+    for name, default in fields.mutable:
+        if name not in values:
+            field_values[name] = deepcopy(default)
+    for name in fields.required:
+        if name not in values:
+            del field_values[name]
+    obj = model_class.__new__(model_class)
+    object.__setattr__(obj, "__dict__", field_values)
+    object.__setattr__(obj, "__pydantic_fields_set__", set(values))
+    object.__setattr__(obj, "__pydantic_extra__", None)
+    object.__setattr__(obj, "__pydantic_private__", None)
+    return obj
+
+
+def _collect_models(obj: Any, found: Dict[int, BaseModel]) -> None:
+    """Find all the model instances in a tree of objects, children first"""
+    if isinstance(obj, BaseModel):
+        if id(obj) in found:
+            return
+        for value in obj.__dict__.values():
+            if isinstance(value, _CONTAINERS):
+                _collect_models(value, found)
+        found[id(obj)] = obj
+    elif isinstance(obj, dict):
+        for item in obj.values():
+            if isinstance(item, _CONTAINERS):
+                _collect_models(item, found)
+    else:
+        for item in obj:
+            if isinstance(item, _CONTAINERS):
+                _collect_models(item, found)
+
+
+_CONTAINERS = (BaseModel, list, tuple, dict)
+
+
+def validate_model_tree(model: M) -> M:
+    """
+    Validate a model and every model inside it, in place
+
+    This is the final pass for objects that were made without validation.  Each
+    object is validated once, even if it is used in many places, and values are
+    coerced as they would have been if the object had been validated when it was
+    made.  Objects that are shared stay shared.
+
+    Args:
+        model (M): The model to validate
+
+    Returns:
+        M: The same model
+
+    Raises:
+        pydantic.ValidationError: If any of the objects are invalid
+    """
+    found: Dict[int, BaseModel] = {}
+    _collect_models(model, found)
+    for obj in found.values():
+        validated = type(obj).model_validate(obj.__dict__)
+        obj.__dict__.update(validated.__dict__)
+    return model
+
+
 class Annotation(BaseModel):
     """
     BaseClass to hold annotations
@@ -58,7 +239,9 @@ class ConfiguredBaseModel(BaseModel):
 
     model_config = basemodel_config
 
-    annotations: List[Union[Annotation, AnnotationSet]] = Field(
+    # subclasses, such as points and particle sets, are dumped with all their fields,
+    # otherwise only the fields of Annotation or AnnotationSet would be kept
+    annotations: List[SerializeAsAny[Union[Annotation, AnnotationSet]]] = Field(
         default_factory=list, description="Annotations for this Image"
     )
 
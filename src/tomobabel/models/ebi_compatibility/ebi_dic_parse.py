@@ -2,12 +2,13 @@ from gemmi import cif
 from typing import Dict, Any
 import argparse
 import sys
-from src.tomobabel.ebi_compatibility import ebi_cats
+from src.tomobabel.models.ebi_compatibility.ebi_cats import write_categories
 
 # This script parses the .dic file with the ebi data model and returns the deposition
 #  data fields for pipeliner's deposition system
 #
-# For each main field it writes a dict entry in tomobabel.ebi_compatibility.ebi_cats
+# For each main field it writes an entry in tomobabel/models/ebi_compatibility/
+#  ebi_cats.json, which is read by tomobabel.models.ebi_compatibility.ebi_cats
 #  field_name: {Subfield1: {datatype: str, regex: str, options: List[str]}}
 #  datatype: The ebi defined data type
 #  reges: regex used to validate the data in this subfield
@@ -68,13 +69,8 @@ def main(in_args=None) -> None:
                     "options": tc,
                 }
 
-    # write jsons to check
-    with open(ebi_cats.__file__, "w") as outfile:
-        outfile.write(
-            "# flake8: noqa\nfrom typing import Dict, Sequence, Union"
-            "\n\nDEPOBJ_CATS: Dict[str, Dict[str, Dict[str, Union[str, Sequence[str]]]]"
-            f"] = {categories}"
-        )
+    # write the categories to the data file
+    write_categories(categories)
 
 
 if __name__ == "__main__":
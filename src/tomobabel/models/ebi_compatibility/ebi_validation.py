@@ -1,4 +1,5 @@
-from typing import List
+from functools import lru_cache
+from typing import FrozenSet, List, NamedTuple, Pattern, Tuple, Type
 from warnings import warn
 from pydantic import model_validator, PrivateAttr
 import re
@@ -6,6 +7,20 @@ from src.tomobabel.models.basemodels import ConfiguredBaseModel
 from src.tomobabel.models.ebi_compatibility.ebi_cats import DEPOBJ_CATS
 
 
+class EbiFieldCheck(NamedTuple):
+    """How the value of a field is checked against the EBI schema
+
+    Attributes:
+        name (str): The field name
+        options (FrozenSet[str]): The allowed values, empty if they are not limited
+        regex (Pattern[str]): The regex the value must match
+    """
+
+    name: str
+    options: FrozenSet[str]
+    regex: Pattern[str]
+
+
 class EbiLinkedBaseModel(ConfiguredBaseModel):
     """
     A class for fields that are directly linked to EBI schema and are validated
@@ -27,6 +42,47 @@ class EbiLinkedBaseModel(ConfiguredBaseModel):
         return fields
 
 
+@lru_cache(maxsize=None)
+def get_ebi_field_checks(
+    model_class: Type[EbiLinkedBaseModel], scheme_name: str
+) -> Tuple[EbiFieldCheck, ...]:
+    """Get the checks for the fields of an EbiLinkedBaseModel
+
+    The schema category is looked up, the regexes compiled and the options made into
+    sets once for each model class, rather than every time a model is validated.
+
+    Args:
+        model_class (Type[EbiLinkedBaseModel]): The model class
+        scheme_name (str): The EBI schema category the model corresponds to
+
+    Returns:
+        Tuple[EbiFieldCheck, ...]: The checks for each of the model's EBI fields
+
+    Raises:
+        ValueError: If the schema category does not exist, or the model has fields
+            that are not in it
+    """
+    ebi_dict = DEPOBJ_CATS.get(scheme_name)
+    if not ebi_dict:
+        raise ValueError(f"{scheme_name} is not a valid EBI data model field")
+    fields = [x for x in model_class.model_fields if x != "annotations"]
+    bad_fields = [x for x in fields if str(x) not in ebi_dict]
+    if bad_fields:
+        raise ValueError(
+            f"The following fields {bad_fields} are not present in the EBI schema."
+            " If they are desired a ConfiguredBaseModel should be used rather than an "
+            "EbiLinkedBaseModel"
+        )
+    return tuple(
+        EbiFieldCheck(
+            name=x,
+            options=frozenset(ebi_dict[x]["options"]),
+            regex=re.compile(str(ebi_dict[x]["regex"])),
+        )
+        for x in fields
+    )
+
+
 def validate_fields_against_ebi(cets_obj: EbiLinkedBaseModel) -> None:
     """Validate a value against the allowed choices in the EBI schema
 
@@ -35,29 +91,29 @@ def validate_fields_against_ebi(cets_obj: EbiLinkedBaseModel) -> None:
 
     Args:
         cets_obj (ConfiguredBaseModel): The model to be checked IE `self`
-        fields (List[str]): The fields to be validated against the EBI schema choices
     Raises:
         Warning: If a field's allowable values are limited in the EBI schema and the
             value is not in the list of allowed values
 
     """
-    for attr in cets_obj.ebi_fields:
-        ebi_dict = DEPOBJ_CATS[cets_obj._ebi_scheme_name]
-        options = ebi_dict[attr]["options"]
-        if getattr(cets_obj, attr) is not None:
-            value = str(getattr(cets_obj, attr))
-            if options and value not in options:
-                warn(
-                    f"CETS model: {cets_obj.__class__.__name__}.{attr}: The value"
-                    f" {value} is not on the approved list of values in the EBI schema"
-                    " for deposition in the PDB/EMDB"
-                )
-            elif not re.match(str(ebi_dict[attr]["regex"]), value):
-                warn(
-                    f"CETS model: {cets_obj.__class__.__name__}.{attr}: The value"
-                    f" {value} does not satisfy the validation regex for this field in"
-                    " the EBI schema"
-                )
+    checks = get_ebi_field_checks(type(cets_obj), cets_obj._ebi_scheme_name)
+    for check in checks:
+        value = getattr(cets_obj, check.name)
+        if value is None:
+            continue
+        value = str(value)
+        if check.options and value not in check.options:
+            warn(
+                f"CETS model: {cets_obj.__class__.__name__}.{check.name}: The value"
+                f" {value} is not on the approved list of values in the EBI schema"
+                " for deposition in the PDB/EMDB"
+            )
+        elif not check.regex.match(value):
+            warn(
+                f"CETS model: {cets_obj.__class__.__name__}.{check.name}: The value"
+                f" {value} does not satisfy the validation regex for this field in"
+                " the EBI schema"
+            )
 
 
 def match_ebi_linked_model_fields(cets_obj: EbiLinkedBaseModel) -> None:
@@ -68,18 +124,4 @@ def match_ebi_linked_model_fields(cets_obj: EbiLinkedBaseModel) -> None:
     that entry, but cannot contain any additional fields.  If it does a standard
     ConfiguredBaseModel should be used instead.
     """
-    bad_fields = []
-    for field in cets_obj.ebi_fields:
-        ebi_dict = DEPOBJ_CATS.get(cets_obj._ebi_scheme_name)
-        if not ebi_dict:
-            raise ValueError(
-                f"{cets_obj._ebi_scheme_name} is not a valid EBI data model field"
-            )
-        elif str(field) not in ebi_dict.keys():
-            bad_fields.append(field)
-    if bad_fields:
-        raise ValueError(
-            f"The following fields {bad_fields} are not present in the EBI schema."
-            " If they are desired a ConfiguredBaseModel should be used rather than an "
-            "EbiLinkedBaseModel"
-        )
+    get_ebi_field_checks(type(cets_obj), cets_obj._ebi_scheme_name)
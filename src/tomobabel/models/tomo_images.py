@@ -1,14 +1,16 @@
 from __future__ import annotations
 
-from typing import List, Optional
+from typing import Any, List, Optional, Union
 
-from pydantic import Field
+import numpy as np
+from pydantic import BaseModel, Field, field_validator, model_validator
 
 from src.tomobabel.models.basemodels import (
     ConfiguredBaseModel,
     Image2D,
     Image3D,
     CoordsLogical,
+    NumpyArray,
 )
 from src.tomobabel.models.transformations import Transformation
 
@@ -124,12 +126,202 @@ class MovieStack(ConfiguredBaseModel):
     path: str = Field(default="")
 
 
+def _comparable(value: Any) -> Any:
+    """Get a value that can be compared with ==, models can hold arrays which can't"""
+    if isinstance(value, BaseModel):
+        return value.model_dump_json()
+    if isinstance(value, list):
+        return [_comparable(x) for x in value]
+    return value
+
+
+class CompactMovieStack(ConfiguredBaseModel):
+    """
+    A stack of movie frames with the values that change between frames held in arrays.
+
+    Only the section, accumulated dose and shift differ between the frames of a movie,
+    so everything else is stored once for the whole stack.  This uses much less memory
+    than a MovieStack for movies with many frames.  MovieFrame objects are only made
+    when they are asked for.
+    """
+
+    path: str = Field(default="")
+    sections: NumpyArray = Field(
+        default=..., description="0-based section index of each frame in the stack"
+    )
+    accumulated_doses: NumpyArray = Field(
+        default=..., description="The pre-exposure up to each frame in e-/A^2"
+    )
+    frame_shifts: Optional[NumpyArray] = Field(
+        default=None,
+        description="The x, y shift of each frame from motion correction in pixels",
+    )
+    nominal_tilt_angle: Optional[float] = Field(
+        default=None, description="The tilt angle reported by the microscope in degrees"
+    )
+    ctf_metadata: Optional[CTFMetadata] = Field(
+        default=None, description="A set of CTF patameters for the frames"
+    )
+    width: Optional[int] = Field(
+        default=None, description="The width of the frames (x-axis) in pixels"
+    )
+    height: Optional[int] = Field(
+        default=None, description="The height of the frames (y-axis) in pixels"
+    )
+    pixel_size: Optional[float] = Field(default=None, description="The pixel size in Å")
+    motion_correction_transformations: List[Transformation] = Field(
+        default_factory=list,
+        description=(
+            "Transformations applied to every frame during motion correction, used"
+            " when there are no frame_shifts"
+        ),
+    )
+
+    @field_validator("sections", mode="before")
+    @classmethod
+    def sections_array(cls, value: Any) -> np.ndarray:
+        return np.asarray(value, dtype=np.int64)
+
+    @field_validator("accumulated_doses", mode="before")
+    @classmethod
+    def doses_array(cls, value: Any) -> np.ndarray:
+        return np.asarray(value, dtype=np.float64)
+
+    @field_validator("frame_shifts", mode="before")
+    @classmethod
+    def shifts_array(cls, value: Any) -> Optional[np.ndarray]:
+        return None if value is None else np.asarray(value, dtype=np.float64)
+
+    @model_validator(mode="after")
+    def check_frame_counts(self) -> CompactMovieStack:
+        n_frames = len(self.sections)
+        if len(self.accumulated_doses) != n_frames:
+            raise ValueError("There must be an accumulated dose for each section")
+        if self.frame_shifts is not None and self.frame_shifts.shape != (n_frames, 2):
+            raise ValueError("frame_shifts must have an x, y shift for each section")
+        return self
+
+    @property
+    def n_frames(self) -> int:
+        return len(self.sections)
+
+    def frame(self, index: int) -> MovieFrame:
+        """
+        Make the MovieFrame object for a single frame
+
+        Args:
+            index (int): The index of the frame in the arrays, negative indices count
+                from the end
+
+        Returns:
+            MovieFrame: The frame
+        """
+        if self.frame_shifts is None:
+            xforms = list(self.motion_correction_transformations)
+        else:
+            # imported here as transform_factory needs scipy, which the models don't
+            from src.tomobabel.models.transform_factory import translation
+
+            xforms = [
+                translation(
+                    x_shift=float(self.frame_shifts[index, 0]),
+                    y_shift=float(self.frame_shifts[index, 1]),
+                    dim=2,
+                )
+            ]
+        return MovieFrame(
+            path=self.path,
+            section=int(self.sections[index]),
+            nominal_tilt_angle=self.nominal_tilt_angle,
+            accumulated_dose=float(self.accumulated_doses[index]),
+            ctf_metadata=self.ctf_metadata,
+            width=self.width,
+            height=self.height,
+            pixel_size=self.pixel_size,
+            motion_correction_transformations=xforms,
+        )
+
+    @property
+    def frame_images(self) -> List[MovieFrame]:
+        """
+        The MovieFrame objects for all the frames, these are made each time they are
+        asked for
+
+        Returns:
+            List[MovieFrame]: The frames
+        """
+        return [self.frame(n) for n in range(self.n_frames)]
+
+    @classmethod
+    def from_movie_stack(cls, stack: MovieStack) -> CompactMovieStack:
+        """
+        Make a compact stack from a MovieStack
+
+        Args:
+            stack (MovieStack): The stack, all its frames must have the same path, tilt
+                angle, size, pixel size, CTF and motion correction transformations
+
+        Returns:
+            CompactMovieStack: The compact stack
+
+        Raises:
+            ValueError: If the shared values differ between frames
+        """
+        frames = stack.frame_images
+        shared = (
+            "path",
+            "nominal_tilt_angle",
+            "ctf_metadata",
+            "width",
+            "height",
+            "pixel_size",
+            "motion_correction_transformations",
+        )
+        first = frames[0] if frames else MovieFrame()
+        first_values = {x: _comparable(getattr(first, x)) for x in shared}
+        for frame in frames[1:]:
+            for field in shared:
+                value = getattr(frame, field)
+                if value is not getattr(first, field) and (
+                    _comparable(value) != first_values[field]
+                ):
+                    raise ValueError(
+                        f"The {field} of the frames in {stack.path} are not all the"
+                        " same"
+                    )
+        return cls(
+            path=stack.path,
+            sections=np.array([x.section for x in frames], dtype=np.int64),
+            accumulated_doses=np.array(
+                [x.accumulated_dose for x in frames], dtype=np.float64
+            ),
+            nominal_tilt_angle=first.nominal_tilt_angle,
+            ctf_metadata=first.ctf_metadata,
+            width=first.width,
+            height=first.height,
+            pixel_size=first.pixel_size,
+            motion_correction_transformations=first.motion_correction_transformations,
+            annotations=stack.annotations,
+        )
+
+    def to_movie_stack(self) -> MovieStack:
+        """
+        Make a MovieStack with a MovieFrame object for each frame
+
+        Returns:
+            MovieStack: The movie stack
+        """
+        return MovieStack(
+            path=self.path, frame_images=self.frame_images, annotations=self.annotations
+        )
+
+
 class MovieStackSet(ConfiguredBaseModel):
     """
     A group of movie stacks that belong to a single tilt series.
     """
 
-    movie_stacks: List[MovieStack] = Field(
+    movie_stacks: List[Union[MovieStack, CompactMovieStack]] = Field(
         default_factory=list, description="The movie stacks"
     )
     gain_file: Optional[GainFile] = Field(
@@ -279,6 +471,7 @@ class Map(ConfiguredBaseModel):
 # Model rebuilds
 # see https://pydantic-docs.helpmanual.io/usage/models/#rebuilding-a-model
 
+CompactMovieStack.model_rebuild()
 CTFMetadata.model_rebuild()
 DefectFile.model_rebuild()
 GainFile.model_rebuild()
@@ -5,7 +5,7 @@ from enum import Enum
 import numpy as np
 from pydantic import Field
 
-from src.tomobabel.models.basemodels import ConfiguredBaseModel
+from src.tomobabel.models.basemodels import ConfiguredBaseModel, NumpyArray
 
 
 class TransformationType(str, Enum):
@@ -23,7 +23,7 @@ class Transformation(ConfiguredBaseModel):
     """
 
     transform_type: str = TransformationType.identity
-    trans_matrix: np.ndarray = Field(
+    trans_matrix: NumpyArray = Field(
         default=np.identity(4),
         description="The matrix used to apply the transformation",
     )
@@ -0,0 +1,412 @@
+import os
+import sqlite3
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple, Optional, Tuple, Union
+
+import mrcfile
+
+"""Header-only access to MRC files
+
+Only the 1024 byte main header of an MRC file is read, the extended header and the
+image data are never touched.  This makes getting the dimensions of multi-GB movie
+stacks and tomograms as cheap as a single small read.
+
+The layout follows the MRC2014 format: https://www.ccpem.ac.uk/mrc_format/mrc2014.php
+
+Headers can also be stored in a persistent :class:`HeaderCache` so that files that
+have not changed since they were last seen don't need to be opened at all.
+"""
+
+MRC_HEADER_SIZE = 1024
+
+# modes defined in MRC2014 plus the IMOD 4-bit mode
+VALID_MRC_MODES = (0, 1, 2, 3, 4, 6, 12, 101)
+
+# words 1-10: nx, ny, nz, mode, nxstart, nystart, nzstart, mx, my, mz
+# words 11-13: cella, word 24: nsymbt, words 50-52: origin, word 54: machst
+_INT_WORDS = "10i"
+_CELLA = "3f"
+_ORIGIN_OFFSET = 196
+_MACHST_OFFSET = 212
+_NSYMBT_OFFSET = 92
+
+
+class MrcHeader(NamedTuple):
+    """The parts of an MRC header needed to describe an image without reading it
+
+    Attributes:
+        nx (int): Number of columns, the image x dimension in px
+        ny (int): Number of rows, the image y dimension in px
+        nz (int): Number of sections, the image z dimension (or frames) in px
+        mode (int): The MRC data mode
+        voxel_size (Tuple[float, float, float]): Voxel size in x, y and z in Å/px
+        origin (Tuple[float, float, float]): The origin in x, y and z in Å
+        extended_header_size (int): Length of the extended header in bytes
+    """
+
+    nx: int
+    ny: int
+    nz: int
+    mode: int
+    voxel_size: Tuple[float, float, float]
+    origin: Tuple[float, float, float]
+    extended_header_size: int
+
+    @property
+    def dims(self) -> Tuple[int, int, int]:
+        return self.nx, self.ny, self.nz
+
+
+class MalformedMrcHeaderError(ValueError):
+    """Raised when the main header of an MRC file cannot be interpreted"""
+
+
+def _byte_order_from_machst(machst: bytes) -> Optional[str]:
+    """Get the struct byte order character from the machine stamp
+
+    Args:
+        machst (bytes): The four byte machine stamp
+
+    Returns:
+        Optional[str]: "<" for little endian, ">" for big endian or None if the
+            machine stamp is not recognised
+    """
+    if machst[0] == 0x44:
+        return "<"
+    if machst[0] == 0x11:
+        return ">"
+    return None
+
+
+def _plausible(nx: int, ny: int, nz: int, mode: int) -> bool:
+    return nx > 0 and ny > 0 and nz > 0 and mode in VALID_MRC_MODES
+
+
+def parse_mrc_header(header: bytes) -> MrcHeader:
+    """Interpret the bytes of an MRC main header
+
+    The byte order is taken from the machine stamp, if the values don't make sense
+    in that order the other one is tried.
+
+    Args:
+        header (bytes): At least the first 1024 bytes of the file
+
+    Returns:
+        MrcHeader: The header values
+
+    Raises:
+        MalformedMrcHeaderError: If the header is too short or the values don't make
+            sense in either byte order
+    """
+    if len(header) < MRC_HEADER_SIZE:
+        raise MalformedMrcHeaderError(
+            f"MRC header is {len(header)} bytes, expected {MRC_HEADER_SIZE}"
+        )
+    # some programs write the wrong machine stamp so try the other order as well
+    stamped = _byte_order_from_machst(header[_MACHST_OFFSET : _MACHST_OFFSET + 4])
+    orders = ["<", ">"] if stamped != ">" else [">", "<"]
+    for order in orders:
+        words = struct.unpack_from(order + _INT_WORDS, header, 0)
+        nx, ny, nz, mode = words[:4]
+        if not _plausible(nx, ny, nz, mode):
+            continue
+        mx, my, mz = words[7:10]
+        (nsymbt,) = struct.unpack_from(order + "i", header, _NSYMBT_OFFSET)
+        if nsymbt < 0:
+            continue
+        cx, cy, cz = struct.unpack_from(order + _CELLA, header, 40)
+        ox, oy, oz = struct.unpack_from(order + "3f", header, _ORIGIN_OFFSET)
+        return MrcHeader(
+            nx=nx,
+            ny=ny,
+            nz=nz,
+            mode=mode,
+            voxel_size=(
+                cx / mx if mx > 0 else 0.0,
+                cy / my if my > 0 else 0.0,
+                cz / mz if mz > 0 else 0.0,
+            ),
+            origin=(ox, oy, oz),
+            extended_header_size=nsymbt,
+        )
+    raise MalformedMrcHeaderError("MRC header values are not valid in any byte order")
+
+
+def _header_from_mrcfile(mrc_file: Path) -> MrcHeader:
+    """Read the header with mrcfile, which is more forgiving of unusual files
+
+    Args:
+        mrc_file (Path): The file to read
+
+    Returns:
+        MrcHeader: The header values
+    """
+    with mrcfile.open(mrc_file, permissive=True, header_only=True) as mrc:
+        hdr = mrc.header
+        vs = mrc.voxel_size
+        return MrcHeader(
+            nx=int(hdr.nx),
+            ny=int(hdr.ny),
+            nz=int(hdr.nz),
+            mode=int(hdr.mode),
+            voxel_size=(float(vs.x), float(vs.y), float(vs.z)),
+            origin=(
+                float(hdr.origin.x),
+                float(hdr.origin.y),
+                float(hdr.origin.z),
+            ),
+            extended_header_size=int(hdr.nsymbt),
+        )
+
+
+def read_mrc_header(mrc_file: Path) -> MrcHeader:
+    """Read the main header of an MRC file without reading any image data
+
+    Falls back to mrcfile in permissive mode if the header can't be interpreted
+
+    Args:
+        mrc_file (Path): The file to read
+
+    Returns:
+        MrcHeader: The header values
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+    """
+    with open(mrc_file, "rb") as f:
+        header = f.read(MRC_HEADER_SIZE)
+    try:
+        return parse_mrc_header(header)
+    except MalformedMrcHeaderError:
+        return _header_from_mrcfile(mrc_file)
+
+
+def default_header_cache_path() -> Path:
+    """Get the default location for the persistent header cache
+
+    This is $TOMOBABEL_CACHE_DIR if it is set, otherwise tomobabel/ in the user's
+    cache dir ($XDG_CACHE_HOME or ~/.cache)
+
+    Returns:
+        Path: The cache database file
+    """
+    cache_dir = os.environ.get("TOMOBABEL_CACHE_DIR")
+    if cache_dir is None:
+        xdg = os.environ.get("XDG_CACHE_HOME")
+        base = Path(xdg) if xdg else Path.home() / ".cache"
+        cache_dir = str(base / "tomobabel")
+    return Path(cache_dir) / "mrc_headers.sqlite"
+
+
+class HeaderCache(object):
+    """A persistent cache of MRC header data stored in an SQLite database
+
+    Entries are keyed by the absolute path of the file and are only used if the
+    file's size and modification time are unchanged since the header was read, so
+    looking up an unchanged file costs a single stat.  When the cache holds more than
+    max_entries the least recently used entries are evicted.
+
+    The cache can be shared between threads, and several processes can use the same
+    database file.
+
+    Attributes:
+        path (Path): The SQLite database file, ":memory:" for a non-persistent cache
+        max_entries (int): The maximum number of headers to keep
+        hits (int): Number of lookups answered from the cache
+        misses (int): Number of lookups that needed the file header to be read
+    """
+
+    # commit after this many changes, uncommitted changes are written on close()
+    commit_interval = 500
+
+    def __init__(
+        self, path: Optional[Union[Path, str]] = None, max_entries: int = 200000
+    ) -> None:
+        if max_entries < 1:
+            raise ValueError("The header cache must be able to hold at least 1 entry")
+        self.path = default_header_cache_path() if path is None else Path(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._pending = 0
+        if str(self.path) != ":memory:":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            str(self.path), timeout=30.0, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS headers ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+            "nx INTEGER, ny INTEGER, nz INTEGER, mode INTEGER, "
+            "vx REAL, vy REAL, vz REAL, ox REAL, oy REAL, oz REAL, "
+            "nsymbt INTEGER, last_used INTEGER)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS headers_last_used ON headers (last_used)"
+        )
+        self._conn.commit()
+        # approximate, counts replaced entries and not other processes' inserts, so
+        # the table is only counted when it might be over the limit
+        self._n_entries = self._count()
+
+    def __enter__(self) -> "HeaderCache":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._count()
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM headers").fetchone()[0]
+
+    def _changed(self) -> None:
+        self._pending += 1
+        if self._pending >= self.commit_interval:
+            self._conn.commit()
+            self._pending = 0
+
+    def get(self, mrc_file: Union[Path, str]) -> Optional[MrcHeader]:
+        """Get the cached header for a file if it is still valid
+
+        Args:
+            mrc_file (Union[Path, str]): The file to look up
+
+        Returns:
+            Optional[MrcHeader]: The header or None if the file isn't in the cache or
+                has changed since it was cached
+
+        Raises:
+            FileNotFoundError: If the file does not exist
+        """
+        key = os.path.abspath(mrc_file)
+        st = os.stat(key)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT nx, ny, nz, mode, vx, vy, vz, ox, oy, oz, nsymbt FROM headers"
+                " WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (key, st.st_size, st.st_mtime_ns),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE headers SET last_used = ? WHERE path = ?", (time.time_ns(), key)
+            )
+            self._changed()
+        return MrcHeader(
+            nx=row[0],
+            ny=row[1],
+            nz=row[2],
+            mode=row[3],
+            voxel_size=(row[4], row[5], row[6]),
+            origin=(row[7], row[8], row[9]),
+            extended_header_size=row[10],
+        )
+
+    def put(
+        self,
+        mrc_file: Union[Path, str],
+        header: MrcHeader,
+        stat: Optional[os.stat_result] = None,
+    ) -> None:
+        """Add a header to the cache, replacing any existing entry for the file
+
+        Args:
+            mrc_file (Union[Path, str]): The file the header is from
+            header (MrcHeader): The header
+            stat (Optional[os.stat_result]): The stat of the file taken before the
+                header was read. If None the file is stat-ed now.
+        """
+        key = os.path.abspath(mrc_file)
+        st = os.stat(key) if stat is None else stat
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO headers VALUES"
+                " (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    st.st_size,
+                    st.st_mtime_ns,
+                    header.nx,
+                    header.ny,
+                    header.nz,
+                    header.mode,
+                    *header.voxel_size,
+                    *header.origin,
+                    header.extended_header_size,
+                    time.time_ns(),
+                ),
+            )
+            self._n_entries += 1
+            if self._n_entries > self.max_entries:
+                self._evict()
+            self._changed()
+
+    def _evict(self) -> None:
+        """Remove the least recently used entries if the cache is over its limit
+
+        Evicts down to 90% of the limit so it isn't needed on every insert
+        """
+        n = self._count()
+        if n > self.max_entries:
+            n_remove = n - int(self.max_entries * 0.9)
+            self._conn.execute(
+                "DELETE FROM headers WHERE path IN"
+                " (SELECT path FROM headers ORDER BY last_used LIMIT ?)",
+                (n_remove,),
+            )
+            n -= n_remove
+        self._n_entries = n
+
+    def read_header(self, mrc_file: Union[Path, str]) -> MrcHeader:
+        """Get the header for a file, from the cache if possible
+
+        If the file is not in the cache or has changed its header is read and the
+        cache is updated.
+
+        Args:
+            mrc_file (Union[Path, str]): The file to read
+
+        Returns:
+            MrcHeader: The header values
+
+        Raises:
+            FileNotFoundError: If the file does not exist
+        """
+        cached = self.get(mrc_file)
+        with self._lock:
+            if cached is not None:
+                self.hits += 1
+                return cached
+            self.misses += 1
+        st = os.stat(mrc_file)
+        header = read_mrc_header(Path(mrc_file))
+        self.put(mrc_file, header, st)
+        return header
+
+    def clear(self) -> None:
+        """Remove all entries from the cache"""
+        with self._lock:
+            self._conn.execute("DELETE FROM headers")
+            self._conn.commit()
+            self._pending = 0
+            self._n_entries = 0
+
+    def flush(self) -> None:
+        """Write any pending changes to the database"""
+        with self._lock:
+            self._conn.commit()
+            self._pending = 0
+
+    def close(self) -> None:
+        """Write any pending changes and close the database"""
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,202 @@
+import json
+import os
+import platform
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from importlib import metadata
+from pathlib import Path
+from typing import Any, ContextManager, Dict, Iterator, Optional, Union
+
+import numpy as np
+import pydantic
+from pydantic import BaseModel
+
+from src.tomobabel.interning import distinct_models
+
+"""Opt-in profiling of conversions
+
+A :class:`ConversionProfiler` records the wall time and number of calls of each stage
+of a conversion (STAR file parsing, image header reads, building the models,
+serialising and writing the output), counters such as the number of bytes read from
+image headers, and the number of objects made for each tilt series.  The report is
+written as JSON so runs with different versions can be compared.
+
+When a profiler is disabled every method returns immediately, so the converters can
+always call it.
+
+Stage times are inclusive and stages can be nested, so the times of different stages
+can overlap.  When tilt series are converted in parallel the profiles of the worker
+processes are merged into the main one, so stage times are summed across processes
+and can be larger than the total wall time.
+"""
+
+REPORT_VERSION = 1
+
+_NO_STAGE = nullcontext()
+
+
+@lru_cache(maxsize=None)
+def get_versions() -> Dict[str, Optional[str]]:
+    """Get the versions of the software that affect conversion performance
+
+    Returns:
+        Dict[str, Optional[str]]: {package: version}, the TomoBabel version is None if
+            it is not installed as a package
+    """
+    try:
+        tomobabel_version: Optional[str] = metadata.version("TomoBabel")
+    except metadata.PackageNotFoundError:
+        tomobabel_version = None
+    return {
+        "tomobabel": tomobabel_version,
+        "python": platform.python_version(),
+        "pydantic": pydantic.VERSION,
+        "numpy": np.__version__,
+    }
+
+
+def count_objects(*models: BaseModel) -> Dict[str, int]:
+    """Count the distinct model objects in one or more model trees by class
+
+    Objects that are shared by several parents are only counted once.
+
+    Args:
+        *models (BaseModel): The models to count
+
+    Returns:
+        Dict[str, int]: The number of objects of each class {class name: count}
+    """
+    by_class: Dict[str, int] = {}
+    for obj in distinct_models(*models):
+        name = type(obj).__name__
+        by_class[name] = by_class.get(name, 0) + 1
+    return dict(sorted(by_class.items()))
+
+
+class ConversionProfiler(object):
+    """Collects timings, counters and object counts for a conversion
+
+    Attributes:
+        enabled (bool): If False nothing is recorded
+        stages (Dict[str, Dict[str, float]]): The total time and number of calls of
+            each stage {stage: {"seconds": time, "calls": n}}
+        counters (Dict[str, int]): Named counts, EG: "header_bytes_read"
+        tilt_series (Dict[str, Dict[str, Any]]): Details of each converted tilt series
+            {tilt_series_name: {"seconds": time, "objects": {class name: count}...}}
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, int] = {}
+        self.tilt_series: Dict[str, Dict[str, Any]] = {}
+        self._start = time.perf_counter()
+
+    def stage(self, name: str) -> ContextManager:
+        """Time a stage of the conversion
+
+        Use as a context manager, the time is added to any earlier time for the stage
+
+        Args:
+            name (str): The name of the stage
+
+        Returns:
+            ContextManager: Times the block it is used for
+        """
+        if not self.enabled:
+            return _NO_STAGE
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float, calls: int = 1) -> None:
+        """Add time to a stage that was measured elsewhere
+
+        Args:
+            name (str): The name of the stage
+            seconds (float): The time to add
+            calls (int): The number of calls to add
+        """
+        if not self.enabled:
+            return
+        entry = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+        entry["seconds"] += seconds
+        entry["calls"] += calls
+
+    def count(self, name: str, n: int = 1) -> None:
+        """Add to a counter
+
+        Args:
+            name (str): The counter
+            n (int): The amount to add
+        """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record_tilt_series(self, ts_name: str, **details: Any) -> None:
+        """Add details for a converted tilt series
+
+        Args:
+            ts_name (str): The tilt series
+            **details (Any): The values to record, they must be JSON serialisable
+        """
+        if self.enabled:
+            self.tilt_series.setdefault(ts_name, {}).update(details)
+
+    def merge(self, report: Dict[str, Any]) -> None:
+        """Add the results from another profiler, EG: one in a worker process
+
+        Args:
+            report (Dict[str, Any]): The other profiler's :meth:`to_dict` output
+        """
+        if not self.enabled:
+            return
+        for name, entry in report["stages"].items():
+            self.add_time(name, entry["seconds"], int(entry["calls"]))
+        for name, n in report["counters"].items():
+            self.count(name, n)
+        for ts_name, details in report["tilt_series"].items():
+            self.record_tilt_series(ts_name, **details)
+
+    def reset(self) -> None:
+        """Forget everything recorded so far and restart the total time"""
+        self.stages = {}
+        self.counters = {}
+        self.tilt_series = {}
+        self._start = time.perf_counter()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get the results
+
+        Returns:
+            Dict[str, Any]: The report, stages are sorted slowest first
+        """
+        stages = sorted(self.stages.items(), key=lambda x: -x[1]["seconds"])
+        return {
+            "report_version": REPORT_VERSION,
+            "versions": dict(get_versions()),
+            "command": [os.path.basename(sys.argv[0])] + sys.argv[1:],
+            "total_seconds": time.perf_counter() - self._start,
+            "stages": {name: dict(entry) for name, entry in stages},
+            "counters": dict(sorted(self.counters.items())),
+            "tilt_series": self.tilt_series,
+        }
+
+    def write(self, report_file: Union[Path, str]) -> None:
+        """Write the results to a JSON file
+
+        Args:
+            report_file (Union[Path, str]): The file to write
+        """
+        report_file = Path(report_file)
+        report_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(report_file, "w") as f:
+            json.dump(self.to_dict(), f, indent=4)
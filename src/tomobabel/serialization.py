@@ -0,0 +1,451 @@
+import json
+import os
+import struct
+import zipfile
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from pydantic import BaseModel
+from pydantic_core import to_json
+
+from src.tomobabel.models.basemodels import ARRAY_SIDECAR
+from src.tomobabel.profiling import ConversionProfiler
+from src.tomobabel.utils import NumpyEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+"""Write models and dumped model data as JSON
+
+The converters used to dump each model to a dict with model_dump() then encode the
+dict with the json module, converting the numpy arrays in it with NumpyEncoder.  That
+builds the whole tree of Python objects for the output and then walks it again in
+Python.  Here models are encoded straight to JSON by pydantic's Rust serialiser, which
+converts the array fields itself (see :data:`~src.tomobabel.models.basemodels.
+NumpyArray`), and writes the same output much faster.
+
+Three backends are available:
+
+- pydantic: pydantic's serialiser, the default.  The indented output has the same
+  layout and values as the json module writes with indent=4, but it is not the same
+  text: non-ASCII characters are not escaped and some floats are formatted differently,
+  EG: 1e-05 is written as 0.00001 and 2.5e-07 as 2.5e-7.  The parsed values are the
+  same
+- orjson: dumps the model to a dict then encodes it with orjson, if it is installed.
+  orjson can only indent by 2 spaces, and writes NaN and inf as null
+- json: the json module with NumpyEncoder, as the converters used to write
+
+Numeric arrays can be written to a NumPy sidecar file next to the JSON file rather
+than as nested lists, see :class:`ArraySidecar`.  The arrays make up most of the bytes
+of the outputs and are slow to parse, so tools that only need the structure of the data
+can read the much smaller JSON file on its own.  :func:`load_json` reads the JSON file
+and memory-maps the arrays it refers to from the sidecar.
+"""
+
+JSON_BACKENDS = ("pydantic", "orjson", "json")
+INDENT = 4
+# the kinds of arrays written to a sidecar: bool, int, uint, float and complex
+SIDECAR_KINDS = "biufc"
+STREAM_BUFFER_SIZE = 1024 * 1024
+
+
+def _default(obj: Any) -> Any:
+    """Convert the values the JSON encoders can't handle themselves"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, Path):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class ArraySidecar(object):
+    """Collects the arrays written to a NumPy sidecar file in place of JSON lists
+
+    Arrays with the same dtype and shape are stacked into a single array in the
+    sidecar, so the transformation matrices of all the frames in a movie set are one
+    Nx4x4 array.  In the JSON each array is replaced by a reference to its place in
+    a stack, EG: {"$array": "float64_4x4", "index": 12}.  An array object that is used
+    in many places, such as a transformation shared by all the frames of a movie, is
+    only stored once.
+
+    The sidecar is an uncompressed .npz file, so each stack can be memory-mapped by
+    :func:`read_sidecar`.
+    """
+
+    def __init__(self) -> None:
+        self._stacks: Dict[str, List[np.ndarray]] = {}
+        self._refs: Dict[int, Dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._refs)
+
+    def add(self, array: np.ndarray) -> Any:
+        """Add an array to the sidecar
+
+        Args:
+            array (np.ndarray): The array
+
+        Returns:
+            Any: The reference to write in place of the array, arrays that are not
+                numeric or are 0-dimensional are not added and are returned as lists
+        """
+        if array.ndim == 0 or array.dtype.kind not in SIDECAR_KINDS:
+            return array.tolist()
+        ref = self._refs.get(id(array))
+        if ref is None:
+            key = f"{array.dtype.name}_{'x'.join(str(x) for x in array.shape)}"
+            stack = self._stacks.setdefault(key, [])
+            ref = {"$array": key, "index": len(stack)}
+            # the stack keeps the array alive, so its id can't be reused
+            stack.append(array)
+            self._refs[id(array)] = ref
+        return ref
+
+    def default(self, obj: Any) -> Any:
+        """Encode the values the JSON encoders can't handle, adding arrays
+
+        Args:
+            obj (Any): The value
+
+        Returns:
+            Any: The value to encode in its place
+        """
+        if isinstance(obj, np.ndarray):
+            return self.add(obj)
+        return _default(obj)
+
+    def save(self, sidecar_file: Path) -> int:
+        """Write the arrays to a sidecar file
+
+        The file is written to a temporary file and then renamed, so readers that
+        have memory-mapped the old file are not affected
+
+        Args:
+            sidecar_file (Path): The file to write
+
+        Returns:
+            int: The size of the file in bytes
+        """
+        tmp = sidecar_file.with_name(sidecar_file.name + ".tmp")
+        # Any, as mypy checks the unpacked dict against savez's allow_pickle argument
+        stacks: Dict[str, Any] = {k: np.stack(x) for k, x in self._stacks.items()}
+        with open(tmp, "wb") as f:
+            np.savez(f, **stacks)
+        os.replace(tmp, sidecar_file)
+        return sidecar_file.stat().st_size
+
+
+def get_sidecar_path(json_file: Path) -> Path:
+    """Get the path of the array sidecar for a JSON file
+
+    Args:
+        json_file (Path): The JSON file
+
+    Returns:
+        Path: The sidecar, the JSON file's name with a .npz suffix
+    """
+    return json_file.with_suffix(".npz")
+
+
+def read_sidecar(sidecar_file: Path, mmap: bool = True) -> Dict[str, np.ndarray]:
+    """Read the arrays from a sidecar file
+
+    Args:
+        sidecar_file (Path): The sidecar file
+        mmap (bool): Memory-map the arrays rather than reading them, only the parts of
+            the arrays that are used are read from the file
+
+    Returns:
+        Dict[str, np.ndarray]: The stacked arrays {key: array}
+    """
+    arrays: Dict[str, np.ndarray] = {}
+    with zipfile.ZipFile(sidecar_file) as zf, open(sidecar_file, "rb") as f:
+        for info in zf.infolist():
+            key = info.filename[: -len(".npy")]
+            if not mmap or info.compress_type != zipfile.ZIP_STORED:
+                with zf.open(info) as member:
+                    arrays[key] = np.lib.format.read_array(member)
+                continue
+            # the array data follows the zip local header and the npy header
+            f.seek(info.header_offset)
+            name_length, extra_length = struct.unpack("<HH", f.read(30)[26:])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            if np.lib.format.read_magic(f) == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            if 0 in shape:
+                arrays[key] = np.empty(shape, dtype=dtype)
+                continue
+            arrays[key] = np.memmap(
+                sidecar_file,
+                dtype=dtype,
+                mode="r",
+                offset=f.tell(),
+                shape=shape,
+                order="F" if fortran else "C",
+            )
+    return arrays
+
+
+def load_json(json_file: Path, mmap: bool = True) -> Any:
+    """Read a JSON file, with the arrays from its sidecar file if it has one
+
+    The result can be validated by the model that was written, EG:
+    MovieStackSet.model_validate(load_json(json_file))
+
+    Args:
+        json_file (Path): The JSON file
+        mmap (bool): Memory-map the arrays in the sidecar rather than reading them
+
+    Returns:
+        Any: The data, with each reference to an array in the sidecar replaced by the
+            array
+    """
+    sidecar_file = get_sidecar_path(json_file)
+    object_hook = None
+    if sidecar_file.exists():
+        arrays = read_sidecar(sidecar_file, mmap)
+
+        def object_hook(obj: Dict[str, Any]) -> Any:
+            if "$array" in obj:
+                return arrays[obj["$array"]][obj["index"]]
+            return obj
+
+    with open(json_file, "rb") as f:
+        return json.loads(f.read(), object_hook=object_hook)
+
+
+def dump_json(
+    data: Union[BaseModel, Any],
+    compact: bool = False,
+    backend: str = "pydantic",
+    sidecar: Optional[ArraySidecar] = None,
+) -> bytes:
+    """Encode a model, or data dumped from models, as JSON
+
+    Args:
+        data (Union[BaseModel, Any]): The model, or a dict or list such as the output
+            of :func:`~src.tomobabel.interning.dump_deduplicated`
+        compact (bool): Write the JSON without indentation or spaces
+        backend (str): Which encoder to use, one of :data:`JSON_BACKENDS`
+        sidecar (Optional[ArraySidecar]): If provided numeric arrays are added to it
+            and written as references to it
+
+    Returns:
+        bytes: The UTF-8 encoded JSON
+
+    Raises:
+        ValueError: If the backend is unknown
+        ImportError: If the orjson backend is used and orjson is not installed
+    """
+    indent = None if compact else INDENT
+    default = _default if sidecar is None else sidecar.default
+    if backend == "pydantic":
+        if isinstance(data, BaseModel):
+            context = None if sidecar is None else {ARRAY_SIDECAR: sidecar}
+            return data.model_dump_json(indent=indent, context=context).encode()
+        return to_json(data, indent=indent, inf_nan_mode="constants", fallback=default)
+
+    if isinstance(data, BaseModel):
+        data = data.model_dump()
+    if backend == "orjson":
+        if orjson is None:
+            raise ImportError(
+                "The orjson JSON backend needs orjson, install it with"
+                " pip install orjson"
+            )
+        option = 0 if sidecar is not None else orjson.OPT_SERIALIZE_NUMPY
+        if not compact:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=default, option=option)
+    if backend == "json":
+        separators = (",", ":") if compact else None
+        if sidecar is not None:
+            return json.dumps(
+                data, indent=indent, separators=separators, default=default
+            ).encode()
+        return json.dumps(
+            data, indent=indent, separators=separators, cls=NumpyEncoder
+        ).encode()
+    raise ValueError(f"Unknown JSON backend {backend}, choose from {JSON_BACKENDS}")
+
+
+class JsonStreamWriter(object):
+    """Writes a model as JSON to a file a piece at a time
+
+    dump_json makes the whole of the JSON for a model in memory before it is written,
+    for a large DataSet this is as big as the output file.  This writes the fields of
+    the model one at a time, and the items of lists of models one at a time, down to
+    list_depth levels of lists.  Below that each model is written in one piece by
+    pydantic's serialiser, so the memory used depends on the size of the largest of
+    these pieces, EG: one movie stack, rather than the size of the output.
+
+    The output is the same as dump_json writes with the pydantic backend.  Models are
+    written with their own serialiser, as they are in fields declared SerializeAsAny,
+    which is the same as their parent's serialiser writes them for the CETS models.
+
+    Attributes:
+        outfile (BinaryIO): The file to write to, opened in binary mode
+        compact (bool): Write the JSON without indentation or spaces
+        sidecar (Optional[ArraySidecar]): If provided numeric arrays are added to it
+            and written as references to it
+        list_depth (int): The number of levels of lists of models to write item by
+            item, EG: 3 writes each region of a DataSet, each image set of a region
+            and each movie stack of an image set separately
+        bytes_written (int): The number of bytes written
+    """
+
+    def __init__(
+        self,
+        outfile: BinaryIO,
+        compact: bool = False,
+        sidecar: Optional[ArraySidecar] = None,
+        list_depth: int = 3,
+    ) -> None:
+        self.outfile = outfile
+        self.compact = compact
+        self.sidecar = sidecar
+        self.list_depth = list_depth
+        self.bytes_written = 0
+        self._indent = None if compact else INDENT
+        self._default = _default if sidecar is None else sidecar.default
+        self._context = None if sidecar is None else {ARRAY_SIDECAR: sidecar}
+
+    def _write(self, data: bytes) -> None:
+        self.outfile.write(data)
+        self.bytes_written += len(data)
+
+    def _write_indented(self, encoded: bytes, level: int) -> None:
+        # newlines can only be whitespace in JSON, those in strings are escaped
+        if self._indent and level:
+            encoded = encoded.replace(b"\n", b"\n" + b" " * (self._indent * level))
+        self._write(encoded)
+
+    def _separators(self, level: int) -> Tuple[bytes, bytes, bytes]:
+        """Get what goes before the first item, between items and after the last item
+        of an object or array"""
+        if self._indent is None:
+            return b"", b",", b""
+        pad = b"\n" + b" " * (self._indent * level)
+        inner = pad + b" " * self._indent
+        return inner, b"," + inner, pad
+
+    def write(self, model: BaseModel) -> int:
+        """Write a model
+
+        Args:
+            model (BaseModel): The model
+
+        Returns:
+            int: The number of bytes written
+        """
+        self._write_value(model, 0, self.list_depth)
+        return self.bytes_written
+
+    def _write_value(self, value: Any, level: int, list_depth: int) -> None:
+        if isinstance(value, BaseModel) and list_depth >= 0:
+            self._write_model(value, level, list_depth)
+        elif isinstance(value, BaseModel):
+            dumped = value.model_dump_json(indent=self._indent, context=self._context)
+            self._write_indented(dumped.encode(), level)
+        elif (
+            isinstance(value, list)
+            and value
+            and list_depth > 0
+            and all(isinstance(x, BaseModel) for x in value)
+        ):
+            first, between, last = self._separators(level)
+            self._write(b"[" + first)
+            for n, item in enumerate(value):
+                if n:
+                    self._write(between)
+                self._write_value(item, level + 1, list_depth - 1)
+            self._write(last + b"]")
+        else:
+            encoded = to_json(
+                value,
+                indent=self._indent,
+                inf_nan_mode="constants",
+                fallback=self._default,
+                context=self._context,
+            )
+            self._write_indented(encoded, level)
+
+    def _write_model(self, model: BaseModel, level: int, list_depth: int) -> None:
+        names = [x for x in type(model).model_fields if x in model.__dict__]
+        if not names:
+            self._write(b"{}")
+            return
+        first, between, last = self._separators(level)
+        colon = b":" if self._indent is None else b": "
+        self._write(b"{" + first)
+        for n, name in enumerate(names):
+            if n:
+                self._write(between)
+            self._write(to_json(name) + colon)
+            self._write_value(model.__dict__[name], level + 1, list_depth)
+        self._write(last + b"}")
+
+
+def write_json(
+    outfile: Path,
+    data: Union[BaseModel, Any],
+    compact: bool = False,
+    backend: str = "pydantic",
+    profiler: Optional[ConversionProfiler] = None,
+    array_sidecar: bool = False,
+    stream: bool = False,
+) -> int:
+    """Write a model, or data dumped from models, to a JSON file
+
+    The files are written to temporary files and then renamed, so a partly written
+    output is never seen
+
+    Args:
+        outfile (Path): The file to write
+        data (Union[BaseModel, Any]): The model or data to write
+        compact (bool): Write the JSON without indentation or spaces
+        backend (str): Which encoder to use, one of :data:`JSON_BACKENDS`
+        profiler (Optional[ConversionProfiler]): Records the time taken to encode and
+            write the JSON
+        array_sidecar (bool): Write the numeric arrays to a sidecar file next to the
+            JSON file, see :func:`get_sidecar_path`
+        stream (bool): Write a model a piece at a time with a
+            :class:`JsonStreamWriter` rather than encoding all of it first
+
+    Returns:
+        int: The number of bytes written
+
+    Raises:
+        ValueError: If stream is used with data that isn't a model or with a backend
+            other than pydantic
+    """
+    if profiler is None:
+        profiler = ConversionProfiler(enabled=False)
+    if stream and (backend != "pydantic" or not isinstance(data, BaseModel)):
+        raise ValueError("Only models can be streamed, with the pydantic backend")
+    sidecar = ArraySidecar() if array_sidecar else None
+    tmp = outfile.with_name(outfile.name + ".tmp")
+    if stream:
+        with profiler.stage("write_json"):
+            with open(tmp, "wb", buffering=STREAM_BUFFER_SIZE) as f:
+                n_bytes = JsonStreamWriter(f, compact, sidecar).write(data)
+    else:
+        with profiler.stage("serialize"):
+            encoded = dump_json(data, compact, backend, sidecar)
+        with profiler.stage("write_json"):
+            tmp.write_bytes(encoded)
+        n_bytes = len(encoded)
+    with profiler.stage("write_json"):
+        if sidecar is not None:
+            n_bytes += sidecar.save(get_sidecar_path(outfile))
+            profiler.count("sidecar_arrays", len(sidecar))
+        os.replace(tmp, outfile)
+    profiler.count("output_bytes_written", n_bytes)
+    return n_bytes
@@ -1,12 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from functools import partial
 from pathlib import Path
-from typing import Tuple, Optional, Dict
+from typing import Any, Callable, Tuple, Optional, Dict, List, Sequence, TypeVar
 
-import mrcfile
 import numpy as np
 import json
 
+from src.tomobabel.mrc_headers import (
+    MRC_HEADER_SIZE,
+    HeaderCache,
+    MrcHeader,
+    read_mrc_header,
+)
+from src.tomobabel.profiling import ConversionProfiler
+
 # from scipy.spatial.transform import Rotation
 
+T = TypeVar("T")
+R = TypeVar("R")
+
 
 class NumpyEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -15,19 +28,120 @@ class NumpyEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
-def clean_dict(input_dict) -> Dict[str, object]:
+# types that are the same after a JSON round trip
+_JSON_SCALARS = frozenset((str, int, float, bool, type(None)))
+
+
+def _clean_key(key: Any) -> str:
+    """Get the string a dict key becomes when it is written as JSON
+
+    Args:
+        key (Any): The key
+
+    Returns:
+        str: The key as a string, EG: 1 -> "1", None -> "null"
+
+    Raises:
+        TypeError: If the key can't be a JSON object key
+    """
+    if isinstance(key, Enum):
+        key = key.value
+    if isinstance(key, np.generic):
+        key = key.item()
+    if isinstance(key, str):
+        return str.__str__(key)
+    if not isinstance(key, (int, float, type(None))):
+        raise TypeError(f"Keys must be str, int, float, bool or None, not {key!r}")
+    return json.dumps(key)
+
+
+def _clean_value(obj: Any, in_place: bool) -> Any:
+    """Convert an object to the types it would have after a JSON round trip
+
+    Args:
+        obj (Any): The object
+        in_place (bool): Update dicts and lists rather than making new ones
+
+    Returns:
+        Any: The converted object
+
+    Raises:
+        TypeError: If the object can't be written as JSON
+    """
+    scalars = _JSON_SCALARS
+    cls = type(obj)
+    if cls in scalars:
+        return obj
+    # scalars are checked before calling _clean_value, as most values are scalars
+    if cls is dict:
+        for k in obj:
+            if type(k) is not str:
+                items = [
+                    (_clean_key(k), _clean_value(v, in_place)) for k, v in obj.items()
+                ]
+                if not in_place:
+                    return dict(items)
+                obj.clear()
+                obj.update(items)
+                return obj
+        if not in_place:
+            return {
+                k: v if type(v) in scalars else _clean_value(v, False)
+                for k, v in obj.items()
+            }
+        for k, v in obj.items():
+            if type(v) not in scalars:
+                obj[k] = _clean_value(v, True)
+        return obj
+    if cls is list and in_place:
+        for n, v in enumerate(obj):
+            if type(v) not in scalars:
+                obj[n] = _clean_value(v, True)
+        return obj
+    if cls is list or cls is tuple:
+        return [v if type(v) in scalars else _clean_value(v, in_place) for v in obj]
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind == "O":
+            return _clean_value(obj.tolist(), in_place)
+        return obj.tolist()
+    if isinstance(obj, Enum):
+        return _clean_value(obj.value, in_place)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    # subclasses of the JSON types
+    if isinstance(obj, str):
+        return str.__str__(obj)
+    if isinstance(obj, int):
+        return int.__int__(obj)
+    if isinstance(obj, float):
+        return float.__float__(obj)
+    if isinstance(obj, dict):
+        return _clean_value(dict(obj), in_place)
+    if isinstance(obj, (list, tuple)):
+        return _clean_value(list(obj), in_place)
+    raise TypeError(f"Object of type {cls.__name__} is not JSON serializable")
+
+
+def clean_dict(input_dict: Dict[Any, Any], in_place: bool = False) -> Dict[str, object]:
     """Converts any np.ndarrys in the dict to lists
 
+    The result is the same as writing the dict as JSON and reading it back, but the
+    dict is walked directly rather than making the JSON text.  Arrays become lists,
+    NumPy scalars and enums become their values, tuples become lists and keys become
+    strings.
+
     Args:
-        input_dict (Dict[str, object]): The dict to operate on
+        input_dict (Dict[Any, Any]): The dict to operate on
+        in_place (bool): Update the dict, and the dicts and lists in it, rather than
+            making a copy.  Tuples and arrays in it are replaced with new lists
 
     Returns:
         Dict[str, object]: The dict with all np.ndarrays in list form
 
+    Raises:
+        TypeError: If the dict contains objects that can't be written as JSON
     """
-    json_str = json.dumps(input_dict, cls=NumpyEncoder)
-    result_dict = json.loads(json_str)
-    return result_dict
+    return _clean_value(input_dict, in_place)
 
 
 # TODO: Make sure this is the correct way to go about this
@@ -118,22 +232,112 @@ def clean_dict(input_dict) -> Dict[str, object]:
 #     }
 
 
+def get_mrc_header(
+    mrc_file: Optional[Path],
+    header_cache: Optional[HeaderCache] = None,
+) -> Optional[MrcHeader]:
+    """Get the main header of an MRC file
+
+    Only the file header is read, see :func:`~tomobabel.mrc_headers.read_mrc_header`
+
+    Args:
+        mrc_file (Optional[Path]): The file to check
+        header_cache (Optional[HeaderCache]): If a header cache is provided the
+            header is taken from it when the file is unchanged since it was cached
+
+    Returns:
+        Optional[MrcHeader]: The header or None if the file was not found.
+    """
+    if mrc_file is None:
+        return None
+    try:
+        if header_cache is not None:
+            return header_cache.read_header(mrc_file)
+        return read_mrc_header(mrc_file)
+    except FileNotFoundError:
+        return None
+
+
 def get_mrc_dims(
     mrc_file: Optional[Path],
+    header_cache: Optional[HeaderCache] = None,
 ) -> Tuple[Optional[int], Optional[int], Optional[int]]:
     """Get the dimensions of an MRC file
 
+    Only the file header is read, see :func:`~tomobabel.mrc_headers.read_mrc_header`
+
     Args:
         mrc_file (Optional[Path]): The file to check
+        header_cache (Optional[HeaderCache]): If a header cache is provided the
+            dimensions are taken from it when the file is unchanged since it was
+            cached
 
     Returns:
          Tuple[Optional[int], Optional[int], Optional[int]]: The dimensions in pixels
             or (None, None, None) if the file was not found.
     """
-    if mrc_file is None:
-        return None, None, None
-    try:
-        with mrcfile.open(mrc_file, permissive=True) as mrc:
-            return mrc.header.nx, mrc.header.ny, mrc.header.nz
-    except FileNotFoundError:
-        return None, None, None
+    header = get_mrc_header(mrc_file, header_cache)
+    return (None, None, None) if header is None else header.dims
+
+
+def probe_mrc_headers(
+    mrc_files: Sequence[Optional[Path]],
+    header_cache: Optional[HeaderCache] = None,
+    max_workers: int = 8,
+    profiler: Optional[ConversionProfiler] = None,
+) -> List[Optional[MrcHeader]]:
+    """Get the headers of a batch of MRC files, reading them concurrently
+
+    On parallel filesystems the latency of opening each file is much greater than the
+    time to read the header, so the files are read by a pool of threads.  Only the
+    headers are read, so this is as fast for multi-GB tomograms as it is for movies.
+
+    Args:
+        mrc_files (Sequence[Optional[Path]]): The files
+        header_cache (Optional[HeaderCache]): Headers are taken from the cache for
+            files that are unchanged since they were cached
+        max_workers (int): The maximum number of threads
+        profiler (Optional[ConversionProfiler]): Records the time taken as the
+            "probe_headers" stage, and the number of headers and bytes read
+
+    Returns:
+        List[Optional[MrcHeader]]: The header of each file, in the same order as
+            mrc_files, None for files that were not found
+    """
+    profiler = ConversionProfiler(enabled=False) if profiler is None else profiler
+    misses = 0 if header_cache is None else header_cache.misses
+    probe = partial(get_mrc_header, header_cache=header_cache)
+    with profiler.stage("probe_headers"):
+        headers = map_concurrently(probe, mrc_files, max_workers)
+    if profiler.enabled:
+        if header_cache is None:
+            n_read = sum(x is not None for x in headers)
+        else:
+            n_read = header_cache.misses - misses
+        profiler.count("headers_probed", len(headers))
+        profiler.count("header_reads", n_read)
+        profiler.count("header_bytes_read", n_read * MRC_HEADER_SIZE)
+    return headers
+
+
+def map_concurrently(
+    func: Callable[[T], R], items: Sequence[T], max_workers: int
+) -> List[R]:
+    """Apply a function to a set of items using a bounded pool of threads
+
+    Intended for I/O bound work like reading file headers. The results are in the same
+    order as the items, regardless of the order they are completed in.
+
+    Args:
+        func (Callable[[T], R]): The function to apply
+        items (Sequence[T]): The items to apply it to
+        max_workers (int): The maximum number of threads, if < 2 the items are
+            processed serially in the calling thread
+
+    Returns:
+        List[R]: The result for each item
+    """
+    if max_workers < 2 or len(items) < 2:
+        return [func(x) for x in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(func, items))
@@ -4,8 +4,24 @@ from pathlib import Path
 import unittest
 import tempfile
 
+import mrcfile
+import numpy as np
+from gemmi import cif
+
+from src.tomobabel.mrc_headers import MrcHeader
 from tests.converters.relion import test_data
 
+# Header returned for the image files in the test project, which don't exist
+STUB_MRC_HEADER = MrcHeader(
+    nx=2000,
+    ny=2000,
+    nz=1,
+    mode=2,
+    voxel_size=(1.0, 1.0, 1.0),
+    origin=(0.0, 0.0, 0.0),
+    extended_header_size=0,
+)
+
 
 class TomoBabelRelionTest(unittest.TestCase):
     def setUp(self):
@@ -41,3 +57,22 @@ class TomoBabelRelionTest(unittest.TestCase):
                     shutil.copytree(f, jobdir / f.name)
                 else:
                     shutil.copy(f, jobdir)
+
+    @staticmethod
+    def make_stub_movies(tilt_series_starfile: str, shape=(8, 20, 30)) -> None:
+        """Write small MRC files for every movie in a set of tilt series
+
+        Args:
+            tilt_series_starfile (str): The TiltSeriesGroupMetadata starfile
+            shape (tuple): The (z, y, x) shape of the movies
+        """
+        glob_block = cif.read_file(tilt_series_starfile).find_block("global")
+        for ts_name, ts_file in glob_block.find(
+            "_rln", ["TomoName", "TomoTiltSeriesStarFile"]
+        ):
+            block = cif.read_file(ts_file).find_block(ts_name)
+            for row in block.find("_rln", ["MicrographMovieName"]):
+                movie = Path(row[0])
+                movie.parent.mkdir(parents=True, exist_ok=True)
+                with mrcfile.new(movie, overwrite=True) as mrc:
+                    mrc.set_data(np.zeros(shape, dtype=np.int8))
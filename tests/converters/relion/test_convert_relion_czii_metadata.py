@@ -3,14 +3,17 @@ import unittest
 from unittest.mock import patch
 from deepdiff import DeepDiff
 from src.tomobabel.converters.relion import relion_converter
-from tests.converters.relion.relion_testing_utils import TomoBabelRelionTest
+from tests.converters.relion.relion_testing_utils import (
+    STUB_MRC_HEADER,
+    TomoBabelRelionTest,
+)
 
 
 class CziiConverterTest(TomoBabelRelionTest):
     # ToDo: Update this test when the other datatypes are added
-    @patch("src.tomobabel.converters.relion.relion_convert_tilt_series.get_mrc_dims")
+    @patch("src.tomobabel.utils.get_mrc_header")
     def test_main_with_ctf_data(self, mockdims):
-        mockdims.return_value = 2000, 2000
+        mockdims.return_value = STUB_MRC_HEADER
         self.setup_tomo_dirs()
         dataset = relion_converter.main(
             [
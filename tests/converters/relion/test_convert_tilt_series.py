@@ -1,5 +1,7 @@
 import json
 import unittest
+
+import mrcfile
 from deepdiff import DeepDiff
 from pathlib import Path, PosixPath
 from unittest.mock import patch
@@ -10,20 +12,35 @@ from gemmi import cif
 from src.tomobabel.converters.relion.relion_convert_tilt_series import (
     RelionTiltSeriesMovie,
     PipelinerTiltSeriesGroupConverter,
+    TiltSeriesConversionError,
     main as tilt_series_main,
 )
 from src.tomobabel.models.tomo_images import (
+    CompactMovieStack,
     MovieStack,
     CTFMetadata,
     MovieFrame,
     GainFile,
     DefectFile,
     TiltSeriesMicrographAlignment,
+    MovieStackSet,
+    TiltSeriesMicrographStack,
 )
 from src.tomobabel.models.transformations import Transformation
-from src.tomobabel.models.basemodels import Annotation
-from tests.converters.relion.relion_testing_utils import TomoBabelRelionTest
-from src.tomobabel.utils import clean_dict
+from src.tomobabel.models.basemodels import Annotation, ValidationLevel
+from src.tomobabel.converters.relion.relion_manifest import ConversionManifest
+from src.tomobabel.converters.relion.relion_starfiles import (
+    StarFileCache,
+    TiltSeriesTable,
+)
+from src.tomobabel.interning import ModelInterner, load_deduplicated
+from src.tomobabel.mrc_headers import HeaderCache
+from src.tomobabel.serialization import dump_json, load_json
+from tests.converters.relion.relion_testing_utils import (
+    STUB_MRC_HEADER,
+    TomoBabelRelionTest,
+)
+from src.tomobabel.utils import NumpyEncoder, clean_dict, probe_mrc_headers
 
 
 class CziiTiltSeriesConverterTest(TomoBabelRelionTest):
@@ -55,7 +72,11 @@ class CziiTiltSeriesConverterTest(TomoBabelRelionTest):
         converter = PipelinerTiltSeriesGroupConverter(
             input_file=Path("Import/job001/tilt_series.star")
         )
-        assert converter.__dict__ == {
+        attrs = dict(converter.__dict__)
+        assert isinstance(attrs.pop("star_cache"), StarFileCache)
+        assert isinstance(attrs.pop("interner"), ModelInterner)
+        assert not attrs.pop("profiler").enabled
+        assert attrs == {
             "input_file": PosixPath("Import/job001/tilt_series.star"),
             "all_movie_sets": {},
             "all_tilt_series": {},
@@ -63,6 +84,12 @@ class CziiTiltSeriesConverterTest(TomoBabelRelionTest):
             "defect_file": None,
             "gain_file": None,
             "motion_correction_job": None,
+            "header_cache": None,
+            "probe_workers": 8,
+            "jobs": 1,
+            "conversion_errors": {},
+            "compact_movies": False,
+            "validation": ValidationLevel.full,
         }
 
     def test_converter_get_tilt_series_dict(self):
@@ -79,10 +106,10 @@ class CziiTiltSeriesConverterTest(TomoBabelRelionTest):
             "TS_54": "Import/job001/tilt_series/TS_54.star",
         }
 
-    @patch("src.tomobabel.converters.relion.relion_convert_tilt_series.get_mrc_dims")
+    @patch("src.tomobabel.utils.get_mrc_header")
     def test_converter_get_movies_data(self, mockmrc):
         """Gets the move object for each movie, without frame data"""
-        mockmrc.return_value = 2000, 2000
+        mockmrc.return_value = STUB_MRC_HEADER
         self.setup_tomo_dirs()
         converter = PipelinerTiltSeriesGroupConverter(
             input_file=Path("Import/job001/tilt_series.star")
@@ -143,6 +170,30 @@ class CziiTiltSeriesConverterTest(TomoBabelRelionTest):
         assert transdata.y_tilt == -57.0
         assert transdata.z_rot == 85.032958
 
+    def test_transformation_data_uses_relion_labels(self):
+        """The columns are requested with the exact RELION labels, EG: TomoYTilt,
+        not TomoyTilt, so reading them doesn't rely on the case-insensitive lookup"""
+        self.setup_tomo_dirs()
+        ts = cif.read_file("AlignTiltSeries/job005/tilt_series/TS_01.star")
+        table = TiltSeriesTable.from_block(ts.find_block("TS_01"))
+        converter = PipelinerTiltSeriesGroupConverter(
+            input_file=Path("CtfFind/job003/corrected_tilt_series.star")
+        )
+        requested = []
+        getitem = TiltSeriesTable.__getitem__
+
+        def record_label(tbl, label):
+            requested.append(label)
+            return getitem(tbl, label)
+
+        with patch.object(TiltSeriesTable, "__getitem__", record_label):
+            transdata = converter.get_alignment_transformation_data(
+                data_block=table, index=0, apix=0.675
+            )
+        assert transdata.y_tilt == -57.0
+        assert "TomoYTilt" in requested
+        assert all(x in table.columns for x in requested)
+
     @patch("src.tomobabel.converters.relion.relion_convert_tilt_series.get_mrc_dims")
     def test_converter_get_gain_and_defect_files(self, mockdims):
         self.setup_tomo_dirs()
@@ -419,9 +470,9 @@ class CziiTiltSeriesConverterTest(TomoBabelRelionTest):
                 expected[n].motion_correction_transformations[0].trans_matrix,
             )
 
-    @patch("src.tomobabel.converters.relion.relion_convert_tilt_series.get_mrc_dims")
+    @patch("src.tomobabel.utils.get_mrc_header")
     def test_converter_do_conversion_import_job(self, mockmrc):
-        mockmrc.return_value = 2000, 2000
+        mockmrc.return_value = STUB_MRC_HEADER
         self.setup_tomo_dirs()
         converter = PipelinerTiltSeriesGroupConverter(
             input_file=Path("Import/job001/tilt_series.star")
@@ -442,9 +493,9 @@ class CziiTiltSeriesConverterTest(TomoBabelRelionTest):
             ats_actual = json.load(ats)
         assert not DeepDiff(clean_dict(ats_dict), ats_actual, ignore_order=True)
 
-    @patch("src.tomobabel.converters.relion.relion_convert_tilt_series.get_mrc_dims")
+    @patch("src.tomobabel.utils.get_mrc_header")
     def test_converter_do_conversion_with_CTF_job(self, mockmrc):
-        mockmrc.return_value = 2000, 2000
+        mockmrc.return_value = STUB_MRC_HEADER
         self.setup_tomo_dirs()
         converter = PipelinerTiltSeriesGroupConverter(
             input_file=Path("CtfFind/job003/tilt_series_ctf.star")
@@ -466,10 +517,10 @@ class CziiTiltSeriesConverterTest(TomoBabelRelionTest):
             ats_actual = json.load(ats)
         assert not DeepDiff(clean_dict(ats_dict), ats_actual, ignore_order=True)
 
-    @patch("src.tomobabel.converters.relion.relion_convert_tilt_series.get_mrc_dims")
+    @patch("src.tomobabel.utils.get_mrc_header")
     def test_converter_do_conversion_with_CTF_job_with_gain_and_defect(self, mockmrc):
         """Output should contain gain ref and defect file info, when provided"""
-        mockmrc.return_value = 2000, 2000
+        mockmrc.return_value = STUB_MRC_HEADER
         self.setup_tomo_dirs()
         converter = PipelinerTiltSeriesGroupConverter(
             input_file=Path("CtfFind/job003/tilt_series_ctf.star"),
@@ -493,10 +544,10 @@ class CziiTiltSeriesConverterTest(TomoBabelRelionTest):
             ats_actual = json.load(ats)
         assert not DeepDiff(clean_dict(ats_dict), ats_actual, ignore_order=True)
 
-    @patch("src.tomobabel.converters.relion.relion_convert_tilt_series.get_mrc_dims")
+    @patch("src.tomobabel.utils.get_mrc_header")
     def test_converter_do_conversion_with_MotionCorr_job(self, mockmrc):
         """This one will have gain ref a defect file info"""
-        mockmrc.return_value = 2000, 2000
+        mockmrc.return_value = STUB_MRC_HEADER
         self.setup_tomo_dirs()
         converter = PipelinerTiltSeriesGroupConverter(
             input_file=Path("MotionCorr/job002/corrected_tilt_series.star")
@@ -518,9 +569,9 @@ class CziiTiltSeriesConverterTest(TomoBabelRelionTest):
             ats_actual = json.load(ats)
         assert not DeepDiff(clean_dict(ats_dict), ats_actual, ignore_order=True)
 
-    @patch("src.tomobabel.converters.relion.relion_convert_tilt_series.get_mrc_dims")
+    @patch("src.tomobabel.utils.get_mrc_header")
     def test_converter_do_conversion_align_job(self, mockmrc):
-        mockmrc.return_value = 2000, 2000
+        mockmrc.return_value = STUB_MRC_HEADER
         self.setup_tomo_dirs()
         converter = PipelinerTiltSeriesGroupConverter(
             input_file=Path("AlignTiltSeries/job005/aligned_tilt_series.star")
@@ -542,9 +593,9 @@ class CziiTiltSeriesConverterTest(TomoBabelRelionTest):
             ats_actual = json.load(ats)
         assert not DeepDiff(clean_dict(ats_dict), ats_actual, ignore_order=True)
 
-    @patch("src.tomobabel.converters.relion.relion_convert_tilt_series.get_mrc_dims")
+    @patch("src.tomobabel.utils.get_mrc_header")
     def test_main_with_outputs_dir(self, mockdims):
-        mockdims.return_value = 2000, 2000
+        mockdims.return_value = STUB_MRC_HEADER
         self.setup_tomo_dirs()
         tilt_series_main(
             in_args=[
@@ -587,6 +638,548 @@ class CziiTiltSeriesConverterTest(TomoBabelRelionTest):
             expected = json.load(exp)
         assert wrote_data == expected
 
+    def test_conversion_with_header_cache_rerun_reads_no_images(self):
+        self.setup_tomo_dirs()
+        self.make_stub_movies("Import/job001/tilt_series.star")
+        with HeaderCache(path="headers.sqlite") as cache:
+            converter = PipelinerTiltSeriesGroupConverter(
+                input_file=Path("Import/job001/tilt_series.star"), header_cache=cache
+            )
+            converter.do_conversion()
+            assert cache.misses == 205
+        first = converter.all_movie_sets["TS_01"].movie_stacks[0].frame_images[0]
+        assert (first.width, first.height) == (30, 20)
+
+        with patch("src.tomobabel.mrc_headers.read_mrc_header") as mock_read:
+            with HeaderCache(path="headers.sqlite") as cache:
+                converter = PipelinerTiltSeriesGroupConverter(
+                    input_file=Path("Import/job001/tilt_series.star"),
+                    header_cache=cache,
+                )
+                converter.do_conversion()
+                assert (cache.hits, cache.misses) == (205, 0)
+        mock_read.assert_not_called()
+        rerun = converter.all_movie_sets["TS_01"].movie_stacks[0].frame_images[0]
+        assert (rerun.width, rerun.height) == (30, 20)
+
+    def test_probe_movie_dims_keeps_order(self):
+        movies = []
+        for n in range(20):
+            movie = Path(f"frames/movie_{n:02d}.mrc")
+            movie.parent.mkdir(exist_ok=True)
+            with mrcfile.new(movie) as mrc:
+                mrc.set_data(np.zeros((n + 1, 4, 10 + n), dtype=np.int8))
+            movies.append(str(movie))
+        movies.append("frames/missing.mrc")
+        converter = PipelinerTiltSeriesGroupConverter(
+            input_file=Path("Import/job001/tilt_series.star"), probe_workers=4
+        )
+        expected = [(10 + n, 4, n + 1) for n in range(20)] + [(None, None, None)]
+        assert converter.probe_movie_dims(movies) == expected
+        converter.probe_workers = 1
+        assert converter.probe_movie_dims(movies) == expected
+
+    def test_get_movies_data_probes_before_making_movies(self):
+        self.setup_tomo_dirs()
+        self.make_stub_movies("Import/job001/tilt_series.star")
+        converter = PipelinerTiltSeriesGroupConverter(
+            input_file=Path("Import/job001/tilt_series.star"), probe_workers=4
+        )
+        block = cif.read_file("Import/job001/tilt_series/TS_01.star").find_block(
+            "TS_01"
+        )
+        with patch(
+            "src.tomobabel.converters.relion.relion_convert_tilt_series."
+            "probe_mrc_headers",
+            wraps=probe_mrc_headers,
+        ) as probe:
+            movies = converter.get_movies_data(block)
+        assert probe.call_count == 1
+        assert len(probe.call_args.args[0]) == 41
+        assert probe.call_args.kwargs["max_workers"] == 4
+        assert [x.stack_file_path for x in movies] == [
+            x[0] for x in block.find("_rln", ["MicrographMovieName"])
+        ]
+        assert all((x.width, x.height) == (30, 20) for x in movies)
+
+    @patch("src.tomobabel.utils.get_mrc_header")
+    def test_do_conversion_parses_each_starfile_once(self, mockmrc):
+        mockmrc.return_value = STUB_MRC_HEADER
+        self.setup_tomo_dirs()
+        converter = PipelinerTiltSeriesGroupConverter(
+            input_file=Path("MotionCorr/job002/corrected_tilt_series.star")
+        )
+        converter.do_conversion()
+        cache = converter.star_cache
+        assert cache.parse_count("MotionCorr/job002/corrected_tilt_series.star") == 1
+        assert cache.parse_count("MotionCorr/job002/job.star") == 1
+        for ts_file in converter.ts_files.values():
+            assert cache.parse_count(ts_file) == 1
+        assert cache.n_parses == 7
+
+    @patch("src.tomobabel.utils.get_mrc_header")
+    def test_star_cache_shared_between_converters(self, mockmrc):
+        mockmrc.return_value = STUB_MRC_HEADER
+        self.setup_tomo_dirs()
+        cache = StarFileCache()
+        for ts in ("TS_01", "TS_03"):
+            converter = PipelinerTiltSeriesGroupConverter(
+                input_file=Path("CtfFind/job003/tilt_series_ctf.star"),
+                star_cache=cache,
+            )
+            converter.do_conversion(tilt_series_names=[ts])
+        assert cache.parse_count("CtfFind/job003/tilt_series_ctf.star") == 1
+        assert cache.n_parses == 4
+
+    def test_converter_get_ctf_and_transformation_data_from_table(self):
+        self.setup_tomo_dirs()
+        ts = cif.read_file("AlignTiltSeries/job005/tilt_series/TS_01.star")
+        block = ts.find_block("TS_01")
+        table = TiltSeriesTable.from_block(block)
+        converter = PipelinerTiltSeriesGroupConverter(
+            input_file=Path("AlignTiltSeries/job005/aligned_tilt_series.star")
+        )
+        for index in (0, 20, 39):
+            assert converter.get_ctf_data(table, index) == converter.get_ctf_data(
+                block, index
+            )
+            from_table = converter.get_alignment_transformation_data(
+                table, index, 0.675
+            )
+            from_block = converter.get_alignment_transformation_data(
+                block, index, 0.675
+            )
+            assert from_table.z_rot == from_block.z_rot
+            assert np.allclose(
+                from_table.translation.trans_matrix,
+                from_block.translation.trans_matrix,
+            )
+
+    def test_parallel_conversion_matches_serial(self):
+        self.setup_tomo_dirs()
+        self.make_stub_movies("CtfFind/job003/tilt_series_ctf.star")
+        results = []
+        for jobs in (1, 3):
+            converter = PipelinerTiltSeriesGroupConverter(
+                input_file=Path("CtfFind/job003/tilt_series_ctf.star"),
+                gain_file="my_gain_file.mrc",
+                jobs=jobs,
+            )
+            converter.do_conversion()
+            assert not converter.conversion_errors
+            results.append(converter)
+        serial, parallel = results
+        assert list(parallel.all_movie_sets) == list(serial.all_movie_sets)
+        assert list(parallel.all_tilt_series) == list(serial.all_tilt_series)
+        for ts in serial.all_movie_sets:
+            assert not DeepDiff(
+                clean_dict(serial.all_movie_sets[ts].model_dump()),
+                clean_dict(parallel.all_movie_sets[ts].model_dump()),
+            )
+            assert not DeepDiff(
+                clean_dict(serial.all_tilt_series[ts].model_dump()),
+                clean_dict(parallel.all_tilt_series[ts].model_dump()),
+            )
+
+    def test_parallel_conversion_reports_errors_per_tilt_series(self):
+        self.setup_tomo_dirs()
+        self.make_stub_movies("Import/job001/tilt_series.star")
+        Path("Import/job001/tilt_series/TS_43.star").unlink()
+        converter = PipelinerTiltSeriesGroupConverter(
+            input_file=Path("Import/job001/tilt_series.star"), jobs=2
+        )
+        converter.do_conversion()
+        assert list(converter.all_movie_sets) == ["TS_01", "TS_03", "TS_45", "TS_54"]
+        assert list(converter.conversion_errors) == ["TS_43"]
+        assert converter.conversion_errors["TS_43"].startswith("FileNotFoundError")
+
+    def test_main_with_jobs(self):
+        self.setup_tomo_dirs()
+        self.make_stub_movies("CtfFind/job003/tilt_series_ctf.star")
+        converter = tilt_series_main(
+            in_args=[
+                "--input_starfile",
+                "CtfFind/job003/tilt_series_ctf.star",
+                "--output",
+                "outdir/",
+                "--jobs",
+                "2",
+            ]
+        )
+        assert converter.jobs == 2
+        assert len(list(Path("outdir").glob("*.json"))) == 10
+
+    def test_main_with_jobs_reports_failed_tilt_series(self):
+        self.setup_tomo_dirs()
+        self.make_stub_movies("Import/job001/tilt_series.star")
+        Path("Import/job001/tilt_series/TS_43.star").unlink()
+        args = [
+            "--input_starfile",
+            "Import/job001/tilt_series.star",
+            "--output",
+            "outdir/",
+            "--jobs",
+            "2",
+        ]
+        logger = "src.tomobabel.converters.relion.relion_convert_tilt_series"
+        for extra in ([], ["--stream"]):
+            with self.subTest(extra=extra):
+                with self.assertLogs(logger, level="ERROR") as logs:
+                    with self.assertRaises(TiltSeriesConversionError) as raised:
+                        tilt_series_main(in_args=args + extra)
+                assert list(raised.exception.errors) == ["TS_43"]
+                assert "1 of 5 tilt series could not be converted" in logs.output[-2]
+                assert "TS_43: FileNotFoundError" in logs.output[-1]
+                # the tilt series that were converted are still written
+                assert len(list(Path("outdir").glob("*_movie_set.json"))) == 4
+
+    @patch("src.tomobabel.utils.get_mrc_header")
+    def test_iter_conversions_does_not_keep_results(self, mockmrc):
+        mockmrc.return_value = STUB_MRC_HEADER
+        self.setup_tomo_dirs()
+        converter = PipelinerTiltSeriesGroupConverter(
+            input_file=Path("CtfFind/job003/tilt_series_ctf.star")
+        )
+        names = []
+        for ts_name, movie_set, tilt_series in converter.iter_conversions():
+            names.append(ts_name)
+            assert isinstance(movie_set, MovieStackSet)
+            assert isinstance(tilt_series, TiltSeriesMicrographStack)
+            assert converter.all_movie_sets == {}
+            assert converter.all_tilt_series == {}
+        assert names == ["TS_01", "TS_03", "TS_43", "TS_45", "TS_54"]
+
+    def test_iter_conversions_parallel_keeps_order(self):
+        self.setup_tomo_dirs()
+        self.make_stub_movies("Import/job001/tilt_series.star")
+        converter = PipelinerTiltSeriesGroupConverter(
+            input_file=Path("Import/job001/tilt_series.star"), jobs=2
+        )
+        names = [x[0] for x in converter.iter_conversions()]
+        assert names == ["TS_01", "TS_03", "TS_43", "TS_45", "TS_54"]
+
+    def test_main_stream_writes_same_files(self):
+        self.setup_tomo_dirs()
+        self.make_stub_movies("CtfFind/job003/tilt_series_ctf.star")
+        args = ["--input_starfile", "CtfFind/job003/tilt_series_ctf.star"]
+        tilt_series_main(in_args=args + ["--output", "stored/"])
+        converter = tilt_series_main(
+            in_args=args + ["--output", "streamed/", "--stream"]
+        )
+        assert converter.all_movie_sets == {}
+        stored = sorted(x.name for x in Path("stored").glob("*.json"))
+        assert stored == sorted(x.name for x in Path("streamed").glob("*.json"))
+        assert len(stored) == 10
+        for f in stored:
+            with open(Path("stored") / f) as a, open(Path("streamed") / f) as b:
+                assert json.load(a) == json.load(b)
+
+    def test_main_stream_needs_output(self):
+        self.setup_tomo_dirs()
+        with self.assertRaises(ValueError):
+            tilt_series_main(
+                in_args=[
+                    "--input_starfile",
+                    "CtfFind/job003/tilt_series_ctf.star",
+                    "--stream",
+                ]
+            )
+
+    def test_incremental_conversion_skips_unchanged(self):
+        self.setup_tomo_dirs()
+        self.make_stub_movies("CtfFind/job003/tilt_series_ctf.star")
+        args = [
+            "--input_starfile",
+            "CtfFind/job003/tilt_series_ctf.star",
+            "--output",
+            "outdir/",
+            "--incremental",
+        ]
+        converter = tilt_series_main(in_args=args)
+        assert len(converter.all_tilt_series) == 5
+        assert Path("outdir/conversion_manifest.json").is_file()
+        assert len(list(Path("outdir").glob("*_tilt_series.json"))) == 5
+
+        # nothing has changed so nothing is converted
+        converter = tilt_series_main(in_args=args)
+        assert converter.all_tilt_series == {}
+
+        # a changed tilt series star file and a deleted output
+        ts_file = Path("CtfFind/job003/tilt_series/TS_03.star")
+        ts_file.write_text(ts_file.read_text().replace("15032.874023", "15032.9", 1))
+        Path("outdir/TS_45_movie_set.json").unlink()
+        converter = tilt_series_main(in_args=args)
+        assert sorted(converter.all_tilt_series) == ["TS_03", "TS_45"]
+        assert Path("outdir/TS_45_movie_set.json").is_file()
+
+    def test_incremental_conversion_rebuilds_when_settings_change(self):
+        self.setup_tomo_dirs()
+        self.make_stub_movies("CtfFind/job003/tilt_series_ctf.star")
+        args = [
+            "--input_starfile",
+            "CtfFind/job003/tilt_series_ctf.star",
+            "--output",
+            "outdir/",
+            "--incremental",
+        ]
+        tilt_series_main(in_args=args)
+        plain = Path("outdir/TS_01_movie_set.json").read_text()
+        assert "$defs" not in plain
+
+        # the inputs are the same but the outputs must be written deduplicated
+        converter = tilt_series_main(in_args=args + ["--deduplicate"])
+        assert len(converter.all_tilt_series) == 5
+        assert "$defs" in Path("outdir/TS_01_movie_set.json").read_text()
+        converter = tilt_series_main(in_args=args + ["--deduplicate"])
+        assert converter.all_tilt_series == {}
+
+        # and switching it off again rewrites them without
+        converter = tilt_series_main(in_args=args)
+        assert len(converter.all_tilt_series) == 5
+        assert Path("outdir/TS_01_movie_set.json").read_text() == plain
+
+    def test_incremental_conversion_keeps_manifest_after_failure(self):
+        self.setup_tomo_dirs()
+        self.make_stub_movies("CtfFind/job003/tilt_series_ctf.star")
+        args = [
+            "--input_starfile",
+            "CtfFind/job003/tilt_series_ctf.star",
+            "--output",
+            "outdir/",
+            "--incremental",
+            "--tilt_series",
+            "TS_01",
+            "TS_03",
+            "TS_43",
+        ]
+        convert = PipelinerTiltSeriesGroupConverter.convert_tilt_series
+
+        def fail_ts03(converter, ts_name, *args):
+            if ts_name == "TS_03":
+                raise RuntimeError("failed")
+            return convert(converter, ts_name, *args)
+
+        with patch.object(
+            PipelinerTiltSeriesGroupConverter, "convert_tilt_series", fail_ts03
+        ):
+            with self.assertRaisesRegex(RuntimeError, "failed"):
+                tilt_series_main(in_args=args)
+        with open("outdir/conversion_manifest.json") as f:
+            assert list(json.load(f)["tilt_series"]) == ["TS_01"]
+
+        # only the tilt series that weren't written are converted next time
+        converter = tilt_series_main(in_args=args)
+        assert sorted(converter.all_tilt_series) == ["TS_03", "TS_43"]
+
+    def test_incremental_conversion_needs_output(self):
+        self.setup_tomo_dirs()
+        with self.assertRaises(ValueError):
+            tilt_series_main(
+                in_args=[
+                    "--input_starfile",
+                    "CtfFind/job003/tilt_series_ctf.star",
+                    "--incremental",
+                ]
+            )
+
+    def test_fingerprint_changes_with_movie_headers(self):
+        self.setup_tomo_dirs()
+        self.make_stub_movies("CtfFind/job003/tilt_series_ctf.star")
+        converter = PipelinerTiltSeriesGroupConverter(
+            input_file=Path("CtfFind/job003/tilt_series_ctf.star")
+        )
+        converter.select_tilt_series(None)
+        first = converter.fingerprint_tilt_series(list(converter.ts_files))
+        assert first == converter.fingerprint_tilt_series(list(converter.ts_files))
+        assert len(set(first.values())) == 5
+        self.make_stub_movies("CtfFind/job003/tilt_series_ctf.star", shape=(9, 20, 30))
+        second = converter.fingerprint_tilt_series(list(converter.ts_files))
+        assert all(first[x] != second[x] for x in first)
+
+    def test_manifest_load_bad_files(self):
+        assert ConversionManifest.load(Path("missing.json")).entries == {}
+        Path("bad.json").write_text("{not json")
+        assert ConversionManifest.load(Path("bad.json")).entries == {}
+        Path("old.json").write_text(
+            json.dumps({"version": 0, "tilt_series": {"TS_01": {}}})
+        )
+        assert ConversionManifest.load(Path("old.json")).entries == {}
+
+    def test_manifest_round_trip(self):
+        Path("out.json").write_text("{}")
+        manifest = ConversionManifest(Path("manifest.json"))
+        manifest.update("TS_01", "abc", [Path("out.json")])
+        manifest.save()
+        loaded = ConversionManifest.load(Path("manifest.json"))
+        assert loaded.is_current("TS_01", "abc")
+        assert not loaded.is_current("TS_01", "def")
+        assert not loaded.is_current("TS_02", "abc")
+        Path("out.json").unlink()
+        assert not loaded.is_current("TS_01", "abc")
+
+    def test_manifest_settings(self):
+        Path("out.json").write_text("{}")
+        manifest = ConversionManifest(Path("manifest.json"), {"deduplicate": True})
+        manifest.update("TS_01", "abc", [Path("out.json")])
+        manifest.save()
+        same = ConversionManifest.load(Path("manifest.json"), {"deduplicate": True})
+        assert same.is_current("TS_01", "abc")
+        changed = ConversionManifest.load(Path("manifest.json"), {"deduplicate": False})
+        assert changed.entries == {}
+        assert changed.settings == {"deduplicate": False}
+
+    @patch("src.tomobabel.utils.get_mrc_header")
+    def test_frames_share_ctf_and_transformation(self, mockmrc):
+        mockmrc.return_value = STUB_MRC_HEADER
+        self.setup_tomo_dirs()
+        converter = PipelinerTiltSeriesGroupConverter(
+            input_file=Path("CtfFind/job003/tilt_series_ctf.star")
+        )
+        converter.do_conversion(["TS_01"])
+        stacks = converter.all_movie_sets["TS_01"].movie_stacks
+        frames = [x for stack in stacks for x in stack.frame_images]
+        assert len({id(x.motion_correction_transformations[0]) for x in frames}) == 1
+        for stack in stacks:
+            assert len({id(x.ctf_metadata) for x in stack.frame_images}) == 1
+
+    def test_main_deduplicate_writes_smaller_files(self):
+        self.setup_tomo_dirs()
+        self.make_stub_movies("CtfFind/job003/tilt_series_ctf.star")
+        args = ["--input_starfile", "CtfFind/job003/tilt_series_ctf.star"]
+        tilt_series_main(in_args=args + ["--output", "full/"])
+        tilt_series_main(in_args=args + ["--output", "dedup/", "--deduplicate"])
+        full = Path("full/TS_01_movie_set.json")
+        dedup = Path("dedup/TS_01_movie_set.json")
+        assert dedup.stat().st_size < full.stat().st_size / 2
+        with open(dedup) as f:
+            data = json.load(f)
+        frame = data["movie_stacks"][0]["frame_images"][0]
+        ref = frame["motion_correction_transformations"][0]["$ref"]
+        assert ref.startswith("#/$defs/Transformation_")
+        with open(full) as f:
+            full_frame = json.load(f)["movie_stacks"][0]["frame_images"][0]
+        xform = full_frame["motion_correction_transformations"][0]
+        assert data["$defs"][ref.split("/")[-1]] == xform
+        movie_set = load_deduplicated(data, MovieStackSet)
+        with open(full) as f:
+            assert json.loads(dump_json(movie_set)) == json.load(f)
+
+    def test_main_compact_json(self):
+        self.setup_tomo_dirs()
+        self.make_stub_movies("CtfFind/job003/tilt_series_ctf.star")
+        args = ["--input_starfile", "CtfFind/job003/tilt_series_ctf.star"]
+        tilt_series_main(in_args=args + ["--output", "full/"])
+        tilt_series_main(in_args=args + ["--output", "compact/", "--compact_json"])
+        full = Path("full/TS_01_movie_set.json")
+        compact = Path("compact/TS_01_movie_set.json")
+        assert compact.stat().st_size < full.stat().st_size / 2
+        assert b"\n" not in compact.read_bytes()
+        with open(full) as f, open(compact) as g:
+            assert json.load(f) == json.load(g)
+
+    def test_main_array_sidecar(self):
+        self.setup_tomo_dirs()
+        self.make_stub_movies("CtfFind/job003/tilt_series_ctf.star")
+        args = ["--input_starfile", "CtfFind/job003/tilt_series_ctf.star"]
+        tilt_series_main(in_args=args + ["--output", "full/"])
+        tilt_series_main(in_args=args + ["--output", "sidecar/", "--array_sidecar"])
+        full = Path("full/TS_01_movie_set.json")
+        with_sidecar = Path("sidecar/TS_01_movie_set.json")
+        assert Path("sidecar/TS_01_movie_set.npz").is_file()
+        assert with_sidecar.stat().st_size < full.stat().st_size
+        loaded = MovieStackSet.model_validate(load_json(with_sidecar))
+        with open(full) as f:
+            assert json.loads(dump_json(loaded)) == json.load(f)
+
+    @patch("src.tomobabel.utils.get_mrc_header")
+    def test_compact_movies_same_frames(self, mockmrc):
+        mockmrc.return_value = STUB_MRC_HEADER
+        self.setup_tomo_dirs()
+        infile = Path("CtfFind/job003/tilt_series_ctf.star")
+        full = PipelinerTiltSeriesGroupConverter(input_file=infile)
+        full.do_conversion(["TS_01"])
+        compact = PipelinerTiltSeriesGroupConverter(
+            input_file=infile, compact_movies=True
+        )
+        compact.do_conversion(["TS_01"])
+        full_stacks = full.all_movie_sets["TS_01"].movie_stacks
+        compact_stacks = compact.all_movie_sets["TS_01"].movie_stacks
+        assert all(isinstance(x, CompactMovieStack) for x in compact_stacks)
+        for full_stack, compact_stack in zip(full_stacks, compact_stacks):
+            expected = json.dumps(full_stack.model_dump(), cls=NumpyEncoder)
+            actual = compact_stack.to_movie_stack().model_dump()
+            assert json.dumps(actual, cls=NumpyEncoder) == expected
+        full_ts = full.all_tilt_series["TS_01"].model_dump()
+        compact_ts = compact.all_tilt_series["TS_01"].model_dump()
+        assert json.dumps(full_ts, cls=NumpyEncoder) == json.dumps(
+            compact_ts, cls=NumpyEncoder
+        )
+
+    @patch("src.tomobabel.utils.get_mrc_header")
+    def test_validation_levels_give_same_results(self, mockmrc):
+        mockmrc.return_value = STUB_MRC_HEADER
+        self.setup_tomo_dirs()
+        results = {}
+        for level in ValidationLevel:
+            for compact in (False, True):
+                converter = PipelinerTiltSeriesGroupConverter(
+                    input_file=Path("AlignTiltSeries/job005/aligned_tilt_series.star"),
+                    validation=level,
+                    compact_movies=compact,
+                )
+                converter.do_conversion(["TS_01", "TS_54"])
+                results[(level, compact)] = [
+                    json.dumps(x[ts].model_dump(), cls=NumpyEncoder)
+                    for x in (converter.all_movie_sets, converter.all_tilt_series)
+                    for ts in x
+                ]
+        for compact in (False, True):
+            expected = results[(ValidationLevel.full, compact)]
+            assert results[(ValidationLevel.construct, compact)] == expected
+            assert results[(ValidationLevel.final, compact)] == expected
+
+    def test_main_validation_level(self):
+        self.setup_tomo_dirs()
+        self.make_stub_movies("CtfFind/job003/tilt_series_ctf.star")
+        args = ["--input_starfile", "CtfFind/job003/tilt_series_ctf.star"]
+        tilt_series_main(in_args=args + ["--output", "full/"])
+        converter = tilt_series_main(
+            in_args=args + ["--output", "final/", "--validation", "final", "-j", "2"]
+        )
+        assert converter.validation == ValidationLevel.final
+        for f in Path("full").glob("*.json"):
+            assert f.read_text() == (Path("final") / f.name).read_text()
+
+    def test_main_profile(self):
+        self.setup_tomo_dirs()
+        self.make_stub_movies("CtfFind/job003/tilt_series_ctf.star")
+        args = ["--input_starfile", "CtfFind/job003/tilt_series_ctf.star"]
+        tilt_series_main(in_args=args + ["--output", "out/", "--profile", "p1.json"])
+        tilt_series_main(
+            in_args=args + ["--output", "out/", "--profile", "p2.json", "-j", "2"]
+        )
+        with open("p1.json") as f:
+            serial = json.load(f)
+        with open("p2.json") as f:
+            parallel = json.load(f)
+
+        for stage in ("read_star", "probe_headers", "build_models", "write_json"):
+            assert serial["stages"][stage]["calls"] > 0
+        assert serial["stages"]["convert_tilt_series"]["calls"] == 5
+        n_movies = sum(x["movies"] for x in serial["tilt_series"].values())
+        assert serial["counters"]["headers_probed"] == n_movies
+        assert serial["counters"]["header_bytes_read"] == n_movies * 1024
+        ts_01 = serial["tilt_series"]["TS_01"]
+        assert ts_01["frames"] == ts_01["movies"] * 8
+        assert ts_01["objects"]["MovieFrame"] == ts_01["frames"]
+        assert ts_01["objects"]["MovieStack"] == ts_01["movies"]
+
+        # the worker profiles are merged
+        assert parallel["stages"]["convert_tilt_series"]["calls"] == 5
+        assert parallel["counters"] == serial["counters"]
+        for ts_name, details in serial["tilt_series"].items():
+            assert parallel["tilt_series"][ts_name]["objects"] == details["objects"]
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,143 @@
+import json
+import os
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import mrcfile
+import numpy as np
+
+from src.tomobabel import mrc_headers
+from src.tomobabel.converters.relion.relion_batch import (
+    BatchConverter,
+    expand_input_files,
+    find_project_dir,
+    main as batch_main,
+)
+from src.tomobabel.converters.relion.relion_convert_tilt_series import (
+    main as tilt_series_main,
+)
+from tests.converters.relion.relion_testing_utils import TomoBabelRelionTest
+
+STARFILE = "CtfFind/job003/tilt_series_ctf.star"
+ALL_TS = ["TS_01", "TS_03", "TS_43", "TS_45", "TS_54"]
+
+
+class BatchConverterTest(TomoBabelRelionTest):
+    def setUp(self):
+        super().setUp()
+        for project in ("proj_a", "proj_b"):
+            Path(project).mkdir()
+            os.chdir(project)
+            self.setup_tomo_dirs()
+            self.make_stub_movies(STARFILE)
+            os.chdir(self.test_dir)
+
+    def get_expected_outputs(self, project: str) -> dict:
+        """Convert a project on its own and get the contents of the output files"""
+        os.chdir(project)
+        tilt_series_main(["--input_starfile", STARFILE, "--output", "single/"])
+        os.chdir(self.test_dir)
+        return {x.name: x.read_text() for x in Path(project, "single").glob("*.json")}
+
+    def test_find_project_dir(self):
+        starfile = Path("proj_a") / STARFILE
+        assert find_project_dir(starfile) == Path("proj_a").resolve()
+        Path("proj_a/CtfFind/default_pipeline.star").touch()
+        assert find_project_dir(starfile) == Path("proj_a/CtfFind").resolve()
+
+    def test_expand_input_files(self):
+        files = expand_input_files(
+            [f"proj_*/{STARFILE}", f"proj_a/{STARFILE}", "proj_b/Import/*/tilt_*.star"]
+        )
+        assert files == [
+            Path(f"proj_a/{STARFILE}").resolve(),
+            Path(f"proj_b/{STARFILE}").resolve(),
+            Path("proj_b/Import/job001/tilt_series.star").resolve(),
+        ]
+        with self.assertRaises(FileNotFoundError):
+            expand_input_files(["proj_c/*.star"])
+
+    def test_project_names_are_unique(self):
+        batch = BatchConverter(
+            [Path(f"proj_a/{STARFILE}"), Path("proj_a/Import/job001/tilt_series.star")],
+            Path("out"),
+        )
+        assert [x.name for x in batch.projects] == ["proj_a", "proj_a_2"]
+        assert batch.projects[1].input_file == Path("Import/job001/tilt_series.star")
+        assert batch.projects[1].output_dir == Path("out/proj_a_2").resolve()
+
+    def check_batch(self, jobs: int) -> None:
+        # proj_b is missing a tilt series file, proj_c has no global block
+        Path("proj_b/CtfFind/job003/tilt_series/TS_43.star").unlink()
+        Path("proj_c/CtfFind/job003").mkdir(parents=True)
+        Path(f"proj_c/{STARFILE}").write_text("data_other\n")
+        expected = self.get_expected_outputs("proj_a")
+
+        batch = batch_main(
+            [
+                "--input_starfiles",
+                f"proj_*/{STARFILE}",
+                "--output_dir",
+                "batch_out",
+                "-j",
+                str(jobs),
+            ]
+        )
+        assert Path.cwd() == self.test_dir
+        wrote = {x.name: x.read_text() for x in Path("batch_out/proj_a").glob("*")}
+        assert wrote == expected
+
+        with open("batch_out/batch_status.json") as f:
+            summary = json.load(f)
+        assert summary["counts"] == {
+            "pending": 0,
+            "running": 0,
+            "complete": 1,
+            "partial": 1,
+            "failed": 1,
+        }
+        status = summary["projects"]
+        assert status == batch.status
+        assert status["proj_a"]["status"] == "complete"
+        assert status["proj_a"]["converted"] == ALL_TS
+        assert status["proj_b"]["status"] == "partial"
+        assert status["proj_b"]["tilt_series"] == 5
+        assert list(status["proj_b"]["errors"]) == ["TS_43"]
+        assert len(list(Path("batch_out/proj_b").glob("*.json"))) == 8
+        assert status["proj_c"]["status"] == "failed"
+        assert list(status["proj_c"]["errors"]) == ["project"]
+
+    def test_batch_serial(self):
+        self.check_batch(jobs=1)
+
+    def test_batch_parallel(self):
+        self.check_batch(jobs=2)
+
+    def test_shared_gain_reference_read_once(self):
+        gain = Path("gain.mrc").resolve()
+        with mrcfile.new(gain) as mrc:
+            mrc.set_data(np.zeros((1, 20, 30), dtype=np.float32))
+        for project in ("proj_a", "proj_b"):
+            job_star = Path(project) / "MotionCorr/job002/job.star"
+            job_star.write_text(
+                job_star.read_text().replace('"my_gain_file.mrc"', str(gain))
+            )
+        with patch.object(
+            mrc_headers, "read_mrc_header", wraps=mrc_headers.read_mrc_header
+        ) as reader:
+            batch = BatchConverter(
+                [
+                    Path(f"{x}/MotionCorr/job002/corrected_tilt_series.star")
+                    for x in ("proj_a", "proj_b")
+                ],
+                Path("out"),
+            )
+            batch.run()
+        gain_reads = [x for x in reader.call_args_list if Path(x.args[0]) == gain]
+        assert len(gain_reads) == 1
+        assert batch.status["proj_b"]["status"] == "complete"
+
+
+if __name__ == "__main__":
+    unittest.main()
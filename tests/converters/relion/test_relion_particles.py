@@ -0,0 +1,165 @@
+import json
+import unittest
+from pathlib import Path
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from src.tomobabel.converters.relion.relion_converter import main as converter_main
+from src.tomobabel.converters.relion.relion_particles import RelionParticleConverter
+from src.tomobabel.models.annotation import (
+    CompactParticleCoordinatesSet,
+    ParticleCoordinatesSet,
+)
+from tests.converters.relion.relion_testing_utils import TomoBabelRelionTest
+
+RELION5_PARTICLES = """
+data_general
+
+_rlnTomoSubTomosAre2DStacks 1
+
+data_optics
+
+loop_
+_rlnOpticsGroup #1
+_rlnOpticsGroupName #2
+_rlnTomoTiltSeriesPixelSize #3
+1 optics1 2.0
+
+data_particles
+
+loop_
+_rlnTomoName #1
+_rlnCenteredCoordinateXAngst #2
+_rlnCenteredCoordinateYAngst #3
+_rlnCenteredCoordinateZAngst #4
+_rlnOriginXAngst #5
+_rlnOriginYAngst #6
+_rlnOriginZAngst #7
+_rlnTomoSubtomogramRot #8
+_rlnTomoSubtomogramTilt #9
+_rlnTomoSubtomogramPsi #10
+_rlnAngleRot #11
+_rlnAngleTilt #12
+_rlnAnglePsi #13
+_rlnAutopickFigureOfMerit #14
+_rlnOpticsGroup #15
+TS_03 10.0 20.0 30.0 1.0 2.0 3.0 0.0 90.0 0.0 90.0 0.0 0.0 0.5 1
+TS_01 -10.0 -20.0 -30.0 0.0 0.0 0.0 0.0 0.0 0.0 0.0 0.0 0.0 0.25 1
+TS_03 100.0 200.0 300.0 0.0 0.0 0.0 0.0 0.0 0.0 0.0 0.0 0.0 0.75 1
+TS_99 1.0 1.0 1.0 0.0 0.0 0.0 0.0 0.0 0.0 0.0 0.0 0.0 0.1 1
+"""
+
+RELION4_PARTICLES = """
+data_optics
+
+loop_
+_rlnOpticsGroup #1
+_rlnTomoTiltSeriesPixelSize #2
+1 2.0
+2 4.0
+
+data_particles
+
+loop_
+_rlnTomoName #1
+_rlnCoordinateX #2
+_rlnCoordinateY #3
+_rlnCoordinateZ #4
+_rlnOpticsGroup #5
+TS_01 50 60 70 1
+TS_03 50 60 70 2
+"""
+
+
+class RelionParticleConverterTest(TomoBabelRelionTest):
+    def write_particles(self, contents: str) -> Path:
+        star = Path("Extract/job006/particles.star")
+        star.parent.mkdir(parents=True)
+        star.write_text(contents)
+        return star
+
+    def test_centered_coordinates(self):
+        converter = RelionParticleConverter(self.write_particles(RELION5_PARTICLES))
+        converter.do_conversion()
+        sets = converter.particle_sets
+        assert list(sets) == ["TS_03", "TS_01", "TS_99"]
+        ts03 = sets["TS_03"]
+        assert isinstance(ts03, CompactParticleCoordinatesSet)
+        assert ts03.coords.tolist() == [[9.0, 18.0, 27.0], [100.0, 200.0, 300.0]]
+        assert ts03.foms.tolist() == [0.5, 0.75]
+        assert sets["TS_01"].coords.tolist() == [[-10.0, -20.0, -30.0]]
+
+    def test_subtomogram_and_particle_rotations_combined(self):
+        converter = RelionParticleConverter(self.write_particles(RELION5_PARTICLES))
+        converter.do_conversion()
+        rotations = converter.particle_sets["TS_03"].rotations
+        expected = (
+            Rotation.from_euler("ZYZ", [0, 90, 0], degrees=True)
+            * Rotation.from_euler("ZYZ", [90, 0, 0], degrees=True)
+        ).as_matrix()
+        assert np.allclose(rotations[0], expected)
+        assert np.allclose(rotations[1], np.identity(3))
+
+    def test_pixel_coordinates(self):
+        star = self.write_particles(RELION4_PARTICLES)
+        converter = RelionParticleConverter(
+            star, tomogram_sizes={"TS_03": (20, 20, 20)}, tomogram_size=(100, 100, 40)
+        )
+        converter.do_conversion()
+        assert converter.particle_sets["TS_01"].coords.tolist() == [[0.0, 20.0, 100.0]]
+        assert converter.particle_sets["TS_03"].coords.tolist() == [
+            [160.0, 200.0, 240.0]
+        ]
+        assert converter.particle_sets["TS_01"].rotations is None
+
+    def test_pixel_coordinates_need_tomogram_sizes(self):
+        star = self.write_particles(RELION4_PARTICLES)
+        converter = RelionParticleConverter(star, tomogram_sizes={"TS_01": (1, 1, 1)})
+        with self.assertRaisesRegex(ValueError, "TS_03"):
+            converter.do_conversion()
+
+    def test_particle_objects_and_selected_tomograms(self):
+        converter = RelionParticleConverter(
+            self.write_particles(RELION5_PARTICLES), particle_objects=True
+        )
+        converter.do_conversion(tomogram_names=["TS_01"])
+        assert list(converter.particle_sets) == ["TS_01"]
+        particle_set = converter.particle_sets["TS_01"]
+        assert isinstance(particle_set, ParticleCoordinatesSet)
+        assert particle_set.particles[0].fom == 0.25
+
+    def test_no_particles_block(self):
+        converter = RelionParticleConverter(self.write_particles("data_optics\n"))
+        with self.assertRaises(ValueError):
+            converter.do_conversion()
+
+    def test_particles_added_to_regions(self):
+        self.setup_tomo_dirs()
+        star = self.write_particles(RELION5_PARTICLES)
+        dataset = converter_main(
+            [
+                "--tilt_series_starfile",
+                "Import/job001/tilt_series.star",
+                "--particles_starfile",
+                str(star),
+                "--validation",
+                "construct",
+                "--output",
+                "dataset.json",
+            ]
+        )
+        # one region per tilt series and one for the tomogram with no tilt series
+        assert len(dataset.regions) == 6
+        assert dataset.regions[1].annotations[0].coords.shape == (2, 3)
+        assert dataset.regions[-1].annotations[0].coords.tolist() == [[1.0, 1.0, 1.0]]
+        with open("dataset.json") as f:
+            regions = json.load(f)["regions"]
+        written = regions[1]["annotations"][0]
+        assert written["type"] == "particle_coordinates"
+        assert written["coords"] == [[9.0, 18.0, 27.0], [100.0, 200.0, 300.0]]
+        assert written["foms"] == [0.5, 0.75]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import os
+import unittest
+from pathlib import Path
+
+import numpy as np
+from gemmi import cif
+
+from src.tomobabel.converters.relion.relion_starfiles import (
+    StarFileCache,
+    TiltSeriesTable,
+)
+from tests.converters.relion.relion_testing_utils import TomoBabelRelionTest
+
+
+class StarFileCacheTest(TomoBabelRelionTest):
+    def test_read_parses_once(self):
+        self.setup_tomo_dirs()
+        cache = StarFileCache()
+        doc = cache.read("Import/job001/tilt_series.star")
+        assert cache.read(Path("Import/job001/tilt_series.star").absolute()) is doc
+        assert cache.parse_count("Import/job001/tilt_series.star") == 1
+        assert cache.n_parses == 1
+
+    def test_find_block(self):
+        self.setup_tomo_dirs()
+        cache = StarFileCache()
+        block = cache.find_block("Import/job001/tilt_series/TS_01.star", "TS_01")
+        assert block.name == "TS_01"
+        assert cache.find_block("Import/job001/tilt_series/TS_01.star", "bad") is None
+        assert cache.get_block("Import/job001/tilt_series/TS_01.star", "TS_01") is block
+        with self.assertRaisesRegex(ValueError, "has no data_bad block"):
+            cache.get_block("Import/job001/tilt_series/TS_01.star", "bad")
+
+    def test_changed_file_is_parsed_again(self):
+        self.setup_tomo_dirs()
+        cache = StarFileCache()
+        star = Path("Import/job001/tilt_series.star")
+        cache.read(star)
+        with open(star, "a") as f:
+            f.write("\ndata_extra\n_rlnTomoName TS_99\n")
+        st = star.stat()
+        os.utime(star, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+        assert cache.read(star).find_block("extra") is not None
+        assert cache.parse_count(star) == 2
+
+    def test_least_recently_used_dropped(self):
+        self.setup_tomo_dirs()
+        cache = StarFileCache(max_documents=2)
+        files = [f"Import/job001/tilt_series/{x}.star" for x in ("TS_01", "TS_03")]
+        for f in files:
+            cache.read(f)
+        cache.read(files[0])
+        cache.read("Import/job001/tilt_series/TS_43.star")
+        cache.read(files[0])
+        assert cache.parse_count(files[0]) == 1
+        cache.read(files[1])
+        assert cache.parse_count(files[1]) == 2
+
+    def test_missing_file(self):
+        with self.assertRaises(FileNotFoundError):
+            StarFileCache().read("not_a_file.star")
+
+    def test_clear(self):
+        self.setup_tomo_dirs()
+        cache = StarFileCache()
+        cache.read("Import/job001/tilt_series.star")
+        cache.clear()
+        assert cache.n_parses == 0
+        cache.read("Import/job001/tilt_series.star")
+        assert cache.n_parses == 1
+
+
+class TiltSeriesTableTest(TomoBabelRelionTest):
+    def get_block(self, job: str = "AlignTiltSeries/job005") -> cif.Block:
+        self.setup_tomo_dirs()
+        return cif.read_file(f"{job}/tilt_series/TS_01.star").find_block("TS_01")
+
+    def test_from_block(self):
+        block = self.get_block()
+        table = TiltSeriesTable.from_block(block)
+        assert table.name == "TS_01"
+        assert len(table) == 40
+        assert len(list(table)) == 27
+        assert table["MicrographMovieName"][0] == "frames/TS_01_038_-57.0.mrc"
+        assert table["TomoTiltMovieFrameCount"].dtype == np.int64
+        assert table["DefocusU"].dtype == np.float64
+
+    def test_columns_match_gemmi(self):
+        block = self.get_block()
+        table = TiltSeriesTable.from_block(block)
+        for label in ("DefocusU", "TomoXShiftAngst", "TomoZRot"):
+            expected = [float(x[0]) for x in block.find("_rln", [label])]
+            assert table[label].tolist() == expected
+
+    def test_str_columns(self):
+        block = cif.read_string(
+            "data_global\nloop_\n_rlnTomoName\n_rlnTomoSizeX\n01 4000\n2 4000\n"
+        ).sole_block()
+        assert TiltSeriesTable.from_block(block)["TomoName"].tolist() == [1, 2]
+        table = TiltSeriesTable.from_block(block, str_columns=["tomoname"])
+        assert table["TomoName"].tolist() == ["01", "2"]
+        assert table["TomoSizeX"].dtype == np.int64
+
+    def test_labels_not_case_sensitive(self):
+        table = TiltSeriesTable.from_block(self.get_block())
+        assert "TomoyTilt" in table
+        assert table["TomoyTilt"] is table["TomoYTilt"]
+
+    def test_has(self):
+        table = TiltSeriesTable.from_block(self.get_block("Import/job001"))
+        assert table.has("MicrographMovieName", "MicrographPreExposure")
+        assert not table.has("MicrographMovieName", "DefocusU")
+        with self.assertRaises(KeyError):
+            table["DefocusU"]
+
+    def test_quoted_strings(self):
+        block = cif.read_string(
+            "data_TS_01\nloop_\n_rlnMicrographMovieName\n_rlnTomoNominalDefocus\n"
+            "'my movie 1.mrc' 1\n'my movie 2.mrc' 2\n"
+        ).sole_block()
+        table = TiltSeriesTable.from_block(block)
+        assert table["MicrographMovieName"].tolist() == [
+            "my movie 1.mrc",
+            "my movie 2.mrc",
+        ]
+        assert table["TomoNominalDefocus"].tolist() == [1, 2]
+
+    def test_empty_block(self):
+        block = cif.read_string("data_TS_01\n_rlnTomoName TS_01\n").sole_block()
+        table = TiltSeriesTable.from_block(block)
+        assert len(table) == 0
+        assert not table.has()
+
+    def test_of(self):
+        table = TiltSeriesTable.from_block(self.get_block())
+        assert TiltSeriesTable.of(table) is table
+
+
+if __name__ == "__main__":
+    unittest.main()
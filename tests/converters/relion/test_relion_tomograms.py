@@ -0,0 +1,183 @@
+import json
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import mrcfile
+import numpy as np
+
+from benchmarks.synthetic_project import write_stub_mrc_header
+from src.tomobabel.converters.relion import relion_tomograms
+from src.tomobabel.converters.relion.relion_converter import main as converter_main
+from src.tomobabel.converters.relion.relion_tomograms import RelionTomogramConverter
+from src.tomobabel.models.tomo_images import TiltSeriesMicrographStack
+from tests.converters.relion.relion_testing_utils import TomoBabelRelionTest
+
+TOMOGRAMS_STAR = """
+data_global
+
+loop_
+_rlnTomoName #1
+_rlnTomoTiltSeriesStarFile #2
+_rlnTomoTiltSeriesPixelSize #3
+_rlnTomoTomogramBinning #4
+_rlnTomoSizeX #5
+_rlnTomoSizeY #6
+_rlnTomoSizeZ #7
+_rlnTomoReconstructedTomogram #8
+_rlnTomoReconstructedTomogramHalf1 #9
+_rlnTomoReconstructedTomogramHalf2 #10
+TS_01 AlignTiltSeries/job005/tilt_series/TS_01.star 1.35 4.0 4000 4000 1000 Tomograms/job006/tomograms/rec_TS_01.mrc Tomograms/job006/tomograms/rec_TS_01_half1.mrc Tomograms/job006/tomograms/rec_TS_01_half2.mrc
+TS_03 AlignTiltSeries/job005/tilt_series/TS_03.star 1.35 4.0 4000 4000 1000 Tomograms/job006/tomograms/rec_TS_03.mrc "" ""
+"""
+
+PIXEL_PARTICLES = """
+data_optics
+
+loop_
+_rlnOpticsGroup #1
+_rlnTomoTiltSeriesPixelSize #2
+1 1.35
+
+data_particles
+
+loop_
+_rlnTomoName #1
+_rlnCoordinateX #2
+_rlnCoordinateY #3
+_rlnCoordinateZ #4
+_rlnOpticsGroup #5
+TS_01 2000 2000 500 1
+"""
+
+
+class RelionTomogramConverterTest(TomoBabelRelionTest):
+    def setUp(self):
+        super().setUp()
+        self.star = Path("Tomograms/job006/tomograms.star")
+        tomo_dir = self.star.parent / "tomograms"
+        tomo_dir.mkdir(parents=True)
+        self.star.write_text(TOMOGRAMS_STAR)
+        # header only, as if the data was a 4 GB volume
+        for name in ("rec_TS_01", "rec_TS_01_half1", "rec_TS_01_half2"):
+            write_stub_mrc_header(tomo_dir / f"{name}.mrc", 1000, 1000, 250, 5.4)
+        with mrcfile.new(tomo_dir / "rec_TS_03.mrc") as mrc:
+            mrc.set_data(np.zeros((25, 20, 10), dtype=np.float32))
+            mrc.voxel_size = 5.4
+
+    def test_tomograms_from_headers(self):
+        converter = RelionTomogramConverter(self.star)
+        converter.do_conversion()
+        assert list(converter.tomogram_sets) == ["TS_01", "TS_03"]
+        ts01 = converter.tomogram_sets["TS_01"].tomograms
+        assert [x.file for x in ts01] == [
+            "Tomograms/job006/tomograms/rec_TS_01.mrc",
+            "Tomograms/job006/tomograms/rec_TS_01_half1.mrc",
+            "Tomograms/job006/tomograms/rec_TS_01_half2.mrc",
+        ]
+        assert (ts01[0].width, ts01[0].height, ts01[0].depth) == (1000, 1000, 250)
+        assert ts01[0].voxel_size == 5.4
+        assert ts01[0].annotations == []
+        assert ts01[1].annotations[0].description == "Half tomogram 1"
+        ts03 = converter.tomogram_sets["TS_03"].tomograms
+        assert len(ts03) == 1
+        assert (ts03[0].width, ts03[0].height, ts03[0].depth) == (10, 20, 25)
+        assert converter.tomogram_sizes["TS_01"] == (4000, 4000, 1000)
+        assert converter.ts_files["TS_03"] == (
+            "AlignTiltSeries/job005/tilt_series/TS_03.star"
+        )
+
+    def test_headers_read_in_one_batch(self):
+        with patch.object(
+            relion_tomograms,
+            "probe_mrc_headers",
+            wraps=relion_tomograms.probe_mrc_headers,
+        ) as probe:
+            RelionTomogramConverter(self.star, probe_workers=4).do_conversion()
+        assert probe.call_count == 1
+        assert len(probe.call_args.args[0]) == 4
+        assert probe.call_args.kwargs["max_workers"] == 4
+
+    def test_missing_tomogram_file(self):
+        Path("Tomograms/job006/tomograms/rec_TS_03.mrc").unlink()
+        converter = RelionTomogramConverter(self.star)
+        with self.assertLogs(relion_tomograms.logger, level="WARNING"):
+            converter.do_conversion(tomogram_names=["TS_03"])
+        tomogram = converter.tomogram_sets["TS_03"].tomograms[0]
+        assert tomogram.width is None
+        assert tomogram.voxel_size == 5.4
+
+    def test_unknown_tomogram(self):
+        with self.assertRaisesRegex(ValueError, "TS_99"):
+            RelionTomogramConverter(self.star).do_conversion(["TS_01", "TS_99"])
+
+    def test_numeric_tomogram_name(self):
+        # names and paths are read as they are written, not as numbers
+        self.star.write_text(
+            "data_global\n\nloop_\n_rlnTomoName #1\n_rlnTomoTiltSeriesStarFile #2\n"
+            "_rlnTomoSizeX #3\n_rlnTomoSizeY #4\n_rlnTomoSizeZ #5\n"
+            "_rlnTomoReconstructedTomogram #6\n"
+            "01 0001 4000 4000 1000 Tomograms/job006/tomograms/rec_TS_03.mrc\n"
+        )
+        converter = RelionTomogramConverter(self.star)
+        converter.do_conversion(["01"])
+        assert list(converter.tomogram_sets) == ["01"]
+        assert converter.tomogram_sizes == {"01": (4000, 4000, 1000)}
+        assert converter.ts_files == {"01": "0001"}
+
+    def test_link_to_tilt_series(self):
+        converter = RelionTomogramConverter(self.star)
+        converter.do_conversion()
+        ts01 = TiltSeriesMicrographStack()
+        assert converter.link_to_tilt_series({"TS_01": ts01}) == ["TS_03"]
+        assert ts01.Tomograms == [converter.tomogram_sets["TS_01"]]
+
+    def test_tomograms_added_to_dataset(self):
+        self.setup_tomo_dirs()
+        particles = Path("Extract/job007/particles.star")
+        particles.parent.mkdir(parents=True)
+        particles.write_text(PIXEL_PARTICLES)
+        dataset = converter_main(
+            [
+                "--tilt_series_starfile",
+                "Import/job001/tilt_series.star",
+                "--tomograms_starfile",
+                str(self.star),
+                "--particles_starfile",
+                str(particles),
+                "--output",
+                "dataset.json",
+            ]
+        )
+        raw_movies = dataset.regions[0].tomo_imaging[0].raw_movies
+        tomogram_set = raw_movies.tilt_series[0].Tomograms[0]
+        assert tomogram_set.tomograms[0].width == 1000
+        # the sizes in the tomograms file put the particle at the center
+        particle_set = dataset.regions[0].annotations[0]
+        assert particle_set.coords.tolist() == [[0.0, 0.0, 0.0]]
+        # a tilt series without tomograms is still added, with no tomograms
+        without = dataset.regions[2].tomo_imaging[0].raw_movies.tilt_series
+        assert len(without) == 1
+        assert without[0].Tomograms == []
+        with open("dataset.json") as f:
+            written = json.load(f)["regions"][0]["tomo_imaging"][0]["raw_movies"]
+        tomograms = written["tilt_series"][0]["Tomograms"][0]["tomograms"]
+        assert tomograms[0]["depth"] == 250
+
+    def test_tilt_series_added_to_dataset_without_tomograms(self):
+        self.setup_tomo_dirs()
+        dataset = converter_main(
+            ["--tilt_series_starfile", "Import/job001/tilt_series.star"]
+        )
+        assert len(dataset.regions) == 5
+        for region in dataset.regions:
+            raw_movies = region.tomo_imaging[0].raw_movies
+            assert len(raw_movies.tilt_series) == 1
+            assert raw_movies.tilt_series[0].Tomograms == []
+            assert len(raw_movies.tilt_series[0].micrographs) == len(
+                raw_movies.movie_stacks
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
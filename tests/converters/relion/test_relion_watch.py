@@ -0,0 +1,123 @@
+import os
+import shutil
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from src.tomobabel.converters.relion.relion_convert_tilt_series import (
+    PipelinerTiltSeriesGroupConverter,
+    main as tilt_series_main,
+)
+from src.tomobabel.converters.relion.relion_watch import TiltSeriesWatcher
+from tests.converters.relion.relion_testing_utils import TomoBabelRelionTest
+
+STARFILE = "CtfFind/job003/tilt_series_ctf.star"
+ALL_TS = ["TS_01", "TS_03", "TS_43", "TS_45", "TS_54"]
+
+
+class TiltSeriesWatcherTest(TomoBabelRelionTest):
+    def setUp(self):
+        super().setUp()
+        self.setup_tomo_dirs()
+        self.make_stub_movies(STARFILE)
+        Path("outdir").mkdir()
+
+    def get_watcher(self, **kwargs) -> TiltSeriesWatcher:
+        converter = PipelinerTiltSeriesGroupConverter(input_file=Path(STARFILE))
+        kwargs.setdefault("settle_time", 0)
+        return TiltSeriesWatcher(converter, Path("outdir"), **kwargs)
+
+    def test_converts_new_and_changed_tilt_series(self):
+        watcher = self.get_watcher()
+        assert watcher.poll() == ALL_TS
+        assert len(list(Path("outdir").glob("*_tilt_series.json"))) == 5
+        assert watcher.poll() == []
+
+        ts_file = Path("CtfFind/job003/tilt_series/TS_03.star")
+        ts_file.write_text(ts_file.read_text().replace("15032.874023", "15032.9", 1))
+        assert watcher.poll() == ["TS_03"]
+        assert watcher.converted == ALL_TS + ["TS_03"]
+        # the converted tilt series are written and not kept
+        assert watcher.converter.all_tilt_series == {}
+        assert watcher.converter.all_movie_sets == {}
+
+    def test_tilt_series_file_appears_later(self):
+        ts_file = Path("CtfFind/job003/tilt_series/TS_43.star")
+        shutil.move(ts_file, "TS_43.star")
+        watcher = self.get_watcher()
+        assert watcher.poll() == ["TS_01", "TS_03", "TS_45", "TS_54"]
+        shutil.move("TS_43.star", ts_file)
+        assert watcher.poll() == ["TS_43"]
+
+    def test_waits_for_files_to_settle(self):
+        # the test data is copied with its old modification times
+        for f in [Path(STARFILE), *Path("CtfFind/job003/tilt_series").glob("*.star")]:
+            f.touch()
+        watcher = self.get_watcher(settle_time=10)
+        clock = "src.tomobabel.converters.relion.relion_watch.time.monotonic"
+        with patch(clock, return_value=100.0):
+            assert watcher.poll() == []
+        with patch(clock, return_value=111.0):
+            # the group file has settled, the tilt series files have just been seen
+            assert watcher.poll() == []
+        ts_file = Path("CtfFind/job003/tilt_series/TS_03.star")
+        ts_file.write_text(ts_file.read_text().replace("15032.874023", "15032.9", 1))
+        with patch(clock, return_value=122.0):
+            # TS_03 changed at 122 so it is still settling
+            assert watcher.poll() == ["TS_01", "TS_43", "TS_45", "TS_54"]
+        with patch(clock, return_value=133.0):
+            assert watcher.poll() == ["TS_03"]
+
+    def test_old_files_already_settled(self):
+        # the job finished an hour ago, apart from TS_45 which was just written
+        hour_ago = time.time() - 3600
+        for f in [Path(STARFILE), *Path("CtfFind/job003/tilt_series").glob("*.star")]:
+            os.utime(f, (hour_ago, hour_ago))
+        Path("CtfFind/job003/tilt_series/TS_45.star").touch()
+        watcher = self.get_watcher(settle_time=30)
+        clock = "src.tomobabel.converters.relion.relion_watch.time.monotonic"
+        with patch(clock, return_value=100.0):
+            assert watcher.poll() == ["TS_01", "TS_03", "TS_43", "TS_54"]
+        with patch(clock, return_value=131.0):
+            assert watcher.poll() == ["TS_45"]
+
+    def test_partly_written_file_is_retried(self):
+        ts_file = Path("CtfFind/job003/tilt_series/TS_45.star")
+        contents = ts_file.read_text()
+        ts_file.write_text(contents[: len(contents) // 2].split("\n_rln")[0])
+        watcher = self.get_watcher()
+        assert watcher.poll() == ["TS_01", "TS_03", "TS_43", "TS_54"]
+        assert "TS_45" not in watcher._checked
+        ts_file.write_text(contents)
+        assert watcher.poll() == ["TS_45"]
+
+    def test_only_watches_selected_tilt_series(self):
+        watcher = self.get_watcher(tilt_series_names=["TS_43", "TS_01"])
+        assert sorted(watcher.poll()) == ["TS_01", "TS_43"]
+
+    def test_no_input_file_yet(self):
+        Path(STARFILE).unlink()
+        assert self.get_watcher().poll() == []
+
+    def test_main_watch(self):
+        converter = tilt_series_main(
+            in_args=[
+                "--input_starfile",
+                STARFILE,
+                "--output",
+                "watched/",
+                "--watch",
+                "--settle_time",
+                "0",
+                "--watch_timeout",
+                "0",
+            ]
+        )
+        assert converter.all_tilt_series == {}
+        assert len(list(Path("watched").glob("*_movie_set.json"))) == 5
+        assert not list(Path("watched").glob("*.tmp"))
+
+
+if __name__ == "__main__":
+    unittest.main()
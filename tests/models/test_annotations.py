@@ -1,6 +1,10 @@
 import numpy as np
+from pydantic import ValidationError
 
 from src.tomobabel.models.annotation import (
+    CompactParticleCoordinatesSet,
+    Particle,
+    ParticleCoordinatesSet,
     Point,
     Vector,
     Sphere,
@@ -117,3 +121,58 @@ class AnnotationModelsTest(TomoBabelTest):
             ),
         )
         assert np.allclose(sq.center_point, np.array([[0], [0], [0]]))
+
+
+class CompactParticleCoordinatesSetTest(TomoBabelTest):
+    def make_set(self, **kwargs) -> CompactParticleCoordinatesSet:
+        rotation = np.array([[0.0, -1.0, 0.0], [1.0, 0.0, 0.0], [0.0, 0.0, 1.0]])
+        return CompactParticleCoordinatesSet(
+            name="Ribosomes",
+            coords=np.array([[1, 2, 3], [4, 5, 6]]),
+            foms=np.array([0.5, 0.25]),
+            rotations=np.array([np.identity(3), rotation]),
+            **kwargs,
+        )
+
+    def test_arrays_are_typed(self):
+        particles = self.make_set()
+        assert particles.coords.dtype == np.float64
+        assert particles.coords.shape == (2, 3)
+        assert particles.rotations.shape == (2, 3, 3)
+        assert particles.n_particles == 2
+
+    def test_particle(self):
+        particle = self.make_set().particle(-1)
+        assert isinstance(particle, Particle)
+        assert particle.coords.array.flatten().tolist() == [4.0, 5.0, 6.0]
+        assert particle.fom == 0.25
+        xform = particle.alignment_transformations[0]
+        assert xform.transform_type == "rotate"
+        assert xform.trans_matrix.shape == (4, 4)
+        assert xform.trans_matrix[1, 0] == 1.0
+
+    def test_mismatched_lengths_raise(self):
+        with self.assertRaises(ValidationError):
+            CompactParticleCoordinatesSet(coords=[[1, 2, 3]], foms=[0.1, 0.2])
+        with self.assertRaises(ValidationError):
+            CompactParticleCoordinatesSet(coords=[[1, 2, 3]], rotations=[])
+
+    def test_round_trip_through_particle_set(self):
+        compact = self.make_set()
+        full = compact.to_particle_set()
+        assert isinstance(full, ParticleCoordinatesSet)
+        assert full.name == "Ribosomes"
+        assert len(full.particles) == 2
+        again = CompactParticleCoordinatesSet.from_particle_set(full)
+        assert np.array_equal(again.coords, compact.coords)
+        assert np.array_equal(again.foms, compact.foms)
+        assert np.allclose(again.rotations, compact.rotations)
+
+    def test_from_particle_set_without_foms(self):
+        full = self.make_set().to_particle_set()
+        for particle in full.particles:
+            particle.fom = None
+        assert CompactParticleCoordinatesSet.from_particle_set(full).foms is None
+        full.particles[0].fom = 1.0
+        with self.assertRaises(ValueError):
+            CompactParticleCoordinatesSet.from_particle_set(full)
@@ -1,9 +1,17 @@
 import numpy as np
+from pydantic import ValidationError
 
+from src.tomobabel.models.annotation import Point
 from src.tomobabel.models.basemodels import (
+    Annotation,
+    AnnotationSet,
     CoordsPhysical,
     CoordsLogical,
+    ValidationLevel,
+    build_model,
+    validate_model_tree,
 )
+from src.tomobabel.models.tomo_images import CTFMetadata, MovieFrame, MovieStack
 from tests.testing_tools import TomoBabelTest
 
 
@@ -39,3 +47,54 @@ class BaseModelsTest(TomoBabelTest):
     def test_get_coords_hom_array_logical2D(self):
         coords = CoordsLogical(x=10.0, y=11.0)
         assert (coords.hom_array == np.array([[10.0], [11.0], [1]])).all()
+
+    def test_build_model_full_validates(self):
+        with self.assertRaises(ValidationError):
+            build_model(CoordsPhysical, ValidationLevel.full, x="a", y=1)
+        coords = build_model(CoordsPhysical, ValidationLevel.full, x="10", y=1)
+        assert coords.x == 10
+
+    def test_build_model_construct_does_not_validate(self):
+        coords = build_model(CoordsPhysical, ValidationLevel.construct, x="10", y=1)
+        assert coords.x == "10"
+        assert coords.z is None
+
+    def test_validate_model_tree(self):
+        ctf = CTFMetadata.model_construct(defocus_u="1.5")
+        frames = [
+            MovieFrame.model_construct(section=str(n), ctf_metadata=ctf)
+            for n in range(3)
+        ]
+        stack = MovieStack.model_construct(path="a.mrc", frame_images=frames)
+        assert validate_model_tree(stack) is stack
+        assert [x.section for x in stack.frame_images] == [0, 1, 2]
+        assert ctf.defocus_u == 1.5
+        assert all(x.ctf_metadata is ctf for x in stack.frame_images)
+
+    def test_validate_model_tree_invalid(self):
+        frame = MovieFrame.model_construct(section="a")
+        stack = MovieStack.model_construct(frame_images=[frame])
+        with self.assertRaises(ValidationError):
+            validate_model_tree(stack)
+
+    def test_dump_plain_annotations(self):
+        frame = MovieFrame(path="movie.mrc", section=1)
+        frame.add_text_annotation("text")
+        frame.add_annotation(
+            AnnotationSet(name="set", annotations=[Annotation(description="a")])
+        )
+        assert frame.model_dump()["annotations"] == [
+            {"type": "text", "description": "text"},
+            {
+                "name": "set",
+                "annotations": [{"type": "text", "description": "a"}],
+            },
+        ]
+
+    def test_dump_annotation_subclasses(self):
+        # subclasses are dumped with all their fields, not just those of Annotation
+        frame = MovieFrame(path="movie.mrc", section=1)
+        frame.add_annotation(Point(coords=CoordsLogical(x=1.0, y=2.0, z=3.0)))
+        dumped = frame.model_dump()["annotations"][0]
+        assert dumped["type"] == "point"
+        assert (dumped["coords"]["x"], dumped["coords"]["z"]) == (1.0, 3.0)
@@ -1,8 +1,43 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+
 from pydantic import Field
 import warnings
 from tests.testing_tools import TomoBabelTest
+from src.tomobabel.models.ebi_compatibility.ebi_cats import (
+    DEPOBJ_CATS,
+    EbiCategories,
+    write_categories,
+)
+from src.tomobabel.models.ebi_compatibility.ebi_validation import get_ebi_field_checks
 from src.tomobabel.models.imaging import EmImagingParameters
 
+# imports the EBI linked models in a new interpreter and reports the cost
+IMPORT_COST_SCRIPT = """
+import json, resource, time
+import src.tomobabel.models.basemodels
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+from src.tomobabel.models import imaging
+from src.tomobabel.models.ebi_compatibility.ebi_cats import DEPOBJ_CATS
+for model in (
+    imaging.SampleSupport,
+    imaging.EmDetector,
+    imaging.EmImagingParameters,
+    imaging.EmVitrification,
+):
+    model()
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss,
+    "loaded": DEPOBJ_CATS.loaded,
+}))
+"""
+
 
 class EbiValidationTests(TomoBabelTest):
     def test_instantiate_EBI_linked_model(self):
@@ -41,3 +76,71 @@ class EbiValidationTests(TomoBabelTest):
         assert str(w[0].message).startswith(
             "CETS model: EmImagingParameters.microscope_model: The value BAD is not"
         )
+
+    def test_regex_warning(self):
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            EmImagingParameters(microscope_model="TFS KRIOS", nominal_cs=float("inf"))
+        assert len(w) == 1
+        assert "does not satisfy the validation regex" in str(w[0].message)
+
+    def test_field_checks_made_once(self):
+        get_ebi_field_checks.cache_clear()
+        model = EmImagingParameters(cryogen="NITROGEN")
+        model.cryogen = "HELIUM"
+        EmImagingParameters()
+        assert get_ebi_field_checks.cache_info().misses == 1
+        checks = get_ebi_field_checks(EmImagingParameters, "em_imaging")
+        assert [x.name for x in checks] == model.ebi_fields
+        cryogen = checks[model.ebi_fields.index("cryogen")]
+        assert cryogen.options == frozenset(["NITROGEN", "HELIUM"])
+
+
+class EbiCategoriesTests(TomoBabelTest):
+    def test_categories_loaded_when_used(self):
+        categories = {
+            "em_detector": {
+                "mode": {"data_type": "text", "regex": ".*", "options": []}
+            },
+            "em_imaging": {
+                "mode": {"data_type": "code", "regex": ".*", "options": ["BRIGHT"]}
+            },
+        }
+        write_categories(categories, Path("cats.json"))
+        loaded = EbiCategories(Path("cats.json"))
+        assert len(loaded) == 2
+        assert "em_imaging" in loaded and "atom_site" not in loaded
+        assert loaded.loaded == []
+        assert loaded["em_imaging"] == categories["em_imaging"]
+        assert loaded.loaded == ["em_imaging"]
+        assert dict(loaded) == categories
+        assert loaded.get("atom_site") is None
+        with self.assertRaises(KeyError):
+            loaded["atom_site"]
+
+    def test_schema_file(self):
+        assert len(DEPOBJ_CATS) > 500
+        assert DEPOBJ_CATS["em_imaging"]["cryogen"]["options"] == ["NITROGEN", "HELIUM"]
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "ru_maxrss is in kB")
+    def test_import_cost(self):
+        # the whole schema used to be a 34k line module that took ~0.45 s and
+        # ~50 MB to import
+        root = Path(__file__).parents[2]
+        env = dict(os.environ, PYTHONPATH=str(root))
+        result = subprocess.run(
+            [sys.executable, "-c", IMPORT_COST_SCRIPT],
+            cwd=root,
+            env=env,
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        cost = json.loads(result.stdout)
+        assert sorted(cost["loaded"]) == [
+            "em_detector",
+            "em_imaging",
+            "em_sample_support",
+            "em_vitrification",
+        ]
+        assert cost["rss_kb"] < 10 * 1024
@@ -0,0 +1,106 @@
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+from pydantic import ValidationError
+
+from src.tomobabel.models.tomo_images import (
+    CompactMovieStack,
+    CTFMetadata,
+    MovieFrame,
+    MovieStack,
+    MovieStackSet,
+)
+from src.tomobabel.models.transformations import Transformation
+from tests.testing_tools import TomoBabelTest
+
+
+class CompactMovieStackTest(TomoBabelTest):
+    def make_stack(self, **kwargs) -> CompactMovieStack:
+        return CompactMovieStack(
+            path="movie.mrc",
+            sections=np.array([0, 1, 2]),
+            accumulated_doses=np.array([1.5, 3.0, 4.5]),
+            nominal_tilt_angle=3.0,
+            width=30,
+            height=20,
+            ctf_metadata=CTFMetadata(defocus_u=1.0),
+            motion_correction_transformations=[Transformation()],
+            **kwargs,
+        )
+
+    def test_arrays_are_typed(self):
+        stack = self.make_stack()
+        assert stack.sections.dtype == np.int64
+        assert stack.accumulated_doses.dtype == np.float64
+        assert stack.n_frames == 3
+        # lists are converted too
+        stack = CompactMovieStack(path="a", sections=[0, 1], accumulated_doses=[1, 2])
+        assert stack.sections.dtype == np.int64
+        assert stack.accumulated_doses.dtype == np.float64
+
+    def test_frame(self):
+        stack = self.make_stack()
+        frame = stack.frame(-1)
+        assert isinstance(frame, MovieFrame)
+        assert frame.section == 2
+        assert frame.accumulated_dose == 4.5
+        assert frame.nominal_tilt_angle == 3.0
+        assert (frame.width, frame.height) == (30, 20)
+        assert frame.ctf_metadata is stack.ctf_metadata
+        assert frame.motion_correction_transformations == (
+            stack.motion_correction_transformations
+        )
+        assert [x.section for x in stack.frame_images] == [0, 1, 2]
+
+    def test_frame_shifts_make_translations(self):
+        stack = self.make_stack(frame_shifts=[[0, 0], [1.5, -2], [3, -4]])
+        xform = stack.frame(1).motion_correction_transformations[0]
+        assert xform.transform_type == "translation"
+        assert xform.trans_matrix[0, 2] == 1.5
+        assert xform.trans_matrix[1, 2] == -2.0
+
+    def test_import_does_not_need_scipy(self):
+        code = (
+            "import sys; import src.tomobabel.models.tomo_images;"
+            " assert 'scipy' not in sys.modules"
+        )
+        root = Path(__file__).parents[2]
+        subprocess.run([sys.executable, "-c", code], check=True, cwd=root)
+
+    def test_mismatched_lengths_raise(self):
+        with self.assertRaises(ValidationError):
+            CompactMovieStack(path="a", sections=[0, 1], accumulated_doses=[1.0])
+        with self.assertRaises(ValidationError):
+            self.make_stack(frame_shifts=[[0, 0]])
+
+    def test_round_trip_through_movie_stack(self):
+        stack = self.make_stack()
+        full = stack.to_movie_stack()
+        assert isinstance(full, MovieStack)
+        assert len(full.frame_images) == 3
+        compact = CompactMovieStack.from_movie_stack(full)
+        assert np.array_equal(compact.sections, stack.sections)
+        assert np.array_equal(compact.accumulated_doses, stack.accumulated_doses)
+        assert compact.ctf_metadata is stack.ctf_metadata
+
+    def test_from_movie_stack_with_different_frames_raises(self):
+        full = self.make_stack().to_movie_stack()
+        full.frame_images[1].nominal_tilt_angle = 6.0
+        with self.assertRaises(ValueError):
+            CompactMovieStack.from_movie_stack(full)
+
+    def test_movie_stack_set_json_round_trip(self):
+        stack = self.make_stack()
+        stack.motion_correction_transformations = []
+        stack_set = MovieStackSet(movie_stacks=[stack, stack.to_movie_stack()])
+        loaded = MovieStackSet.model_validate_json(stack_set.model_dump_json())
+        assert isinstance(loaded.movie_stacks[0], CompactMovieStack)
+        assert isinstance(loaded.movie_stacks[1], MovieStack)
+        assert np.array_equal(loaded.movie_stacks[0].accumulated_doses, [1.5, 3, 4.5])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+import json
+import unittest
+
+import numpy as np
+
+from src.tomobabel.interning import (
+    ModelInterner,
+    distinct_models,
+    dump_deduplicated,
+    load_deduplicated,
+)
+from src.tomobabel.models.basemodels import Annotation
+from src.tomobabel.models.tomo_images import (
+    CTFMetadata,
+    MovieFrame,
+    MovieStack,
+    MovieStackSet,
+)
+from src.tomobabel.models.transformations import Transformation
+from src.tomobabel.serialization import dump_json
+
+
+class ModelInternerTest(unittest.TestCase):
+    def test_intern_returns_shared_instance(self):
+        interner = ModelInterner()
+        first = interner.intern(CTFMetadata(defocus_u=1.0))
+        assert interner.intern(CTFMetadata(defocus_u=1.0)) is first
+        assert interner.intern(CTFMetadata(defocus_u=2.0)) is not first
+        assert interner.hits == 1
+        assert len(interner) == 2
+
+    def test_intern_distinguishes_types(self):
+        interner = ModelInterner()
+        annot = interner.intern(Annotation(description="a"))
+        xform = interner.intern(Transformation())
+        assert interner.intern(Annotation(description="a")) is annot
+        assert interner.intern(Transformation()) is xform
+
+    def test_intern_forgets_values_when_full(self):
+        interner = ModelInterner(max_values=2)
+        first = interner.intern(CTFMetadata(defocus_u=1.0))
+        interner.intern(CTFMetadata(defocus_u=2.0))
+        interner.intern(CTFMetadata(defocus_u=3.0))
+        assert len(interner) == 1
+        assert interner.intern(CTFMetadata(defocus_u=1.0)) is not first
+
+    def test_shared_only_calls_factory_once(self):
+        interner = ModelInterner()
+        calls = []
+
+        def factory():
+            calls.append(1)
+            return Transformation(trans_matrix=np.identity(2))
+
+        first = interner.shared("placeholder", factory)
+        assert interner.shared("placeholder", factory) is first
+        assert len(calls) == 1
+        interner.clear()
+        assert interner.shared("placeholder", factory) is not first
+
+
+class DumpDeduplicatedTest(unittest.TestCase):
+    def make_stack(self, share: bool = True) -> MovieStack:
+        ctf = CTFMetadata(defocus_u=1.0)
+        xform = Transformation(
+            trans_matrix=np.identity(2), annotations=[Annotation(description="x")]
+        )
+        frames = [
+            MovieFrame(
+                path="movie.mrc",
+                section=n,
+                ctf_metadata=ctf if share else CTFMetadata(defocus_u=1.0),
+                motion_correction_transformations=[
+                    xform if share else Transformation()
+                ],
+            )
+            for n in range(3)
+        ]
+        return MovieStack(path="movie.mrc", frame_images=frames)
+
+    def test_nothing_shared_is_same_as_model_dump(self):
+        stack = self.make_stack(share=False)
+        dumped = dump_deduplicated(stack)
+        assert "$defs" not in dumped
+        assert dumped.keys() == stack.model_dump().keys()
+
+    def test_distinct_models(self):
+        stack = self.make_stack()
+        models = distinct_models(stack, stack.frame_images[0])
+        assert [type(x).__name__ for x in models] == [
+            "MovieStack",
+            "MovieFrame",
+            "CTFMetadata",
+            "Transformation",
+            "Annotation",
+            "MovieFrame",
+            "MovieFrame",
+        ]
+        assert models[1] is stack.frame_images[0]
+
+    def test_shared_instances_written_once(self):
+        dumped = dump_deduplicated(self.make_stack())
+        assert list(dumped["$defs"]) == ["CTFMetadata_0", "Transformation_1"]
+        for frame in dumped["frame_images"]:
+            assert frame["ctf_metadata"] == {"$ref": "#/$defs/CTFMetadata_0"}
+            assert frame["motion_correction_transformations"] == [
+                {"$ref": "#/$defs/Transformation_1"}
+            ]
+        xform = dumped["$defs"]["Transformation_1"]
+        assert xform["annotations"] == [{"type": "text", "description": "x"}]
+        assert np.array_equal(xform["trans_matrix"], np.identity(2))
+        assert dumped["$defs"]["CTFMetadata_0"]["defocus_u"] == 1.0
+
+    def test_equal_instances_written_once_by_value(self):
+        stack = self.make_stack(share=False)
+        assert "$defs" not in dump_deduplicated(stack)
+        dumped = dump_deduplicated(stack, by_value=True)
+        assert list(dumped["$defs"]) == ["CTFMetadata_0", "Transformation_1"]
+        for frame in dumped["frame_images"]:
+            assert frame["ctf_metadata"] == {"$ref": "#/$defs/CTFMetadata_0"}
+        xform = dumped["$defs"]["Transformation_1"]
+        assert dump_json(xform) == dump_json(Transformation().model_dump())
+
+    def test_by_value_compares_types_and_nan(self):
+        frames = [
+            MovieFrame(path="movie.mrc", section=n, ctf_metadata=ctf)
+            for n, ctf in enumerate(
+                [
+                    CTFMetadata(defocus_u=float("nan")),
+                    CTFMetadata(defocus_u=float("nan")),
+                    CTFMetadata(defocus_u=1.0),
+                    CTFMetadata(defocus_u=1.5),
+                ]
+            )
+        ]
+        dumped = dump_deduplicated(MovieStack(frame_images=frames), by_value=True)
+        assert list(dumped["$defs"]) == ["CTFMetadata_0"]
+        assert np.isnan(dumped["$defs"]["CTFMetadata_0"]["defocus_u"])
+        assert dumped["frame_images"][2]["ctf_metadata"]["defocus_u"] == 1.0
+
+    def test_load_deduplicated(self):
+        stack = self.make_stack(share=False)
+        movie_set = MovieStackSet(movie_stacks=[stack, self.make_stack()])
+        data = json.loads(dump_json(dump_deduplicated(movie_set, by_value=True)))
+        loaded = load_deduplicated(data, MovieStackSet)
+        assert dump_json(loaded) == dump_json(movie_set)
+        frames = [x for s in loaded.movie_stacks for x in s.frame_images]
+        assert len({id(x.ctf_metadata) for x in frames}) == 1
+        xforms = {id(x.motion_correction_transformations[0]) for x in frames}
+        assert len(xforms) == 2
+
+    def test_load_not_deduplicated(self):
+        stack = self.make_stack()
+        loaded = load_deduplicated(json.loads(dump_json(stack)), MovieStack)
+        assert dump_json(loaded) == dump_json(stack)
+
+    def test_load_bad_reference(self):
+        data = dump_deduplicated(self.make_stack())
+        data["frame_images"][0]["ctf_metadata"] = {"$ref": "#/$defs/CTFMetadata_9"}
+        with self.assertRaisesRegex(ValueError, "CTFMetadata_9"):
+            load_deduplicated(data, MovieStack)
+        data["$defs"]["Unknown_9"] = {}
+        data["frame_images"][0]["ctf_metadata"] = {"$ref": "#/$defs/Unknown_9"}
+        with self.assertRaisesRegex(ValueError, "Unknown"):
+            load_deduplicated(data, MovieStack)
+
+
+if __name__ == "__main__":
+    unittest.main()
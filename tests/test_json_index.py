@@ -0,0 +1,160 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from src.tomobabel.interning import dump_deduplicated
+from src.tomobabel.json_index import IndexedJsonFile, build_index, get_index_path
+from src.tomobabel.models.annotation import CompactParticleCoordinatesSet
+from src.tomobabel.models.basemodels import Annotation
+from src.tomobabel.models.tomo_images import (
+    CompactMovieStack,
+    MovieStack,
+    MovieStackSet,
+)
+from src.tomobabel.models.top_level import DataSet, Region, TomoImageSet
+from src.tomobabel.serialization import dump_json, write_json
+from tests.test_serialization import make_stack
+
+
+def make_dataset() -> DataSet:
+    regions = []
+    for n in range(3):
+        stack = make_stack(defocus_v=2.0)
+        compact = CompactMovieStack(
+            sections=np.array([0, 1]), accumulated_doses=np.array([1.0, 2.0])
+        )
+        movies = MovieStackSet(
+            movie_stacks=[stack, compact],
+            annotations=[
+                Annotation(description=f"Raw images for tilt series name: TS_{n}")
+            ],
+        )
+        regions.append(Region(tomo_imaging=[TomoImageSet(raw_movies=movies)]))
+    return DataSet(name="[dataset] {1}", regions=regions)
+
+
+class BuildIndexTest(unittest.TestCase):
+    def test_offsets(self):
+        data = b'{"a": [{"b": "}]"}, {"c/d": {"e": [1, [2]]}}], "f": {}}'
+        index = build_index(data)
+        assert list(index) == ["/a/0", "/a/1/c~1d", "/a/1", "/f", ""]
+        for pointer, (start, end) in index.items():
+            assert json.loads(data[start:end]) is not None
+        start, end = index["/a/1/c~1d"]
+        assert data[start:end] == b'{"e": [1, [2]]}'
+
+    def test_max_depth(self):
+        data = json.dumps({"a": [{"b": [{"c": [{}]}]}]}).encode()
+        assert list(build_index(data, max_depth=1)) == ["/a/0", ""]
+        assert "/a/0/b/0/c/0" in build_index(data, max_depth=3)
+
+    def test_mixed_list(self):
+        # the objects in a list can only be numbered if everything in it is an object
+        data = b'{"a": [{"x": 1}, 2, {"y": 3}]}'
+        assert list(build_index(data)) == ["/a/0", ""]
+
+    def test_incomplete(self):
+        with self.assertRaises(ValueError):
+            build_index(b'{"a": [{"b": 1}]')
+        with self.assertRaises(ValueError):
+            build_index(b'{"a": 1}}')
+
+
+class IndexedJsonFileTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.json_file = Path(self._tmpdir.name) / "dataset.json"
+        self.dataset = make_dataset()
+
+    def test_load_parts(self):
+        write_json(self.json_file, self.dataset, stream=True)
+        indexed = IndexedJsonFile(self.json_file, model=DataSet)
+        assert indexed.paths("/regions/*") == ["/regions/0", "/regions/1", "/regions/2"]
+        region = indexed.load("/regions/1")
+        assert isinstance(region, Region)
+        assert dump_json(region) == dump_json(self.dataset.regions[1])
+        movies = indexed.load("/regions/2/tomo_imaging/0/raw_movies")
+        assert isinstance(movies, MovieStackSet)
+        stacks = indexed.paths("/regions/2/tomo_imaging/0/raw_movies/movie_stacks/*")
+        assert isinstance(indexed.load(stacks[0]), MovieStack)
+        assert isinstance(indexed.load(stacks[1]), CompactMovieStack)
+        annotation = indexed.load(stacks[0].rsplit("/", 2)[0] + "/annotations/0")
+        assert annotation.description.endswith("TS_2")
+        # the frames are inside a fourth list
+        assert not indexed.paths(stacks[0] + "/frame_images/*")
+        assert indexed.load("").name == "[dataset] {1}"
+
+    def test_load_movie_set(self):
+        movies = self.dataset.regions[0].tomo_imaging[0].raw_movies
+        write_json(self.json_file, movies, compact=True)
+        indexed = IndexedJsonFile(self.json_file, model=MovieStackSet)
+        frame = indexed.load("/movie_stacks/0/frame_images/1")
+        assert dump_json(frame) == dump_json(movies.movie_stacks[0].frame_images[1])
+        data = indexed.load_data("/annotations/0")
+        assert data["description"] == "Raw images for tilt series name: TS_0"
+
+    def test_model_class(self):
+        # a region with particles can only be validated as the particle set type
+        region = self.dataset.regions[0]
+        region.add_annotation(CompactParticleCoordinatesSet(coords=[[1.0, 2.0, 3.0]]))
+        write_json(self.json_file, region)
+        indexed = IndexedJsonFile(self.json_file)
+        particles = indexed.load("/annotations/0", CompactParticleCoordinatesSet)
+        assert particles.coords.tolist() == [[1.0, 2.0, 3.0]]
+
+    def test_index_file(self):
+        write_json(self.json_file, self.dataset)
+        indexed = IndexedJsonFile(self.json_file)
+        assert indexed.index_built
+        assert get_index_path(self.json_file).exists()
+        reopened = IndexedJsonFile(self.json_file)
+        assert not reopened.index_built
+        assert reopened.index == indexed.index
+        assert IndexedJsonFile(self.json_file, rebuild=True).index_built
+        assert IndexedJsonFile(self.json_file, max_depth=1).index_built
+
+        # the index is rebuilt if the file changes
+        self.dataset.regions.pop()
+        write_json(self.json_file, self.dataset)
+        reopened = IndexedJsonFile(self.json_file)
+        assert reopened.index_built
+        assert len(reopened.paths("/regions/*")) == 2
+
+    def test_index_file_not_writable(self):
+        write_json(self.json_file, self.dataset)
+        os.mkdir(get_index_path(self.json_file))
+        with self.assertLogs("src.tomobabel.json_index", level="WARNING"):
+            indexed = IndexedJsonFile(self.json_file, model=DataSet)
+        assert "/regions/2" in indexed
+
+    def test_sidecar_and_deduplicated(self):
+        expected = dump_json(self.dataset.regions[1])
+        write_json(self.json_file, self.dataset, array_sidecar=True)
+        indexed = IndexedJsonFile(self.json_file, model=DataSet)
+        assert dump_json(indexed.load("/regions/1")) == expected
+
+        write_json(self.json_file, dump_deduplicated(self.dataset))
+        indexed = IndexedJsonFile(self.json_file, model=DataSet)
+        assert "/$defs" in indexed
+        assert dump_json(indexed.load("/regions/1")) == expected
+
+    def test_errors(self):
+        write_json(self.json_file, self.dataset)
+        indexed = IndexedJsonFile(self.json_file)
+        with self.assertRaisesRegex(ValueError, "model_class"):
+            indexed.load("/regions/0")
+        assert isinstance(indexed.load("/regions/0", Region), Region)
+        with self.assertRaises(KeyError):
+            indexed.read_bytes("/regions/9")
+        indexed.model = DataSet
+        with self.assertRaisesRegex(ValueError, "not a location"):
+            indexed.load("/regions/0/tomo_imaging/0/raw_movies/annotations/0/x")
+
+
+if __name__ == "__main__":
+    unittest.main()
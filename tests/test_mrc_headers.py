@@ -0,0 +1,215 @@
+import unittest
+import warnings
+from pathlib import Path
+
+import mrcfile
+import numpy as np
+
+from unittest.mock import patch
+
+from src.tomobabel.mrc_headers import (
+    HeaderCache,
+    MalformedMrcHeaderError,
+    MrcHeader,
+    parse_mrc_header,
+    read_mrc_header,
+)
+from src.tomobabel.profiling import ConversionProfiler
+from src.tomobabel.utils import get_mrc_dims, map_concurrently, probe_mrc_headers
+from tests.testing_tools import TomoBabelTest
+
+
+def write_test_mrc(
+    path: str,
+    shape=(3, 20, 30),
+    dtype=np.float32,
+    voxel_size=(1.5, 1.5, 2.0),
+    origin=(10.0, 20.0, 30.0),
+    big_endian: bool = False,
+) -> Path:
+    """Write a small MRC file, optionally with big endian byte order"""
+    data = np.zeros(shape, dtype=dtype)
+    if big_endian:
+        data = data.astype(data.dtype.newbyteorder(">"))
+    with mrcfile.new(path, overwrite=True) as mrc:
+        mrc.set_data(data)
+        mrc.voxel_size = voxel_size
+        mrc.header.origin = origin
+    return Path(path)
+
+
+class MrcHeaderTest(TomoBabelTest):
+    def test_read_header_little_endian(self):
+        mrc = write_test_mrc("test.mrc")
+        assert read_mrc_header(mrc) == MrcHeader(
+            nx=30,
+            ny=20,
+            nz=3,
+            mode=2,
+            voxel_size=(1.5, 1.5, 2.0),
+            origin=(10.0, 20.0, 30.0),
+            extended_header_size=0,
+        )
+
+    def test_read_header_big_endian(self):
+        mrc = write_test_mrc("test_be.mrc", dtype=np.int16, big_endian=True)
+        with open(mrc, "rb") as f:
+            assert f.read(1024)[212] == 0x11
+        hdr = read_mrc_header(mrc)
+        assert hdr.dims == (30, 20, 3)
+        assert hdr.mode == 1
+        assert hdr.voxel_size == (1.5, 1.5, 2.0)
+        assert hdr.origin == (10.0, 20.0, 30.0)
+
+    def test_read_header_matches_mrcfile(self):
+        mrc = write_test_mrc("test.mrc", shape=(7, 64, 48), dtype=np.uint8)
+        hdr = read_mrc_header(mrc)
+        with mrcfile.open(mrc) as m:
+            assert hdr.dims == (m.header.nx, m.header.ny, m.header.nz)
+            assert hdr.mode == m.header.mode
+
+    def test_read_header_with_extended_header(self):
+        with mrcfile.new("ext.mrc") as mrc:
+            mrc.set_data(np.zeros((2, 4, 4), dtype=np.float32))
+            mrc.set_extended_header(np.zeros(256, dtype=np.uint8))
+        assert read_mrc_header(Path("ext.mrc")).extended_header_size == 256
+
+    def test_wrong_machine_stamp_falls_back_to_other_byte_order(self):
+        mrc = write_test_mrc("test.mrc")
+        with open(mrc, "r+b") as f:
+            f.seek(212)
+            f.write(b"\x11\x11\x00\x00")
+        assert read_mrc_header(mrc).dims == (30, 20, 3)
+
+    def test_parse_short_header_raises(self):
+        with self.assertRaises(MalformedMrcHeaderError):
+            parse_mrc_header(b"\x00" * 100)
+
+    def test_parse_nonsense_header_raises(self):
+        with self.assertRaises(MalformedMrcHeaderError):
+            parse_mrc_header(b"\xff" * 1024)
+
+    def test_malformed_header_falls_back_to_mrcfile(self):
+        mrc = write_test_mrc("test.mrc")
+        # an invalid mode that mrcfile's permissive mode will still read
+        with open(mrc, "r+b") as f:
+            f.seek(12)
+            f.write(np.int32(99).tobytes())
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            hdr = read_mrc_header(mrc)
+        assert hdr.dims == (30, 20, 3)
+        assert hdr.mode == 99
+
+    def test_get_mrc_dims(self):
+        mrc = write_test_mrc("test.mrc")
+        assert get_mrc_dims(mrc) == (30, 20, 3)
+
+    def test_get_mrc_dims_no_file(self):
+        assert get_mrc_dims(Path("not_a_file.mrc")) == (None, None, None)
+        assert get_mrc_dims(None) == (None, None, None)
+
+    def test_probe_mrc_headers(self):
+        files = [
+            write_test_mrc(f"test{n}.mrc", shape=(n + 1, 20, 30)) for n in range(3)
+        ]
+        profiler = ConversionProfiler()
+        headers = probe_mrc_headers(
+            files + [Path("not_a_file.mrc")], max_workers=4, profiler=profiler
+        )
+        assert [x.nz for x in headers[:3]] == [1, 2, 3]
+        assert headers[3] is None
+        assert profiler.counters == {
+            "headers_probed": 4,
+            "header_reads": 3,
+            "header_bytes_read": 3 * 1024,
+        }
+
+
+class HeaderCacheTest(TomoBabelTest):
+    def test_cache_miss_then_hit(self):
+        mrc = write_test_mrc("test.mrc")
+        with HeaderCache(path="cache.sqlite") as cache:
+            hdr = cache.read_header(mrc)
+            assert (cache.hits, cache.misses) == (0, 1)
+            with patch("src.tomobabel.mrc_headers.read_mrc_header") as mock_read:
+                assert cache.read_header(mrc) == hdr
+            mock_read.assert_not_called()
+            assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_cache_persists_between_instances(self):
+        mrc = write_test_mrc("test.mrc")
+        with HeaderCache(path="cache.sqlite") as cache:
+            hdr = cache.read_header(mrc)
+        with HeaderCache(path="cache.sqlite") as cache:
+            assert len(cache) == 1
+            assert cache.get(mrc) == hdr
+            assert cache.get(Path(mrc).absolute()) == hdr
+
+    def test_changed_file_is_reread(self):
+        mrc = write_test_mrc("test.mrc")
+        with HeaderCache(path="cache.sqlite") as cache:
+            cache.read_header(mrc)
+            write_test_mrc("test.mrc", shape=(5, 20, 30))
+            assert cache.get(mrc) is None
+            assert cache.read_header(mrc).nz == 5
+            assert cache.misses == 2
+            assert len(cache) == 1
+
+    def test_eviction_removes_least_recently_used(self):
+        files = [write_test_mrc(f"test_{n}.mrc") for n in range(10)]
+        with HeaderCache(path=":memory:", max_entries=5) as cache:
+            for f in files[:5]:
+                cache.read_header(f)
+            # use the first one again so it is not the oldest
+            cache.read_header(files[0])
+            cache.read_header(files[5])
+            assert len(cache) <= 5
+            assert cache.get(files[0]) is not None
+            assert cache.get(files[1]) is None
+            assert cache.get(files[5]) is not None
+
+    def test_table_only_counted_when_over_limit(self):
+        files = [write_test_mrc(f"test_{n}.mrc") for n in range(6)]
+        with HeaderCache(path="cache.sqlite", max_entries=5) as cache:
+            with patch.object(cache, "_evict", wraps=cache._evict) as evict:
+                for f in files[:5]:
+                    cache.read_header(f)
+                evict.assert_not_called()
+                # replacing an entry is counted as an insert until the table is
+                # counted again
+                cache.put(files[0], cache.get(files[0]))
+                assert evict.call_count == 1
+                assert len(cache) == 5
+                cache.read_header(files[5])
+                assert evict.call_count == 2
+            assert len(cache) == 4
+        with HeaderCache(path="cache.sqlite", max_entries=5) as cache:
+            assert cache._n_entries == 4
+
+    def test_hits_and_misses_counted_across_threads(self):
+        files = [write_test_mrc(f"test_{n}.mrc") for n in range(4)]
+        with HeaderCache(path=":memory:") as cache:
+            map_concurrently(cache.read_header, files * 50, 8)
+            assert cache.hits + cache.misses == 200
+            assert cache.misses >= 4
+
+    def test_missing_file(self):
+        with HeaderCache(path=":memory:") as cache:
+            with self.assertRaises(FileNotFoundError):
+                cache.read_header("not_a_file.mrc")
+            assert get_mrc_dims(Path("bad.mrc"), header_cache=cache) == (
+                None,
+                None,
+                None,
+            )
+
+    def test_default_cache_location(self):
+        with patch.dict("os.environ", {"TOMOBABEL_CACHE_DIR": "my_cache"}):
+            with HeaderCache() as cache:
+                assert cache.path == Path("my_cache/mrc_headers.sqlite")
+            assert cache.path.is_file()
+
+
+if __name__ == "__main__":
+    unittest.main()
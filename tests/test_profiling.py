@@ -0,0 +1,84 @@
+import json
+import unittest
+from pathlib import Path
+
+from src.tomobabel.models.tomo_images import CTFMetadata, MovieFrame, MovieStack
+from src.tomobabel.profiling import ConversionProfiler, count_objects
+from tests.testing_tools import TomoBabelTest
+
+
+class ConversionProfilerTest(TomoBabelTest):
+    def test_stages_and_counters(self):
+        profiler = ConversionProfiler()
+        for _ in range(3):
+            with profiler.stage("parse"):
+                pass
+        with profiler.stage("write"):
+            profiler.count("bytes", 10)
+            profiler.count("bytes", 5)
+        assert profiler.stages["parse"]["calls"] == 3
+        assert profiler.stages["write"]["calls"] == 1
+        assert profiler.stages["parse"]["seconds"] >= 0.0
+        assert profiler.counters == {"bytes": 15}
+
+    def test_stage_recorded_when_it_raises(self):
+        profiler = ConversionProfiler()
+        with self.assertRaises(ValueError):
+            with profiler.stage("parse"):
+                raise ValueError("bad")
+        assert profiler.stages["parse"]["calls"] == 1
+
+    def test_disabled_records_nothing(self):
+        profiler = ConversionProfiler(enabled=False)
+        with profiler.stage("parse"):
+            profiler.count("bytes", 10)
+        profiler.record_tilt_series("TS_01", seconds=1.0)
+        profiler.merge(ConversionProfiler().to_dict())
+        assert profiler.stages == {}
+        assert profiler.counters == {}
+        assert profiler.tilt_series == {}
+
+    def test_merge(self):
+        main = ConversionProfiler()
+        main.add_time("parse", 1.0)
+        main.count("bytes", 1)
+        worker = ConversionProfiler()
+        worker.add_time("parse", 2.0, calls=2)
+        worker.add_time("build", 0.5)
+        worker.count("bytes", 2)
+        worker.record_tilt_series("TS_01", frames=8)
+        main.merge(worker.to_dict())
+        assert main.stages == {
+            "parse": {"seconds": 3.0, "calls": 3},
+            "build": {"seconds": 0.5, "calls": 1},
+        }
+        assert main.counters == {"bytes": 3}
+        assert main.tilt_series == {"TS_01": {"frames": 8}}
+
+    def test_write_report(self):
+        profiler = ConversionProfiler()
+        profiler.add_time("fast", 0.1)
+        profiler.add_time("slow", 1.0)
+        profiler.write("reports/report.json")
+        with open(Path("reports/report.json")) as f:
+            report = json.load(f)
+        assert list(report["stages"]) == ["slow", "fast"]
+        assert report["versions"]["pydantic"]
+        assert report["total_seconds"] >= 0.0
+
+    def test_count_objects_counts_shared_objects_once(self):
+        ctf = CTFMetadata(defocus_u=1.0)
+        frames = [
+            MovieFrame(path="a.mrc", section=n, ctf_metadata=ctf) for n in range(3)
+        ]
+        stack = MovieStack(path="a.mrc", frame_images=frames)
+        assert count_objects(stack) == {
+            "CTFMetadata": 1,
+            "MovieFrame": 3,
+            "MovieStack": 1,
+        }
+        assert count_objects(stack, frames[0])["MovieFrame"] == 3
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,243 @@
+import io
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+
+from src.tomobabel import serialization
+from src.tomobabel.interning import dump_deduplicated
+from src.tomobabel.models.annotation import CompactParticleCoordinatesSet
+from src.tomobabel.models.basemodels import Annotation
+from src.tomobabel.models.tomo_images import (
+    CompactMovieStack,
+    CTFMetadata,
+    MovieFrame,
+    MovieStack,
+    MovieStackSet,
+)
+from src.tomobabel.models.top_level import DataSet, Region, TomoImageSet
+from src.tomobabel.models.transformations import Transformation
+from src.tomobabel.profiling import ConversionProfiler
+from src.tomobabel.serialization import (
+    ArraySidecar,
+    JsonStreamWriter,
+    dump_json,
+    get_sidecar_path,
+    load_json,
+    read_sidecar,
+    write_json,
+)
+from src.tomobabel.utils import NumpyEncoder
+
+
+def make_stack(defocus_v: float = float("nan")) -> MovieStack:
+    ctf = CTFMetadata(defocus_u=1.0, defocus_v=defocus_v)
+    xform = Transformation(trans_matrix=np.identity(4) * 0.1)
+    frames = [
+        MovieFrame(
+            path="movie.mrc",
+            section=n,
+            ctf_metadata=ctf,
+            motion_correction_transformations=[xform],
+            annotations=[Annotation(description="Å")],
+        )
+        for n in range(3)
+    ]
+    return MovieStack(frame_images=frames)
+
+
+class DumpJsonTest(unittest.TestCase):
+    def test_same_as_model_dump_and_json(self):
+        stack = make_stack()
+        expected = json.dumps(stack.model_dump(), indent=4, cls=NumpyEncoder)
+        # the json module escapes non-ASCII characters, pydantic writes them as UTF-8
+        assert dump_json(stack).decode() == expected.replace("\\u00c5", "Å")
+
+    def test_float_format_differs_from_json(self):
+        ctf = CTFMetadata(defocus_u=1e-05, defocus_v=2.5e-07)
+        expected = json.dumps(ctf.model_dump(), indent=4)
+        written = dump_json(ctf).decode()
+        assert written != expected
+        assert "0.00001" in written and "2.5e-7" in written
+        assert json.loads(written) == json.loads(expected)
+        assert dump_json(ctf, backend="json").decode() == expected
+
+    def test_deduplicated_data(self):
+        data = dump_deduplicated(make_stack())
+        expected = json.dumps(data, indent=4, cls=NumpyEncoder)
+        assert dump_json(data).decode() == expected.replace("\\u00c5", "Å")
+
+    def test_compact(self):
+        stack = make_stack()
+        compact = dump_json(stack, compact=True)
+        assert b" " not in compact.replace(b"movie.mrc", b"")
+        assert len(compact) < len(dump_json(stack)) / 2
+        assert json.loads(compact)["frame_images"][2]["section"] == 2
+
+    def test_arrays_read_back(self):
+        xform = Transformation(trans_matrix=np.arange(16.0).reshape(4, 4))
+        loaded = Transformation.model_validate_json(dump_json(xform))
+        assert isinstance(loaded.trans_matrix, np.ndarray)
+        assert np.array_equal(loaded.trans_matrix, xform.trans_matrix)
+        particles = CompactParticleCoordinatesSet(
+            coords=[[1.0, 2.0, 3.0]], foms=[0.5], rotations=[np.identity(3)]
+        )
+        loaded = CompactParticleCoordinatesSet.model_validate_json(
+            dump_json(particles, compact=True)
+        )
+        assert loaded.rotations.shape == (1, 3, 3)
+
+    def test_annotation_subclasses_written(self):
+        region = Region()
+        region.add_annotation(CompactParticleCoordinatesSet(coords=[[1.0, 2.0, 3.0]]))
+        written = json.loads(dump_json(region))["annotations"][0]
+        assert written["coords"] == [[1.0, 2.0, 3.0]]
+
+    def test_json_backend(self):
+        stack = make_stack(defocus_v=2.0)
+        assert json.loads(dump_json(stack, backend="json")) == json.loads(
+            dump_json(stack)
+        )
+        assert b"\n" not in dump_json(stack, compact=True, backend="json")
+
+    @unittest.skipIf(serialization.orjson is None, "orjson is not installed")
+    def test_orjson_backend(self):
+        # orjson writes NaN as null
+        stack = make_stack(defocus_v=2.0)
+        expected = json.loads(dump_json(stack))
+        assert json.loads(dump_json(stack, backend="orjson")) == expected
+        compact = dump_json(stack, compact=True, backend="orjson")
+        assert json.loads(compact) == expected
+
+    def test_orjson_not_installed(self):
+        with patch.object(serialization, "orjson", None):
+            with self.assertRaisesRegex(ImportError, "orjson"):
+                dump_json(make_stack(), backend="orjson")
+
+    def test_unknown_backend(self):
+        with self.assertRaisesRegex(ValueError, "simplejson"):
+            dump_json(make_stack(), backend="simplejson")
+
+    def test_write_json(self):
+        profiler = ConversionProfiler()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            outfile = Path(tmpdir) / "stack.json"
+            size = write_json(outfile, make_stack(), compact=True, profiler=profiler)
+            assert outfile.stat().st_size == size
+        assert profiler.counters["output_bytes_written"] == size
+        assert "serialize" in profiler.stages and "write_json" in profiler.stages
+
+
+class ArraySidecarTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.outfile = Path(self._tmpdir.name) / "stack.json"
+
+    def test_arrays_stacked_by_shape(self):
+        sidecar = ArraySidecar()
+        shared = np.identity(4)
+        refs = [sidecar.add(x) for x in (shared, np.zeros((4, 4)), shared)]
+        assert refs[0] == {"$array": "float64_4x4", "index": 0}
+        assert refs[1] == {"$array": "float64_4x4", "index": 1}
+        assert refs[2] is refs[0]
+        assert sidecar.add(np.arange(3)) == {"$array": "int64_3", "index": 0}
+        assert sidecar.add(np.array(["a"])) == ["a"]
+        assert len(sidecar) == 3
+
+    def test_write_and_load(self):
+        stack = make_stack(defocus_v=2.0)
+        size = write_json(self.outfile, stack, array_sidecar=True)
+        sidecar_file = get_sidecar_path(self.outfile)
+        assert sidecar_file == self.outfile.with_suffix(".npz")
+        assert size == self.outfile.stat().st_size + sidecar_file.stat().st_size
+        written = json.loads(self.outfile.read_text())
+        xform = written["frame_images"][0]["motion_correction_transformations"][0]
+        assert xform["trans_matrix"] == {"$array": "float64_4x4", "index": 0}
+        # the transformation shared by the frames is only stored once
+        assert read_sidecar(sidecar_file)["float64_4x4"].shape == (1, 4, 4)
+
+        data = load_json(self.outfile)
+        matrix = data["frame_images"][2]["motion_correction_transformations"][0]
+        assert isinstance(matrix["trans_matrix"], np.memmap)
+        loaded = MovieStack.model_validate(data)
+        assert dump_json(loaded) == dump_json(stack)
+
+    def test_load_without_mmap(self):
+        particles = CompactParticleCoordinatesSet(
+            coords=np.arange(30.0).reshape(10, 3), foms=np.ones(10)
+        )
+        write_json(self.outfile, particles, compact=True, array_sidecar=True)
+        data = load_json(self.outfile, mmap=False)
+        assert not isinstance(data["coords"], np.memmap)
+        loaded = CompactParticleCoordinatesSet.model_validate(data)
+        assert np.array_equal(loaded.coords, particles.coords)
+
+    def test_compressed_sidecar(self):
+        write_json(self.outfile, make_stack(), array_sidecar=True)
+        sidecar_file = get_sidecar_path(self.outfile)
+        arrays = read_sidecar(sidecar_file, mmap=False)
+        np.savez_compressed(sidecar_file, **arrays)
+        reread = read_sidecar(sidecar_file)
+        assert np.array_equal(reread["float64_4x4"], arrays["float64_4x4"])
+
+    def test_deduplicated_data_and_backends(self):
+        stack = make_stack(defocus_v=2.0)
+        backends = ["pydantic", "json"]
+        if serialization.orjson is not None:
+            backends.append("orjson")
+        for backend in backends:
+            for data in (stack, dump_deduplicated(stack)):
+                write_json(self.outfile, data, backend=backend, array_sidecar=True)
+                assert b"0.1" not in self.outfile.read_bytes()
+                loaded = load_json(self.outfile)
+                expected = json.loads(dump_json(data))
+                assert json.loads(dump_json(loaded)) == expected
+
+
+class JsonStreamWriterTest(unittest.TestCase):
+    def make_dataset(self) -> DataSet:
+        stack = make_stack()
+        stack.frame_images[0].path = "line\nbreak"
+        compact = CompactMovieStack(
+            sections=np.array([0, 1]), accumulated_doses=np.array([1.0, 2.0])
+        )
+        movies = MovieStackSet(movie_stacks=[stack, compact])
+        region = Region(tomo_imaging=[TomoImageSet(raw_movies=movies)])
+        particles = CompactParticleCoordinatesSet(coords=np.array([[1.0, 2.0, 3.0]]))
+        region.add_annotation(particles)
+        return DataSet(regions=[region, Region()])
+
+    def test_same_as_dump_json(self):
+        dataset = self.make_dataset()
+        for compact in (False, True):
+            expected = dump_json(dataset, compact)
+            for list_depth in (0, 1, 3, 10):
+                f = io.BytesIO()
+                writer = JsonStreamWriter(f, compact, list_depth=list_depth)
+                assert writer.write(dataset) == len(expected)
+                assert f.getvalue() == expected
+
+    def test_with_sidecar(self):
+        dataset = self.make_dataset()
+        f = io.BytesIO()
+        sidecar = ArraySidecar()
+        JsonStreamWriter(f, sidecar=sidecar).write(dataset)
+        assert f.getvalue() == dump_json(dataset, sidecar=ArraySidecar())
+        assert len(sidecar) == 4
+
+    def test_write_json_stream(self):
+        dataset = self.make_dataset()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            outfile = Path(tmpdir) / "dataset.json"
+            write_json(outfile, dataset, stream=True)
+            assert outfile.read_bytes() == dump_json(dataset)
+            with self.assertRaises(ValueError):
+                write_json(outfile, dataset, backend="json", stream=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from pathlib import Path
+
+from benchmarks.bench_conversion import run_conversion
+from benchmarks.synthetic_project import (
+    STAGE_COLUMNS,
+    dose_symmetric_tilts,
+    write_project,
+)
+from src.tomobabel.converters.relion.relion_convert_tilt_series import (
+    PipelinerTiltSeriesGroupConverter,
+)
+from src.tomobabel.converters.relion.relion_starfiles import TiltSeriesTable
+from src.tomobabel.mrc_headers import read_mrc_header
+from tests.testing_tools import TomoBabelTest
+
+
+class SyntheticProjectTest(TomoBabelTest):
+    def test_dose_symmetric_tilts(self):
+        assert dose_symmetric_tilts(6).tolist() == [0, 3, -3, -6, 6, 9]
+
+    def test_project_columns_for_each_stage(self):
+        expected = []
+        for stage in STAGE_COLUMNS:
+            expected += STAGE_COLUMNS[stage]
+            starfile = write_project(
+                Path(stage), n_tilt_series=1, n_tilts=3, last_stage=stage
+            )
+            converter = PipelinerTiltSeriesGroupConverter(Path(stage) / starfile)
+            converter.get_tilt_series_files()
+            ts_file = Path(stage) / converter.ts_files["TS_001"]
+            table = TiltSeriesTable.from_block(
+                converter.star_cache.find_block(ts_file, "TS_001")
+            )
+            assert list(table) == expected
+
+    def test_project_converts(self):
+        starfile = write_project(
+            Path("."), n_tilt_series=3, n_tilts=5, n_frames=4, last_stage="CtfFind"
+        )
+        header = read_mrc_header(Path("frames/TS_002_004_6.0.mrc"))
+        assert header.dims == (4096, 4096, 4)
+        assert round(header.voxel_size[0], 6) == 0.675
+
+        converter = PipelinerTiltSeriesGroupConverter(starfile)
+        converter.do_conversion()
+        assert list(converter.all_movie_sets) == ["TS_001", "TS_002", "TS_003"]
+        movies = converter.all_movie_sets["TS_002"].movie_stacks
+        assert len(movies) == 5
+        assert len(movies[0].frame_images) == 4
+        assert movies[0].frame_images[0].width == 4096
+        assert movies[0].frame_images[0].ctf_metadata is not None
+
+    def test_run_conversion(self):
+        project = Path("project").resolve()
+        starfile = write_project(project, n_tilt_series=2, n_tilts=3)
+        for target in ("tilt_series", "dataset"):
+            result = run_conversion(target, project, starfile, [])
+            assert result["output_bytes"] > 0
+            assert result["peak_rss_mb"] >= result["base_rss_mb"] > 0
+            assert not list(project.glob("bench_out_*"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import json
+import threading
+import time
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from src.tomobabel.models.annotation import AnnotationType
+from src.tomobabel.utils import NumpyEncoder, clean_dict, map_concurrently
+from tests.testing_tools import TomoBabelTest
+
+
+class UtilsTest(TomoBabelTest):
+    def test_map_concurrently_keeps_order(self):
+        def slow_square(x):
+            # later items finish first
+            time.sleep(0.001 * (10 - x))
+            return x * x
+
+        assert map_concurrently(slow_square, list(range(10)), 4) == [
+            x * x for x in range(10)
+        ]
+
+    def test_map_concurrently_uses_threads(self):
+        threads = set()
+
+        def record_thread(x):
+            threads.add(threading.get_ident())
+            time.sleep(0.01)
+            return x
+
+        map_concurrently(record_thread, list(range(8)), 4)
+        assert 1 < len(threads) <= 4
+
+    def test_map_concurrently_serial(self):
+        threads = set()
+
+        def record_thread(x):
+            threads.add(threading.get_ident())
+            return x
+
+        assert map_concurrently(record_thread, [1, 2, 3], 1) == [1, 2, 3]
+        assert threads == {threading.get_ident()}
+
+    def test_map_concurrently_raises_errors(self):
+        def bad(x):
+            raise ValueError(x)
+
+        with self.assertRaises(ValueError):
+            map_concurrently(bad, [1, 2, 3], 2)
+
+    def test_clean_dict_same_as_json_round_trip(self):
+        data = {
+            "matrix": np.arange(6.0).reshape(2, 3),
+            "tuple": (1, (2.5, "a")),
+            "nested": [{"x": [None, True]}, np.arange(2)],
+            "nan": float("nan"),
+            1: "int key",
+            2.5: "float key",
+            None: "None key",
+        }
+        expected = json.dumps(json.loads(json.dumps(data, cls=NumpyEncoder)))
+        assert json.dumps(clean_dict(data)) == expected
+        assert isinstance(data["matrix"], np.ndarray)
+        assert json.dumps(clean_dict(data, in_place=True)) == expected
+        assert data["matrix"] == [[0.0, 1.0, 2.0], [3.0, 4.0, 5.0]]
+
+    def test_clean_dict_numpy_scalars_and_enums(self):
+        data = {
+            "float": np.float32(1.5),
+            "int": np.int64(3),
+            "bool": np.bool_(True),
+            "enum": AnnotationType.particle,
+            "objects": np.array([{"a": np.int32(1)}], dtype=object),
+            AnnotationType.point: 1,
+        }
+        cleaned = clean_dict(data)
+        assert cleaned == {
+            "float": 1.5,
+            "int": 3,
+            "bool": True,
+            "enum": "particle_coodinate",
+            "objects": [{"a": 1}],
+            "point": 1,
+        }
+        assert type(cleaned["int"]) is int and type(cleaned["enum"]) is str
+        assert type(cleaned["bool"]) is bool
+
+    def test_clean_dict_copy(self):
+        data = {"a": [{"b": 1}], "c": {"d": [2]}}
+        cleaned = clean_dict(data)
+        assert cleaned == data
+        assert cleaned["a"] is not data["a"] and cleaned["c"] is not data["c"]
+        assert clean_dict(data, in_place=True)["a"] is data["a"]
+
+    def test_clean_dict_not_json(self):
+        with self.assertRaisesRegex(TypeError, "Path"):
+            clean_dict({"path": Path("/tmp")})
+        with self.assertRaises(TypeError):
+            clean_dict({(1, 2): "tuple key"})
+
+
+if __name__ == "__main__":
+    unittest.main()